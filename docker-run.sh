@@ -21,7 +21,7 @@ if [ "$1" == "shell" ]; then
 fi
 
 if [ "$1" == "worker" ]; then
-    exec /ve/bin/python manage.py celery worker
+    exec /ve/bin/python manage.py send_queued_email --loop
 fi
 
 if [ "$1" == "beat" ]; then
@@ -42,3 +42,13 @@ if [ "$1" == "run" ]; then
          -t 600 \
          --access-logfile=- --error-logfile=-
 fi
+
+# Serves over ASGI, so that async views run on each worker's event loop
+if [ "$1" == "run-asgi" ]; then
+    exec /ve/bin/gunicorn --env \
+         DJANGO_SETTINGS_MODULE=$DJANGO_SETTINGS_MODULE \
+         $APP.asgi:application -b 0.0.0.0:8000 -w 3 \
+         -k uvicorn_worker.UvicornWorker \
+         -t 600 \
+         --access-logfile=- --error-logfile=-
+fi
@@ -0,0 +1,7 @@
+import os
+from django.core.asgi import get_asgi_application
+os.environ.setdefault(
+    "DJANGO_SETTINGS_MODULE",
+    "locustempus.settings")
+
+application = get_asgi_application()
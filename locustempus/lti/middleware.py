@@ -0,0 +1,45 @@
+from asgiref.sync import (
+    iscoroutinefunction, markcoroutinefunction, sync_to_async
+)
+from lti_tool.constants import SESSION_KEY
+from lti_tool.middleware import (
+    LtiLaunchMiddleware as BaseLtiLaunchMiddleware
+)
+from lti_tool.models import AbsentLtiLaunch
+from lti_tool.utils import get_launch_from_request
+from pylti1p3.exception import LtiException
+
+
+class LtiLaunchMiddleware(BaseLtiLaunchMiddleware):
+    """
+    lti_tool's LtiLaunchMiddleware, able to run in an async middleware
+    chain. Under ASGI, a sync-only middleware makes Django hand every
+    request below it to a thread, async views included. The launch is
+    still looked up in a thread, since that reads the session and cache.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response) -> None:
+        super().__init__(get_response)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        self.set_launch(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        await sync_to_async(self.set_launch)(request)
+        return await self.get_response(request)
+
+    @staticmethod
+    def set_launch(request) -> None:
+        launch_id = request.session.get(SESSION_KEY)
+        try:
+            request.lti_launch = get_launch_from_request(request, launch_id)
+        except LtiException:
+            request.lti_launch = AbsentLtiLaunch()
@@ -1,6 +1,8 @@
 from django.contrib import admin
 from django.contrib.contenttypes.admin import GenericTabularInline
-from locustempus.main.models import RasterLayer, Project, Response
+from locustempus.main.models import (
+    QueuedEmail, RasterLayer, Project, Response
+)
 
 
 class RasterLayerInline(GenericTabularInline):
@@ -19,6 +21,16 @@ class ResponseAdmin(admin.ModelAdmin):
     ]
 
 
+class QueuedEmailAdmin(admin.ModelAdmin):
+    list_display = (
+        'recipient', 'subject', 'course', 'status', 'attempts',
+        'created_at', 'sent_at'
+    )
+    list_filter = ('status',)
+    search_fields = ('recipient',)
+
+
 admin.site.register(Project, ProjectAdmin)
 admin.site.register(Response, ResponseAdmin)
 admin.site.register(RasterLayer)
+admin.site.register(QueuedEmail, QueuedEmailAdmin)
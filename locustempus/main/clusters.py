@@ -0,0 +1,179 @@
+"""
+Clusters events' locations for a zoom level
+
+Locations are snapped to a grid of CLUSTER_CELLS cells across each map
+tile, in Web Mercator, and each cell with events in it becomes a cluster
+with the events' count, centroid and bounds, and a few of their pks. On
+PostGIS the grid is computed in the database with ST_SnapToGrid. Other
+spatial backends, such as the SpatiaLite database used by the tests,
+hash locations to grid cells in Python.
+
+Clusters are cached by the query and zoom, and the events' latest
+modified_at and count, so they're only computed again after an edit.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.db.models import Count, FloatField, Func, Max
+from locustempus.main.models import Location
+from locustempus.main.tiles import MAX_LATITUDE, MVT_EXTENT, tile_coords
+
+from typing import Any, Dict, List
+
+
+# 64 pixel cells on 256 pixel tiles
+CLUSTER_CELLS = 4
+# The number of event pks included with each cluster
+CLUSTER_SAMPLE = 5
+# Half the width of the Web Mercator world, in meters
+MERCATOR_HALF_WIDTH = 20037508.342789244
+
+
+def grid_cell(lng: float, lat: float, zoom: int):
+    cells = 2 ** zoom * CLUSTER_CELLS
+    px, py = tile_coords(lng, lat, zoom, 0, 0)
+    size = MVT_EXTENT // CLUSTER_CELLS
+    return (min(max(px // size, 0), cells - 1),
+            min(max(py // size, 0), cells - 1))
+
+
+def python_clusters(events, zoom: int) -> List[Dict[str, Any]]:
+    cells: Dict[Any, Dict[str, Any]] = {}
+    # Points are read as numbers, which is much faster than reading them
+    # as GEOS geometries
+    locations = Location.objects.filter(
+        event__in=events
+    ).values_list(
+        'event_id',
+        Func('point', function='ST_X', output_field=FloatField()),
+        Func('point', function='ST_Y', output_field=FloatField()),
+        'polygon'
+    ).order_by('event_id')
+
+    for event_id, x, y, polygon in locations.iterator():
+        if x is not None:
+            west, south, east, north = x, y, x, y
+        elif polygon is not None:
+            x, y = polygon.centroid.coords
+            west, south, east, north = polygon.extent
+        else:
+            continue
+
+        key = grid_cell(x, y, zoom)
+        cell = cells.get(key)
+        if cell is None:
+            cell = cells[key] = {
+                'count': 0, 'x': 0.0, 'y': 0.0, 'pks': [],
+                'bbox': [west, south, east, north],
+            }
+        cell['count'] += 1
+        cell['x'] += x
+        cell['y'] += y
+        bbox = cell['bbox']
+        bbox[:] = [min(bbox[0], west), min(bbox[1], south),
+                   max(bbox[2], east), max(bbox[3], north)]
+        if len(cell['pks']) < CLUSTER_SAMPLE:
+            cell['pks'].append(event_id)
+
+    return [{
+        'count': cell['count'],
+        'centroid': [cell['x'] / cell['count'], cell['y'] / cell['count']],
+        'bbox': cell['bbox'],
+        'pks': cell['pks'],
+    } for _, cell in sorted(cells.items())]
+
+
+# Points are snapped to the nearest grid point, so the grid's origin is
+# offset by half a cell to snap each point to the middle of its cell
+POSTGIS_CLUSTER_SQL = """
+WITH locations AS (
+    SELECT l.event_id AS id,
+           COALESCE(l.point, l.polygon) AS geom,
+           COALESCE(l.point, ST_Centroid(l.polygon)) AS center
+    FROM main_location l
+    WHERE l.event_id IN ({events})
+), cells AS (
+    SELECT id, geom, center,
+           ST_SnapToGrid(
+               ST_Transform(ST_SetSRID(ST_MakePoint(
+                   ST_X(center),
+                   GREATEST(LEAST(ST_Y(center), %s), -%s)
+               ), 4326), 3857),
+               %s, %s, %s, %s) AS cell
+    FROM locations
+)
+SELECT count(*),
+       ST_X(ST_Centroid(ST_Collect(center))),
+       ST_Y(ST_Centroid(ST_Collect(center))),
+       ST_XMin(ST_Extent(geom)), ST_YMin(ST_Extent(geom)),
+       ST_XMax(ST_Extent(geom)), ST_YMax(ST_Extent(geom)),
+       (array_agg(id ORDER BY id))[1:%s]
+FROM cells
+GROUP BY ST_X(cell), ST_Y(cell)
+ORDER BY ST_X(cell), -ST_Y(cell)
+"""
+
+
+def postgis_clusters(events, zoom: int) -> List[Dict[str, Any]]:
+    events_sql, events_params = events.values('pk').query.sql_with_params()
+    size = 2 * MERCATOR_HALF_WIDTH / (2 ** zoom * CLUSTER_CELLS)
+    origin = -MERCATOR_HALF_WIDTH + size / 2
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            POSTGIS_CLUSTER_SQL.format(events=events_sql),
+            list(events_params) + [
+                MAX_LATITUDE, MAX_LATITUDE, origin, origin, size, size,
+                CLUSTER_SAMPLE])
+        rows = cursor.fetchall()
+
+    return [{
+        'count': count,
+        'centroid': [x, y],
+        'bbox': [west, south, east, north],
+        'pks': pks,
+    } for count, x, y, west, south, east, north, pks in rows]
+
+
+def event_clusters(events, zoom: int) -> List[Dict[str, Any]]:
+    """Returns the clusters of an Event queryset's locations at a zoom"""
+    if getattr(connection.ops, 'postgis', False):
+        return postgis_clusters(events, zoom)
+    return python_clusters(events, zoom)
+
+
+def event_clusters_cache_key(events, zoom: int) -> str:
+    """
+    A key that changes whenever one of the events is added, edited or
+    removed. Saving an event's location marks the event as modified, see
+    location_changed. The query is hashed, so the key has a fixed length
+    however large the query is.
+    """
+    sql, params = events.query.sql_with_params()
+    state = events.aggregate(modified=Max('modified_at'), count=Count('pk'))
+    key = '{}:{}:{}:{}:{}:{}'.format(
+        sql, params, zoom, CLUSTER_CELLS, state['modified'], state['count'])
+    digest = hashlib.sha1(key.encode('utf-8'), usedforsecurity=False)
+    return 'locustempus:clusters:{}'.format(digest.hexdigest())
+
+
+def cached_event_clusters(events, zoom: int) -> List[Dict[str, Any]]:
+    """
+    Returns event_clusters from the cache named by
+    settings.EVENT_CLUSTER_CACHE, computing them if they aren't there
+    """
+    alias = getattr(settings, 'EVENT_CLUSTER_CACHE', None)
+    if not alias:
+        return event_clusters(events, zoom)
+
+    cache = caches[alias]
+    key = event_clusters_cache_key(events, zoom)
+    clusters = cache.get(key)
+    if clusters is None:
+        clusters = event_clusters(events, zoom)
+        cache.set(
+            key, clusters,
+            getattr(settings, 'EVENT_CLUSTER_CACHE_TIMEOUT', 3600))
+    return clusters
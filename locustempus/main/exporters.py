@@ -0,0 +1,96 @@
+"""
+Exports layers' Events as a GeoJSON FeatureCollection
+
+The collection is written as a stream of strings: events are read from the
+database in chunks with a server-side cursor where the backend supports
+one, so memory use stays flat no matter how many events are exported.
+"""
+import json
+
+from django.db.models import QuerySet
+from django.http import StreamingHttpResponse
+from locustempus.main.models import Event
+
+from typing import Any, Dict, Iterator, Optional
+
+
+EXPORT_CHUNK_SIZE = 2000
+
+
+def geometry_to_geojson(location) -> Optional[Dict[str, Any]]:
+    if location is None:
+        return None
+    geometry = location.point or location.polygon
+    if geometry is None:
+        return None
+    return {'type': geometry.geom_type, 'coordinates': geometry.coords}
+
+
+def event_to_feature(event: Event) -> Dict[str, Any]:
+    # Events are saved with their location, but guard against one missing
+    location = getattr(event, 'location', None)
+    return {
+        'type': 'Feature',
+        'id': event.pk,
+        'geometry': geometry_to_geojson(location),
+        'properties': {
+            'label': event.label,
+            'description': event.description,
+            'datetime': event.datetime.isoformat()
+            if event.datetime else None,
+            'layer': event.layer_id,
+            'media': [{
+                'url': m.url,
+                'source': m.source,
+                'caption': m.caption,
+                'alt': m.alt,
+            } for m in event.media.all()],
+        },
+    }
+
+
+def iter_feature_collection(layers: QuerySet,
+                            chunk_size: int = EXPORT_CHUNK_SIZE
+                            ) -> Iterator[str]:
+    """
+    Yields a GeoJSON FeatureCollection of the events in the layers
+    queryset. The layers themselves are listed in a "layers" member.
+    """
+    layer_list = [
+        {'id': layer['pk'], 'title': layer['title'], 'color': layer['color']}
+        for layer in layers.order_by('pk').values('pk', 'title', 'color')
+    ]
+    yield '{{"type": "FeatureCollection", "layers": {}, "features": ['.format(
+        json.dumps(layer_list))
+
+    events = Event.objects.filter(
+        layer__in=layers.values('pk')
+    ).select_related(
+        'location'
+    ).prefetch_related(
+        'media'
+    ).order_by('layer_id', 'pk')
+
+    # Write each chunk of features in one piece rather than per feature
+    buf = []
+    separator = ''
+    for event in events.iterator(chunk_size=chunk_size):
+        buf.append(separator + json.dumps(event_to_feature(event)))
+        separator = ',\n'
+        if len(buf) >= chunk_size:
+            yield ''.join(buf)
+            buf = []
+
+    buf.append(']}\n')
+    yield ''.join(buf)
+
+
+def geojson_response(layers: QuerySet, filename: str,
+                     chunk_size: int = EXPORT_CHUNK_SIZE
+                     ) -> StreamingHttpResponse:
+    response = StreamingHttpResponse(
+        iter_feature_collection(layers, chunk_size),
+        content_type='application/geo+json')
+    response['Content-Disposition'] = \
+        'attachment; filename="{}.geojson"'.format(filename)
+    return response
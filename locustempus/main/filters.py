@@ -0,0 +1,269 @@
+"""
+Query string filters and pagination for the API
+
+Event filters are evaluated in the database against the spatial indexes
+on Location.point and Location.polygon, so that a map can request only
+the events in its viewport. Every filter that is given must match.
+"""
+import base64
+import binascii
+import json
+import math
+from datetime import timezone as dt_timezone
+
+from dateutil.parser import isoparse
+from django.contrib.gis.geos import (
+    GEOSException, GEOSGeometry, Point, Polygon
+)
+from django.contrib.gis.measure import D
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.filters import BaseFilterBackend
+from rest_framework.pagination import BasePagination, LimitOffsetPagination
+from rest_framework.response import Response as APIResponse
+from rest_framework.utils.urls import replace_query_param
+
+from typing import Any, List, Optional, Tuple
+
+
+# Meters in a degree of latitude, and of longitude at the equator
+METERS_PER_DEGREE = 111320
+# About half the Earth's circumference
+MAX_RADIUS = 20000000
+
+
+def parse_floats(request, param: str, count: int) -> Optional[List[float]]:
+    value = request.query_params.get(param)
+    if value is None:
+        return None
+    try:
+        values = [float(v) for v in value.split(',')]
+    except ValueError:
+        values = []
+    if len(values) != count or not all(math.isfinite(v) for v in values):
+        raise ValidationError({
+            param: 'Expected {} comma separated numbers.'.format(count)})
+    return values
+
+
+def check_lng_lat(param: str, lng: float, lat: float) -> None:
+    if not (-180 <= lng <= 180 and -90 <= lat <= 90):
+        raise ValidationError({
+            param: 'Coordinates must be a longitude and latitude.'})
+
+
+def location_q(lookup: str, value) -> Q:
+    """Matches events whose point or polygon satisfies a spatial lookup"""
+    return Q(**{'location__point__' + lookup: value}) | \
+        Q(**{'location__polygon__' + lookup: value})
+
+
+def bbox_polygon(west: float, south: float, east: float,
+                 north: float) -> Polygon:
+    polygon = Polygon.from_bbox((west, south, east, north))
+    polygon.srid = 4326
+    return polygon
+
+
+def radius_bbox(lng: float, lat: float, radius: float) -> Polygon:
+    """
+    A box around a point that contains every location within radius
+    meters of it. Filtering on the box first lets the database use its
+    spatial index before measuring distances.
+    """
+    dlat = radius / METERS_PER_DEGREE
+    cos_lat = math.cos(math.radians(lat))
+    if lat + dlat >= 90 or lat - dlat <= -90 or \
+            radius >= cos_lat * METERS_PER_DEGREE * 180:
+        # The circle reaches a pole or wraps around the world
+        dlng = 180.0
+    else:
+        dlng = min(radius / (METERS_PER_DEGREE * cos_lat), 180.0)
+    return bbox_polygon(
+        max(lng - dlng, -180), max(lat - dlat, -90),
+        min(lng + dlng, 180), min(lat + dlat, 90))
+
+
+class EventSpatialFilter(BaseFilterBackend):
+    """
+    Filters events by their location:
+
+    - bbox=west,south,east,north: locations intersecting the box
+    - near=lng,lat&radius=meters: locations within radius of the point
+    - intersects=<GeoJSON Polygon or MultiPolygon>: locations intersecting
+      the geometry
+    """
+    def filter_queryset(self, request, queryset, view):
+        bbox = parse_floats(request, 'bbox', 4)
+        if bbox is not None:
+            west, south, east, north = bbox
+            check_lng_lat('bbox', west, south)
+            check_lng_lat('bbox', east, north)
+            if west > east or south > north:
+                raise ValidationError({
+                    'bbox': 'Expected west,south,east,north.'})
+            queryset = queryset.filter(
+                location_q('intersects', bbox_polygon(*bbox)))
+
+        near = parse_floats(request, 'near', 2)
+        if near is not None:
+            queryset = self.filter_near(request, queryset, *near)
+
+        geojson = request.query_params.get('intersects')
+        if geojson is not None:
+            queryset = queryset.filter(
+                location_q('intersects', self.parse_geometry(geojson)))
+
+        return queryset
+
+    def filter_near(self, request, queryset, lng: float, lat: float):
+        check_lng_lat('near', lng, lat)
+        radius = parse_floats(request, 'radius', 1)
+        if radius is None or not 0 < radius[0] <= MAX_RADIUS:
+            raise ValidationError({
+                'radius': 'A radius in meters, up to {}, is required.'.format(
+                    MAX_RADIUS)})
+
+        point = Point(lng, lat, srid=4326)
+        return queryset.filter(
+            location_q('intersects', radius_bbox(lng, lat, radius[0]))
+        ).filter(
+            location_q('distance_lte', (point, D(m=radius[0]))))
+
+    def parse_geometry(self, value: str) -> GEOSGeometry:
+        try:
+            geom = GEOSGeometry(value)
+        except (GEOSException, ValueError, TypeError):
+            raise ValidationError({
+                'intersects': 'Expected a GeoJSON geometry.'})
+        if geom.geom_type not in ('Polygon', 'MultiPolygon') or \
+                not geom.valid:
+            raise ValidationError({
+                'intersects': 'Expected a valid Polygon or MultiPolygon.'})
+        geom.srid = 4326
+        return geom
+
+
+class EventTemporalFilter(BaseFilterBackend):
+    """
+    Filters events by their datetime: start and end are ISO 8601 dates or
+    datetimes, UTC unless they have an offset, and an event matches if
+    start <= datetime < end
+    """
+    def filter_queryset(self, request, queryset, view):
+        start = self.parse_datetime(request, 'start')
+        if start is not None:
+            queryset = queryset.filter(datetime__gte=start)
+        end = self.parse_datetime(request, 'end')
+        if end is not None:
+            queryset = queryset.filter(datetime__lt=end)
+        return queryset
+
+    def parse_datetime(self, request, param: str):
+        value = request.query_params.get(param)
+        if value is None:
+            return None
+        try:
+            parsed = isoparse(value)
+        except (ValueError, OverflowError):
+            raise ValidationError({param: 'Expected an ISO 8601 datetime.'})
+        if timezone.is_naive(parsed):
+            parsed = parsed.replace(tzinfo=dt_timezone.utc)
+        return parsed
+
+
+class EventPagination(LimitOffsetPagination):
+    """
+    Pages events when a limit is given. Without one, the full list is
+    returned as before.
+    """
+    max_limit = 1000
+
+
+class KeysetCursorPagination(BasePagination):
+    """
+    Pages a list in (cursor_field, pk) order when a page_size or cursor is
+    given. Without either, the full list is returned as before.
+
+    Each page links to the next with a cursor holding the last row's
+    (cursor_field, pk), so a page costs the same however deep it is, and
+    rows added in the meantime don't shift later pages. Rows without a
+    cursor_field value, such as draft responses, come first.
+    """
+    cursor_field = ''
+    page_size = 50
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.cursor_query_param not in params and \
+                self.page_size_query_param not in params:
+            return None
+
+        self.request = request
+        page_size = self.get_page_size(request)
+        queryset = queryset.order_by(
+            F(self.cursor_field).asc(nulls_first=True), 'pk')
+
+        cursor = params.get(self.cursor_query_param)
+        if cursor:
+            queryset = queryset.filter(self.after(*self.decode_cursor(cursor)))
+
+        rows = list(queryset[:page_size + 1])
+        self.next_row = rows[page_size - 1] if len(rows) > page_size \
+            else None
+        return rows[:page_size]
+
+    def get_page_size(self, request) -> int:
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(size, self.max_page_size) if size > 0 else self.page_size
+
+    def after(self, value, pk: int) -> Q:
+        """Matches the rows that come after (value, pk)"""
+        field = self.cursor_field
+        if value is None:
+            return Q(**{field + '__isnull': False}) | \
+                Q(**{field + '__isnull': True, 'pk__gt': pk})
+        return Q(**{field + '__gt': value}) | Q(**{field: value, 'pk__gt': pk})
+
+    def encode_cursor(self, row) -> str:
+        value = getattr(row, self.cursor_field)
+        data = json.dumps([value.isoformat() if value else None, row.pk])
+        return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, cursor: str) -> Tuple[Any, int]:
+        try:
+            value, pk = json.loads(base64.urlsafe_b64decode(cursor))
+            if value is not None:
+                value = parse_datetime(value)
+                if value is None:
+                    raise ValueError
+            return value, int(pk)
+        except (binascii.Error, TypeError, ValueError):
+            raise NotFound('Invalid cursor')
+
+    def get_next_link(self) -> Optional[str]:
+        if self.next_row is None:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(), self.cursor_query_param,
+            self.encode_cursor(self.next_row))
+
+    def get_paginated_response(self, data):
+        return APIResponse({'next': self.get_next_link(), 'results': data})
+
+
+class ResponseCursorPagination(KeysetCursorPagination):
+    cursor_field = 'submitted_at'
+
+
+class FeedbackCursorPagination(KeysetCursorPagination):
+    # Feedback is shown as submitted when it's created
+    cursor_field = 'created_at'
@@ -1,9 +1,13 @@
+import csv
+import io
+
 from courseaffils.models import Course
 from django import forms
 from django.conf import settings
 from django.core.validators import RegexValidator
 from django.forms.formsets import formset_factory
 from django_registration.forms import RegistrationForm
+from typing import List
 
 from django_registration.signals import user_registered
 
@@ -31,18 +35,76 @@ class CourseForm(forms.ModelForm):
         fields = ['title']
 
 
+validate_uni = RegexValidator(
+    regex=r'^[a-z]{1,3}\d+$',
+    message='This is not a valid UNI.'
+)
+
+
 class CourseRosterInviteUNIForm(forms.Form):
     invitee = forms.CharField(
         max_length=24,
-        validators=[
-            RegexValidator(
-                regex=r'^[a-z]{1,3}\d+$',
-                message='This is not a valid UNI.'
-            )
-        ]
+        validators=[validate_uni]
     )
 
 
+class CourseRosterInviteFileForm(forms.Form):
+    """
+    A CSV file of UNIs, one per row in the first column, e.g. a class
+    list exported from a spreadsheet. A "UNI" header row is skipped.
+    """
+    MAX_UNIS = 5000
+    MAX_SIZE = 1024 * 1024
+    # Invalid rows listed in the error, before the rest are counted
+    MAX_ERRORS = 5
+
+    uni_file = forms.FileField(
+        required=False, label='Or upload a CSV file of UNIs')
+
+    def read_rows(self, upload) -> List[List[str]]:
+        if upload.size > self.MAX_SIZE:
+            raise forms.ValidationError(
+                'The file is too large. Please upload at most 1 MB.')
+        try:
+            text = upload.read().decode('utf-8-sig')
+        except UnicodeDecodeError:
+            raise forms.ValidationError('This is not a CSV file.')
+        try:
+            return list(csv.reader(io.StringIO(text)))
+        except csv.Error:
+            raise forms.ValidationError('This is not a CSV file.')
+
+    def clean_uni_file(self) -> List[str]:
+        upload = self.cleaned_data['uni_file']
+        if not upload:
+            return []
+
+        unis = []
+        errors = []
+        for line, row in enumerate(self.read_rows(upload), start=1):
+            uni = row[0].strip() if row else ''
+            if not uni or (line == 1 and uni.lower() == 'uni'):
+                continue
+            try:
+                validate_uni(uni)
+            except forms.ValidationError:
+                errors.append('Line {}: {} is not a valid UNI.'.format(
+                    line, uni))
+            else:
+                unis.append(uni)
+
+        if errors:
+            if len(errors) > self.MAX_ERRORS:
+                errors = errors[:self.MAX_ERRORS] + [
+                    '...and {} more.'.format(len(errors) - self.MAX_ERRORS)]
+            raise forms.ValidationError(errors)
+        if len(unis) > self.MAX_UNIS:
+            raise forms.ValidationError(
+                'A file can list at most {} UNIs.'.format(self.MAX_UNIS))
+
+        return unis
+
+
 class CourseRosterInviteEmailForm(forms.Form):
     invitee = forms.EmailField()
 
@@ -0,0 +1,360 @@
+"""
+Imports GeoJSON and CSV files into a Layer's Events and Locations
+
+Files are read as a stream: GeoJSON features and CSV rows are parsed one
+at a time and inserted in chunks, so memory use stays flat regardless of
+the size of the file. Rows that can't be imported are recorded as errors
+and skipped without aborting the rest of the import.
+"""
+import codecs
+import csv
+import io
+import json
+import os
+
+from dateutil import parser as dateparser
+from django.contrib.gis.geos import (
+    GEOSException, LinearRing, Point, Polygon
+)
+from django.db import transaction
+from django.utils import timezone
+from locustempus.main.models import Event, Location
+
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+
+# A parsed row: its row number, properties and GeoJSON-style geometry
+Record = Tuple[int, Dict[str, Any], Optional[Dict[str, Any]]]
+
+LABEL_KEYS = ('label', 'title', 'name')
+DESCRIPTION_KEYS = ('description', 'desc')
+DATETIME_KEYS = ('datetime', 'date', 'time', 'timestamp')
+LAT_KEYS = ('lat', 'latitude', 'y')
+LNG_KEYS = ('lng', 'lon', 'long', 'longitude', 'x')
+
+IMPORT_FORMATS = ('geojson', 'csv')
+
+# The longest JSON value, such as one feature, that is read into memory
+MAX_JSON_VALUE_SIZE = 8 * 1024 * 1024
+
+
+class ImportFormatError(ValueError):
+    """Raised when a file can't be read in the requested format"""
+
+
+class JSONStream(object):
+    """
+    Decodes JSON values from a file object one at a time, keeping only
+    the unread part of the current chunk in memory.
+    """
+    # JSON whitespace, plus the record separator used by GeoJSON text
+    # sequences (RFC 8142)
+    whitespace = ' \t\n\r\x1e'
+
+    def __init__(self, fileobj, chunk_size: int = 64 * 1024,
+                 max_value_size: int = MAX_JSON_VALUE_SIZE):
+        self.fileobj = fileobj
+        self.chunk_size = chunk_size
+        self.max_value_size = max_value_size
+        self.decoder = json.JSONDecoder()
+        self.utf8 = codecs.getincrementaldecoder('utf-8-sig')()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self, size: int) -> None:
+        chunk = self.fileobj.read(size)
+        # A read can end inside a multibyte character and decode to '',
+        # so the end of the file is decided from the raw read
+        if not chunk:
+            self.eof = True
+        if isinstance(chunk, bytes):
+            chunk = self.utf8.decode(chunk, final=not chunk)
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+
+    def peek(self) -> str:
+        """Returns the next non-whitespace character, or '' at the end"""
+        while True:
+            while self.pos < len(self.buf) and \
+                    self.buf[self.pos] in self.whitespace:
+                self.pos += 1
+            if self.pos < len(self.buf) or self.eof:
+                return self.buf[self.pos:self.pos + 1]
+            self.fill(self.chunk_size)
+
+    def expect(self, chars: str) -> str:
+        char = self.peek()
+        if not char or char not in chars:
+            raise ImportFormatError(
+                'Expected one of {} in the JSON, found {}'.format(
+                    ' '.join(chars), repr(char) if char else 'the end'))
+        self.pos += 1
+        return char
+
+    def decode(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError as e:
+                if self.eof:
+                    raise ImportFormatError('Invalid JSON: {}'.format(e))
+            else:
+                # A value ending with the buffer may be a truncated number
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            # Grow the reads with the value so a large feature isn't
+            # re-decoded once per chunk, up to max_value_size, so that
+            # malformed JSON isn't read to the end of the file
+            pending = len(self.buf) - self.pos
+            if pending >= self.max_value_size:
+                raise ImportFormatError(
+                    'Invalid JSON: a value is longer than {} characters'
+                    .format(self.max_value_size))
+            self.fill(min(max(self.chunk_size, pending),
+                          self.max_value_size - pending))
+
+
+def iter_geojson(fileobj) -> Iterator[Record]:
+    """
+    Yields the features of a GeoJSON FeatureCollection without reading
+    the whole collection into memory. Files containing a single Feature,
+    or a sequence of Features (newline-delimited GeoJSON) are read too.
+    """
+    stream = JSONStream(fileobj)
+    row = 0
+    while stream.peek():
+        stream.expect('{')
+        obj = {}
+        has_features = False
+        while stream.peek() != '}':
+            if obj or has_features:
+                stream.expect(',')
+            key = stream.decode()
+            stream.expect(':')
+            if key != 'features':
+                obj[key] = stream.decode()
+                continue
+
+            has_features = True
+            stream.expect('[')
+            first = True
+            while stream.peek() != ']':
+                if not first:
+                    stream.expect(',')
+                first = False
+                row += 1
+                yield feature_record(row, stream.decode())
+            stream.expect(']')
+        stream.expect('}')
+
+        if not has_features:
+            if obj.get('type') != 'Feature':
+                raise ImportFormatError(
+                    'Expected a GeoJSON Feature or FeatureCollection')
+            row += 1
+            yield feature_record(row, obj)
+
+
+def feature_record(row: int, feature: Any) -> Record:
+    if not isinstance(feature, dict):
+        return (row, {}, None)
+
+    properties = feature.get('properties')
+    if not isinstance(properties, dict):
+        properties = {}
+    # Match property names case-insensitively, as with CSV headers
+    properties = {str(k).lower(): v for k, v in properties.items()}
+    return (row, properties, feature.get('geometry'))
+
+
+def iter_csv(fileobj) -> Iterator[Record]:
+    """
+    Yields the rows of a CSV file with a header row. Coordinates are read
+    from lat/lng (or latitude/longitude) columns.
+    """
+    if not isinstance(fileobj, io.TextIOBase):
+        fileobj = io.TextIOWrapper(fileobj, encoding='utf-8-sig', newline='')
+
+    reader = csv.DictReader(fileobj)
+    if reader.fieldnames is None:
+        return
+    reader.fieldnames = [f.strip().lower() for f in reader.fieldnames]
+
+    # The header is row 1
+    for row, properties in enumerate(reader, start=2):
+        lat = first_value(properties, LAT_KEYS)
+        lng = first_value(properties, LNG_KEYS)
+        geometry = None
+        if lat is not None or lng is not None:
+            geometry = {'type': 'Point', 'coordinates': [lng, lat]}
+        yield (row, properties, geometry)
+
+
+def first_value(properties: Dict[str, Any], keys: Tuple[str, ...]) -> Any:
+    """Returns the first non-empty value in properties under any of keys"""
+    for key in keys:
+        value = properties.get(key)
+        if value not in (None, ''):
+            return value
+    return None
+
+
+def parse_coordinates(coordinates: Any) -> Tuple[float, float]:
+    try:
+        lng, lat = [float(c) for c in coordinates[:2]]
+    except (TypeError, ValueError, IndexError):
+        raise ValueError('Invalid coordinates: {}'.format(coordinates))
+
+    if not (-180 <= lng <= 180 and -90 <= lat <= 90):
+        raise ValueError('Coordinates out of range: {}'.format(coordinates))
+    return (lng, lat)
+
+
+def build_location(geometry: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Maps a GeoJSON geometry to the fields of a Location"""
+    if not isinstance(geometry, dict):
+        raise ValueError('Missing geometry')
+
+    geom_type = geometry.get('type')
+    coordinates = geometry.get('coordinates')
+    if geom_type == 'Point':
+        return {'point': Point(*parse_coordinates(coordinates), srid=4326)}
+
+    if geom_type == 'Polygon':
+        try:
+            rings = [
+                LinearRing([parse_coordinates(c) for c in ring])
+                for ring in coordinates
+            ]
+            return {'polygon': Polygon(*rings, srid=4326)}
+        except (TypeError, IndexError):
+            raise ValueError('Invalid polygon coordinates')
+        except (GEOSException, ValueError) as e:
+            # GEOS rejects unclosed rings and rings with too few points
+            raise ValueError('Invalid polygon: {}'.format(e))
+
+    raise ValueError('Unsupported geometry type: {}'.format(geom_type))
+
+
+def parse_datetime(value: Any):
+    if value in (None, ''):
+        return None
+    try:
+        dt = dateparser.parse(str(value))
+    except (ValueError, OverflowError):
+        raise ValueError('Invalid date: {}'.format(value))
+
+    if timezone.is_naive(dt):
+        dt = timezone.make_aware(dt)
+    return dt
+
+
+class ImportResult(object):
+    """Counts and errors for a layer import"""
+    # Only the first errors are kept, so a file with many bad rows
+    # doesn't grow memory
+    max_errors = 100
+
+    def __init__(self):
+        self.created = 0
+        self.error_count = 0
+        self.errors: List[Dict[str, Any]] = []
+
+    def add_error(self, row: Optional[int], message: str) -> None:
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'row': row, 'error': message})
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'created': self.created,
+            'error_count': self.error_count,
+            'errors': self.errors,
+        }
+
+
+class LayerImporter(object):
+    """
+    Creates an Event and Location for each record, inserting them into
+    the layer in chunks. The optional progress callback is called with
+    the ImportResult after each chunk.
+    """
+    def __init__(self, layer, user=None, chunk_size: int = 500,
+                 progress: Optional[Callable[[ImportResult], None]] = None):
+        self.layer = layer
+        self.user = user
+        self.chunk_size = chunk_size
+        self.progress = progress
+
+    def build_event(self, row: int, properties: Dict[str, Any],
+                    geometry: Optional[Dict[str, Any]]
+                    ) -> Tuple[Event, Location]:
+        location = build_location(geometry)
+        label = first_value(properties, LABEL_KEYS)
+        event = Event(
+            layer=self.layer,
+            label=str(label) if label is not None else 'Row {}'.format(row),
+            description=str(first_value(properties, DESCRIPTION_KEYS) or ''),
+            datetime=parse_datetime(first_value(properties, DATETIME_KEYS)),
+            created_by=self.user,
+            modified_by=self.user,
+        )
+        return (event, Location(event=event, **location))
+
+    def flush(self, chunk: List[Tuple[Event, Location]],
+              result: ImportResult) -> None:
+        if chunk:
+            with transaction.atomic():
+                Event.objects.bulk_create([event for event, _ in chunk])
+                Location.objects.bulk_create([loc for _, loc in chunk])
+            result.created += len(chunk)
+
+        if self.progress:
+            self.progress(result)
+
+    def run(self, records: Iterator[Record]) -> ImportResult:
+        result = ImportResult()
+        chunk: List[Tuple[Event, Location]] = []
+        try:
+            for row, properties, geometry in records:
+                try:
+                    chunk.append(self.build_event(row, properties, geometry))
+                except ValueError as e:
+                    result.add_error(row, str(e))
+                    continue
+
+                if len(chunk) >= self.chunk_size:
+                    self.flush(chunk, result)
+                    chunk = []
+        except (ImportFormatError, csv.Error, UnicodeDecodeError) as e:
+            # The rest of the file can't be read, keep what was imported
+            result.add_error(None, str(e))
+
+        self.flush(chunk, result)
+        return result
+
+
+def detect_format(filename: str) -> Optional[str]:
+    ext = os.path.splitext(filename or '')[1].lower()
+    if ext in ('.geojson', '.json', '.geojsonl', '.ndjson'):
+        return 'geojson'
+    if ext in ('.csv', '.txt'):
+        return 'csv'
+    return None
+
+
+def import_layer(layer, fileobj, file_format: str, user=None,
+                 chunk_size: int = 500,
+                 progress: Optional[Callable[[ImportResult], None]] = None
+                 ) -> ImportResult:
+    """Streams a GeoJSON or CSV file into a layer's events"""
+    readers = {'geojson': iter_geojson, 'csv': iter_csv}
+    if file_format not in readers:
+        raise ImportFormatError(
+            'Unsupported import format: {}'.format(file_format))
+
+    importer = LayerImporter(layer, user, chunk_size, progress)
+    return importer.run(readers[file_format](fileobj))
@@ -0,0 +1,133 @@
+"""
+A database-backed queue for email
+
+Views render their emails with template_emails (or template_email for
+just one) and pass them to
+queue_emails, which saves them once the request's transaction commits,
+so that nothing is sent for a change that was rolled back. The
+send_queued_email command then sends them in batches, each over a single
+connection to the mail server, at most settings.EMAIL_RATE_LIMIT
+messages a second.
+"""
+from django.conf import settings
+from django.core.mail import get_connection
+from django.db import transaction
+from django.utils import timezone
+from locustempus.main.models import QueuedEmail
+from locustempus.main.utils import SendRate, render_template_emails
+
+from typing import Any, Dict, List, Sequence, Tuple
+
+
+def template_emails(subject: str, template_name: str,
+                    recipients: Sequence[Tuple[str, Dict[str, Any]]],
+                    course=None) -> List[QueuedEmail]:
+    """
+    Validates the addresses and renders an unsaved QueuedEmail for each
+    (recipient, context) pair
+    """
+    return [
+        QueuedEmail(
+            course=course,
+            recipient=recipient,
+            subject=subject,
+            body=body
+        )
+        for recipient, body in render_template_emails(
+            template_name, recipients)
+    ]
+
+
+def template_email(subject: str, template_name: str,
+                   context: Dict[str, Any], recipient: str,
+                   course=None) -> QueuedEmail:
+    """Validates the address and renders an unsaved QueuedEmail"""
+    return template_emails(
+        subject, template_name, [(recipient, context)], course)[0]
+
+
+def queue_emails(emails: List[QueuedEmail]) -> None:
+    """Saves the emails for sending once the transaction commits"""
+    if emails:
+        transaction.on_commit(
+            lambda: QueuedEmail.objects.bulk_create(emails))
+
+
+def save_result(email: QueuedEmail) -> None:
+    """Saves the outcome of one send attempt, see mark_sent and mark_failed"""
+    QueuedEmail.objects.filter(pk=email.pk).update(
+        status=email.status,
+        attempts=email.attempts,
+        last_error=email.last_error,
+        next_attempt_at=email.next_attempt_at,
+        sent_at=email.sent_at
+    )
+
+
+def send_messages(emails: List[QueuedEmail], connection) -> None:
+    """
+    Sends the emails over the connection, saving each one's result as
+    soon as it is known
+    """
+    try:
+        connection.open()
+    except Exception as e:
+        for email in emails:
+            email.mark_failed(e)
+            save_result(email)
+        return
+
+    rate = SendRate(getattr(settings, 'EMAIL_RATE_LIMIT', None))
+    try:
+        for email in emails:
+            # One message at a time, so a rejected address only fails
+            # its own email
+            rate.wait()
+            try:
+                sent = connection.send_messages([email.message()])
+            except Exception as e:
+                email.mark_failed(e)
+            else:
+                if sent:
+                    email.mark_sent()
+                else:
+                    email.mark_failed('The message was not sent.')
+            save_result(email)
+    finally:
+        connection.close()
+
+
+def claim_emails(batch_size: int) -> List[QueuedEmail]:
+    """
+    Claims a batch of the pending emails that are due, by moving their
+    next attempt past CLAIM_TIMEOUT. Workers running side by side skip
+    the rows another is claiming, and the claimed rows aren't due again
+    until the claim runs out, so an email whose worker stopped before
+    saving its result is retried then.
+    """
+    with transaction.atomic():
+        emails = list(
+            QueuedEmail.objects.select_for_update(skip_locked=True).filter(
+                status=QueuedEmail.PENDING,
+                next_attempt_at__lte=timezone.now()
+            ).order_by('next_attempt_at', 'pk')[:batch_size]
+        )
+        claimed_until = timezone.now() + QueuedEmail.CLAIM_TIMEOUT
+        for email in emails:
+            email.next_attempt_at = claimed_until
+        QueuedEmail.objects.filter(pk__in=[e.pk for e in emails]).update(
+            next_attempt_at=claimed_until)
+    return emails
+
+
+def send_queued_emails(batch_size: int = 100, connection=None) -> int:
+    """
+    Sends a batch of the pending emails that are due, over one
+    connection, and returns the number of emails tried. The batch is
+    claimed in a short transaction and sent outside of it, so no rows
+    are locked while the mail server is waited on.
+    """
+    emails = claim_emails(batch_size)
+    if emails:
+        send_messages(emails, connection or get_connection())
+    return len(emails)
@@ -0,0 +1,324 @@
+"""Benchmark_asgi: compares serving the API over WSGI and over ASGI
+
+Seeds a project with layers and events, then sends --requests requests
+from --concurrency clients to each of two in-process handlers:
+
+- sync: the WSGI handler, with --workers threads standing in for
+  gunicorn's sync workers, each serving one request at a time
+- async: the ASGI handler on one event loop, as a uvicorn worker runs it
+
+The requests cycle through the project bundle, the layer list, and a
+view that waits on a local stand-in for S3, which answers after
+--s3-latency milliseconds. The sync mode requests the DRF views and the
+async mode their async variants. Requests per second and the p50 and p99
+latency, including the time spent waiting for a free worker, are
+reported for each mode. The seeded rows are deleted at the end.
+"""
+import asyncio
+import http.client
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from statistics import median
+from typing import Dict, List, Tuple
+
+from courseaffils.models import Course
+from django.conf import settings
+from django.contrib.auth.models import Group, User
+from django.contrib.gis.geos import Point
+from django.contrib.sessions.models import Session
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+from django.db import transaction
+from django.http import HttpResponse
+from django.test import Client, override_settings
+from django.urls import include, path, reverse
+from django.views.generic.base import View
+from locustempus.main.models import Activity, Event, Layer, Location, Project
+from locustempus.main.viewsets import AsyncAPIView
+
+
+class StandInS3(BaseHTTPRequestHandler):
+    """Answers every request after a fixed latency, like a slow S3"""
+    latency = 0.1
+
+    def do_HEAD(self):
+        time.sleep(self.latency)
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class S3View(View):
+    address: Tuple[str, int] = ('127.0.0.1', 0)
+
+    def get(self, request):
+        conn = http.client.HTTPConnection(*self.address, timeout=30)
+        try:
+            conn.request('HEAD', '/uploads/benchmark')
+            conn.getresponse().read()
+        finally:
+            conn.close()
+        return HttpResponse(status=204)
+
+
+class AsyncS3View(AsyncAPIView):
+    async def get(self, request):
+        reader, writer = await asyncio.open_connection(*S3View.address)
+        writer.write(b'HEAD /uploads/benchmark HTTP/1.0\r\n\r\n')
+        await writer.drain()
+        await reader.read()
+        writer.close()
+        await writer.wait_closed()
+        return HttpResponse(status=204)
+
+
+# The site's URLs, and the views that wait on the stand-in for S3
+urlpatterns = [
+    path('benchmark/s3/', S3View.as_view(), name='benchmark-s3'),
+    path('benchmark/async/s3/', AsyncS3View.as_view(),
+         name='benchmark-async-s3'),
+    path('', include('locustempus.urls')),
+]
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(int(len(values) * pct / 100), len(values) - 1)]
+
+
+class Command(BaseCommand):
+    help = 'Compares requests per second and latency over WSGI and ASGI.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests', type=int, default=600,
+            help='Number of requests to send in each mode.',
+        )
+        parser.add_argument(
+            '--concurrency', type=int, default=24,
+            help='Number of clients sending requests at once.',
+        )
+        parser.add_argument(
+            '--workers', type=int, default=3,
+            help='Number of sync workers in the sync mode.',
+        )
+        parser.add_argument(
+            '--s3-latency', type=int, default=100,
+            help='Milliseconds the stand-in for S3 takes to answer.',
+        )
+        parser.add_argument(
+            '--layers', type=int, default=10,
+            help='Number of layers to seed.',
+        )
+        parser.add_argument(
+            '--events', type=int, default=50,
+            help='Number of events to seed per layer.',
+        )
+        parser.add_argument(
+            '--host', default='localhost',
+            help='Host header to send, which must be in ALLOWED_HOSTS.',
+        )
+
+    @transaction.atomic
+    def seed(self, layers: int, events: int) -> Tuple[Course, User]:
+        group = Group.objects.create(name='benchmark-asgi-group')
+        faculty_group = Group.objects.create(
+            name='benchmark-asgi-faculty-group')
+        course = Course.objects.create(
+            title='Benchmark Workspace', group=group,
+            faculty_group=faculty_group)
+        user = User.objects.create(username='benchmark-asgi-faculty')
+        group.user_set.add(user)
+        faculty_group.user_set.add(user)
+
+        project = Project.objects.create(course=course, title='Benchmark')
+        Activity.objects.create(project=project, instructions='Benchmark')
+        for i in range(layers):
+            layer = Layer.objects.create(
+                title='Layer {}'.format(i), content_object=project,
+                created_by=user)
+            created = Event.objects.bulk_create([
+                Event(layer=layer, label='Event {}'.format(j),
+                      created_by=user)
+                for j in range(events)
+            ])
+            Location.objects.bulk_create([
+                Location(event=event, point=Point(j % 180, j % 90))
+                for j, event in enumerate(created)
+            ])
+        return course, user
+
+    def cleanup(self, course: Course, session_key: str) -> None:
+        groups = [course.group, course.faculty_group]
+        Project.objects.filter(course=course).delete()
+        course.delete()
+        for group in groups:
+            group.delete()
+        User.objects.filter(username='benchmark-asgi-faculty').delete()
+        Session.objects.filter(session_key=session_key).delete()
+
+    def run_sync(self, paths: List[str], count: int, concurrency: int,
+                 workers: int, headers: Dict[str, str]) -> Dict:
+        application = get_wsgi_application()
+        latencies: List[float] = []
+        errors = [0]
+        lock = threading.Lock()
+
+        def serve(environ) -> str:
+            status = []
+            body = application(environ, lambda s, h, e=None: status.append(s))
+            b''.join(body)
+            body.close()
+            return status[0]
+
+        def client(pool: ThreadPoolExecutor, n: int) -> None:
+            for i in range(n, count, concurrency):
+                path, _, query = paths[i % len(paths)].partition('?')
+                environ = {
+                    'REQUEST_METHOD': 'GET', 'PATH_INFO': path,
+                    'QUERY_STRING': query, 'SERVER_NAME': headers['host'],
+                    'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+                    'HTTP_HOST': headers['host'],
+                    'HTTP_COOKIE': headers['cookie'],
+                    'wsgi.input': BytesIO(), 'wsgi.url_scheme': 'http',
+                    'wsgi.errors': BytesIO(),
+                }
+                start = time.perf_counter()
+                # Requests wait in line for a free worker, as they do in
+                # gunicorn's listen backlog
+                status = pool.submit(serve, environ).result()
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+                    if not status.startswith('2'):
+                        errors[0] += 1
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            threads = [threading.Thread(target=client, args=(pool, n))
+                       for n in range(concurrency)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        return self.results(latencies, errors[0], start)
+
+    def run_async(self, paths: List[str], count: int, concurrency: int,
+                  headers: Dict[str, str]) -> Dict:
+        application = get_asgi_application()
+        latencies: List[float] = []
+        errors = [0]
+
+        async def request(path: str) -> int:
+            path, _, query = path.partition('?')
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'},
+                'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+                'path': path, 'raw_path': path.encode(),
+                'query_string': query.encode(), 'root_path': '',
+                'headers': [(k.encode(), v.encode())
+                            for k, v in headers.items()],
+                'client': ('127.0.0.1', 0), 'server': (headers['host'], 80),
+            }
+            received = asyncio.Event()
+            status = []
+
+            async def receive():
+                if received.is_set():
+                    # The client stays connected until the response is sent
+                    await asyncio.Future()
+                received.set()
+                return {'type': 'http.request', 'body': b''}
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    status.append(message['status'])
+
+            await application(scope, receive, send)
+            return status[0]
+
+        async def client(n: int) -> None:
+            for i in range(n, count, concurrency):
+                start = time.perf_counter()
+                status = await request(paths[i % len(paths)])
+                latencies.append(time.perf_counter() - start)
+                if not 200 <= status < 300:
+                    errors[0] += 1
+
+        async def main():
+            await asyncio.gather(*[client(n) for n in range(concurrency)])
+
+        start = time.perf_counter()
+        asyncio.run(main())
+        return self.results(latencies, errors[0], start)
+
+    def results(self, latencies: List[float], errors: int,
+                start: float) -> Dict:
+        elapsed = time.perf_counter() - start
+        return {
+            'rps': len(latencies) / elapsed,
+            'p50': median(latencies) * 1000 if latencies else 0,
+            'p99': percentile(latencies, 99) * 1000,
+            'errors': errors,
+        }
+
+    def handle(self, *args, **options):
+        StandInS3.latency = options['s3_latency'] / 1000
+        s3 = ThreadingHTTPServer(('127.0.0.1', 0), StandInS3)
+        S3View.address = s3.server_address[:2]
+        threading.Thread(target=s3.serve_forever, daemon=True).start()
+
+        self.stdout.write('Seeding {} layers of {} events...'.format(
+            options['layers'], options['events']))
+        course, user = self.seed(options['layers'], options['events'])
+        project = course.projects.first()
+
+        client = Client()
+        client.force_login(user)
+        session_key = client.cookies[settings.SESSION_COOKIE_NAME].value
+        headers = {
+            'host': options['host'],
+            'cookie': '{}={}'.format(
+                settings.SESSION_COOKIE_NAME, session_key),
+        }
+
+        try:
+            with override_settings(ROOT_URLCONF=__name__):
+                sync_paths = [
+                    reverse('api-project-bundle', args=[project.pk]),
+                    reverse('api-layer-list'),
+                    reverse('benchmark-s3'),
+                ]
+                async_paths = [
+                    reverse('api-async-project-bundle', args=[project.pk]),
+                    reverse('api-async-layer-list'),
+                    reverse('benchmark-async-s3'),
+                ]
+                results = [
+                    ('sync', self.run_sync(
+                        sync_paths, options['requests'],
+                        options['concurrency'], options['workers'],
+                        headers)),
+                    ('async', self.run_async(
+                        async_paths, options['requests'],
+                        options['concurrency'], headers)),
+                ]
+        finally:
+            s3.shutdown()
+            self.cleanup(course, session_key)
+
+        self.stdout.write(
+            '{:<6} {:>9} {:>9} {:>9} {:>7}'.format(
+                'mode', 'req/s', 'p50 ms', 'p99 ms', 'errors'))
+        for mode, result in results:
+            self.stdout.write(
+                '{:<6} {rps:>9.1f} {p50:>9.1f} {p99:>9.1f} {errors:>7}'
+                .format(mode, **result))
@@ -0,0 +1,155 @@
+"""Benchmark_indexes: times the API's hot queries with and without indexes
+
+Seeds a large course inside a transaction, times the queries that the
+composite indexes on Layer and Response are meant for, drops those indexes
+and times the same queries again. The transaction is rolled back at the
+end, so the database is left as it was.
+"""
+from statistics import mean
+from time import perf_counter
+
+from courseaffils.models import Course
+from django.contrib.auth.models import Group, User
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from locustempus.main.models import (
+    Activity, Layer, Project, Response, ResponseOwner
+)
+
+
+# The composite indexes added for these queries. Other indexes on Layer and
+# Response stay in place.
+BENCHMARKED_INDEXES = [
+    'layer_content_object_idx',
+    'response_activity_status_idx',
+    'response_not_draft_idx',
+]
+
+
+class Command(BaseCommand):
+    help = 'Times layer and response queries with and without indexes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--activities', type=int, default=50,
+            help='Number of activities to seed.',
+        )
+        parser.add_argument(
+            '--responses', type=int, default=200,
+            help='Number of responses to seed per activity.',
+        )
+        parser.add_argument(
+            '--layers', type=int, default=5,
+            help='Number of layers to seed per response.',
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=20,
+            help='Number of times to run each query.',
+        )
+
+    def seed(self, activities, responses, layers):
+        group = Group.objects.create(name='benchmark-group')
+        faculty_group = Group.objects.create(name='benchmark-faculty-group')
+        course = Course.objects.create(
+            title='Benchmark Workspace', group=group,
+            faculty_group=faculty_group)
+
+        users = User.objects.bulk_create([
+            User(username='benchmark-user-{}'.format(i))
+            for i in range(responses)
+        ])
+        response_type = ContentType.objects.get_for_model(Response)
+        statuses = [Response.DRAFT, Response.SUBMITTED, Response.REVIEWED]
+
+        for i in range(activities):
+            project = Project.objects.create(
+                course=course, title='Benchmark {}'.format(i))
+            activity = Activity.objects.create(
+                project=project, instructions='Benchmark')
+            rs = Response.objects.bulk_create([
+                Response(activity=activity, status=statuses[j % 3])
+                for j in range(responses)
+            ])
+            ResponseOwner.objects.bulk_create([
+                ResponseOwner(owner=user, response=r, activity=activity)
+                for user, r in zip(users, rs)
+            ])
+            Layer.objects.bulk_create([
+                Layer(
+                    title='Layer {}'.format(k),
+                    content_type=response_type,
+                    object_id=r.pk
+                ) for r in rs for k in range(layers)
+            ])
+
+        return list(Activity.objects.filter(project__course=course)), users
+
+    def queries(self, activities, users):
+        response_type = ContentType.objects.get_for_model(Response)
+        not_draft = [Response.SUBMITTED, Response.REVIEWED]
+        activity = activities[len(activities) // 2]
+        response = activity.responses.last()
+        user = users[len(users) // 2]
+        return {
+            'layers by content object': lambda: list(Layer.objects.filter(
+                content_type=response_type, object_id=response.pk)),
+            # The counts ActivityStats.rebuild runs
+            'submitted response count': lambda: Response.objects.filter(
+                activity=activity, status__in=not_draft).count(),
+            'feedback count': lambda: Response.objects.filter(
+                activity=activity, status=Response.REVIEWED).count(),
+            'non-draft responses': lambda: list(Response.objects.filter(
+                activity=activity).exclude(status=Response.DRAFT)),
+            'aggregated layer pks': lambda: list(Layer.objects.filter(
+                response__activity=activity,
+                response__status__in=not_draft
+            ).values_list('pk', flat=True)),
+            'response owner': lambda: list(ResponseOwner.objects.filter(
+                owner=user, activity=activity)),
+        }
+
+    def time_queries(self, queries, repeat):
+        timings = {}
+        for name, query in queries.items():
+            query()  # warm up
+            runs = []
+            for _ in range(repeat):
+                start = perf_counter()
+                query()
+                runs.append(perf_counter() - start)
+            timings[name] = mean(runs) * 1000
+        return timings
+
+    def drop_indexes(self):
+        # SQLite's schema editor can't run inside the transaction, so the
+        # indexes are dropped directly
+        with connection.cursor() as cursor:
+            for name in BENCHMARKED_INDEXES:
+                cursor.execute('DROP INDEX {}'.format(
+                    connection.ops.quote_name(name)))
+            if connection.vendor == 'postgresql':
+                cursor.execute('ANALYZE')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.stdout.write('Seeding data...')
+            activities, users = self.seed(
+                options['activities'], options['responses'],
+                options['layers'])
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute('ANALYZE')
+
+            queries = self.queries(activities, users)
+            after = self.time_queries(queries, options['repeat'])
+            self.drop_indexes()
+            before = self.time_queries(queries, options['repeat'])
+
+            self.stdout.write('{:<28}{:>14}{:>14}'.format(
+                'Query', 'Before (ms)', 'After (ms)'))
+            for name in queries:
+                self.stdout.write('{:<28}{:>14.3f}{:>14.3f}'.format(
+                    name, before[name], after[name]))
+
+            transaction.set_rollback(True)
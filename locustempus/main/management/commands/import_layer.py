@@ -0,0 +1,81 @@
+"""Import_layer: loads a GeoJSON or CSV file into a layer's events
+
+The file is streamed and inserted in chunks, so large datasets can be
+loaded without holding them in memory. Rows that can't be imported are
+reported at the end.
+"""
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from locustempus.main.importers import (
+    IMPORT_FORMATS, ImportFormatError, detect_format, import_layer
+)
+from locustempus.main.models import Layer
+
+
+class Command(BaseCommand):
+    help = 'Imports the features of a GeoJSON or CSV file into a layer.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('layer', type=int, help='The pk of the layer.')
+        parser.add_argument('path', help='The file to import.')
+        parser.add_argument(
+            '--format', choices=IMPORT_FORMATS,
+            help='The file format. Guessed from the extension if omitted.',
+        )
+        parser.add_argument(
+            '--user',
+            help='Username to record as the creator of the events.',
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help='Number of events to insert at a time.',
+        )
+
+    def get_layer(self, pk):
+        try:
+            return Layer.objects.get(pk=pk)
+        except Layer.DoesNotExist:
+            raise CommandError('Layer {} does not exist.'.format(pk))
+
+    def get_user(self, username):
+        if not username:
+            return None
+        try:
+            return User.objects.get(username=username)
+        except User.DoesNotExist:
+            raise CommandError('User {} does not exist.'.format(username))
+
+    def write_errors(self, result):
+        for error in result.errors:
+            self.stderr.write('Row {}: {}'.format(
+                error['row'] or '-', error['error']))
+        if result.error_count > len(result.errors):
+            self.stderr.write('... and {} more errors'.format(
+                result.error_count - len(result.errors)))
+
+    def handle(self, *args, **options):
+        layer = self.get_layer(options['layer'])
+        user = self.get_user(options['user'])
+
+        file_format = options['format'] or detect_format(options['path'])
+        if file_format is None:
+            raise CommandError(
+                'Unable to guess the format of {}, use --format.'.format(
+                    options['path']))
+
+        def progress(result):
+            self.stdout.write('Imported {} events, {} errors'.format(
+                result.created, result.error_count))
+
+        try:
+            with open(options['path'], 'rb') as f:
+                result = import_layer(
+                    layer, f, file_format, user,
+                    chunk_size=options['chunk_size'], progress=progress)
+        except (OSError, ImportFormatError) as e:
+            raise CommandError(str(e))
+
+        self.write_errors(result)
+        self.stdout.write(self.style.SUCCESS(
+            'Imported {} events into "{}"'.format(
+                result.created, layer.title)))
@@ -0,0 +1,32 @@
+"""Rebuild_activity_stats: recomputes the ActivityStats rows
+
+The stats are kept current as responses change, so this is only needed
+after changes made around the ORM, e.g. by raw SQL, a bulk update of
+response statuses, or a restored backup. With --activity it rebuilds
+just those activities.
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from locustempus.main.models import ActivityStats
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the response counts of activities.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--activity', type=int, action='append', dest='activities',
+            help='The pk of an activity to rebuild. Can be repeated.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Number of activities to rebuild per query.',
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            count = ActivityStats.rebuild(
+                options['activities'], options['batch_size'])
+        if options['verbosity']:
+            self.stdout.write('Rebuilt the stats of {} activities.'.format(
+                count))
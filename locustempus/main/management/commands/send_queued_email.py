@@ -0,0 +1,49 @@
+"""Send_queued_email: sends the emails queued by the roster views
+
+Sends the pending emails that are due in batches, each over one
+connection to the mail server, until there are none left. With --loop
+it then keeps checking for new ones every --interval seconds, as the
+docker worker does.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from locustempus.main.mailqueue import send_queued_emails
+
+
+class Command(BaseCommand):
+    help = 'Sends queued emails.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=100,
+            help='Number of emails to send over each connection.',
+        )
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Keep checking for new emails.',
+        )
+        parser.add_argument(
+            '--interval', type=float, default=10,
+            help='Seconds to wait between checks with --loop.',
+        )
+
+    def send_due(self, batch_size: int) -> int:
+        total = 0
+        while True:
+            count = send_queued_emails(batch_size)
+            total += count
+            if count < batch_size:
+                return total
+
+    def handle(self, *args, **options):
+        while True:
+            count = self.send_due(options['batch_size'])
+            if count and options['verbosity']:
+                self.stdout.write('Tried to send {} emails.'.format(count))
+            if not options['loop']:
+                return
+
+            close_old_connections()
+            time.sleep(options['interval'])
@@ -1,39 +1,108 @@
 """
 Add user created_by and modified_by foreign key refs to any model
-automatically. Almost entirely taken from
+automatically. Originally based on
 https://github.com/Atomidata/django-audit-log/
     blob/master/audit_log/middleware.py
+
+The acting user is kept in a context variable while a write request is
+handled, and a single pre_save receiver, connected once, stamps it on the
+saved instance. Context variables are local to each thread and each
+asyncio task, so concurrent requests never see each other's user.
 """
+import contextvars
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
 from django.db.models import signals
-from functools import partial as curry
+from django.dispatch import receiver
+
+from typing import Iterable, Iterator, TypeVar
+
+
+T = TypeVar('T', bound=Iterable)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+# Unset outside of write requests, and None for anonymous writes
+_acting_user = contextvars.ContextVar('whodidit_user')
+_UNSET = object()
+
+
+def get_acting_user():
+    """Returns the user stamped on saves in this context, or None"""
+    user = _acting_user.get(_UNSET)
+    return None if user is _UNSET else user
+
+
+@contextmanager
+def acting_user(user) -> Iterator[None]:
+    """
+    Stamps saves with the given user for the duration of the block, e.g.
+    in a management command or a background task
+    """
+    token = _acting_user.set(user)
+    try:
+        yield
+    finally:
+        _acting_user.reset(token)
+
+
+def stamp_whodidit(instances: T, user=_UNSET) -> T:
+    """
+    Sets created_by and modified_by on instances that are written without
+    save(), e.g. with bulk_create, which doesn't send pre_save. The user
+    defaults to the acting user. Returns the instances.
+    """
+    if user is _UNSET:
+        user = _acting_user.get(_UNSET)
+        if user is _UNSET:
+            return instances
+
+    for instance in instances:
+        mark_whodidit(user, instance)
+    return instances
+
+
+def mark_whodidit(user, instance) -> None:
+    if hasattr(instance, 'created_by_id') and not instance.created_by_id:
+        instance.created_by = user
+    if hasattr(instance, 'modified_by_id'):
+        instance.modified_by = user
+
+
+@receiver(signals.pre_save, dispatch_uid='locustempus.main.whodidit')
+def whodidit_pre_save(sender, instance, **kwargs):
+    user = _acting_user.get(_UNSET)
+    if user is not _UNSET:
+        mark_whodidit(user, instance)
 
 
 class WhoDidItMiddleware(object):
+    sync_capable = True
+    async_capable = True
 
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
-        if request.method not in ('GET', 'HEAD', 'OPTIONS', 'TRACE'):
-            if hasattr(request, 'user') and request.user.is_authenticated:
-                user = request.user
-            else:
-                user = None
-
-            mark_whodidit = curry(self.mark_whodidit, user)
-            signals.pre_save.connect(
-                mark_whodidit,
-                dispatch_uid=(self.__class__, request,),
-                weak=False)
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
 
-        response = self.get_response(request)
+        if request.method in SAFE_METHODS:
+            return self.get_response(request)
 
-        signals.pre_save.disconnect(dispatch_uid=(self.__class__, request,))
+        user = getattr(request, 'user', None)
+        with acting_user(user if user and user.is_authenticated else None):
+            return self.get_response(request)
 
-        return response
+    async def __acall__(self, request):
+        if request.method in SAFE_METHODS:
+            return await self.get_response(request)
 
-    def mark_whodidit(self, user, sender, instance, **kwargs):
-        if not getattr(instance, 'created_by_id', None):
-            instance.created_by = user
-        if hasattr(instance, 'modified_by_id'):
-            instance.modified_by = user
+        user = None
+        if hasattr(request, 'auser'):
+            user = await request.auser()
+        with acting_user(user if user and user.is_authenticated else None):
+            return await self.get_response(request)
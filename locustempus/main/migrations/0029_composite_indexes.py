@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:27
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('main', '0028_layer_color'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='layer',
+            index=models.Index(fields=['content_type', 'object_id'], name='layer_content_object_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='response',
+            index=models.Index(fields=['activity', 'status'], name='response_activity_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='response',
+            index=models.Index(condition=models.Q(('status', 'DRAFT'), _negated=True), fields=['activity'], name='response_not_draft_idx'),
+        ),
+    ]
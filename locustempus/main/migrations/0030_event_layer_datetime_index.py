@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:52
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0029_composite_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['layer', 'datetime'], name='event_layer_datetime_idx'),
+        ),
+    ]
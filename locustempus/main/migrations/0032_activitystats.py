@@ -0,0 +1,67 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Max, Q
+
+
+def forwards(apps, schema_editor):
+    """
+    Fills in the stats of the existing activities
+
+    This is a frozen copy of ActivityStats.rebuild_batch as it was when
+    the table was added, written against the historical models. It must
+    not import or call the model's version, and isn't meant to follow
+    later changes to it.
+    """
+    Activity = apps.get_model('main', 'Activity')
+    ActivityStats = apps.get_model('main', 'ActivityStats')
+    Feedback = apps.get_model('main', 'Feedback')
+    ResponseOwner = apps.get_model('main', 'ResponseOwner')
+
+    stats = {
+        pk: ActivityStats(activity_id=pk)
+        for pk in Activity.objects.values_list('pk', flat=True)
+    }
+    for row in apps.get_model('main', 'Response').objects.values(
+            'activity_id').annotate(
+                draft=Count('pk', filter=Q(status='DRAFT')),
+                submitted=Count('pk', filter=Q(status='SUBMITTED')),
+                reviewed=Count('pk', filter=Q(status='REVIEWED')),
+                last=Max('submitted_at')).order_by():
+        activity = stats[row['activity_id']]
+        activity.draft_count = row['draft']
+        activity.submitted_count = row['submitted']
+        activity.reviewed_count = row['reviewed']
+        activity.last_submitted_at = row['last']
+    for row in ResponseOwner.objects.values('activity_id').annotate(
+            count=Count('pk')).order_by():
+        stats[row['activity_id']].owner_count = row['count']
+    for row in Feedback.objects.values('response__activity_id').annotate(
+            last=Max('modified_at')).order_by():
+        stats[row['response__activity_id']].last_feedback_at = row['last']
+
+    ActivityStats.objects.bulk_create(stats.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0031_queuedemail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivityStats',
+            fields=[
+                ('activity', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='main.activity')),
+                ('draft_count', models.IntegerField(default=0)),
+                ('submitted_count', models.IntegerField(default=0)),
+                ('reviewed_count', models.IntegerField(default=0)),
+                ('owner_count', models.IntegerField(default=0)),
+                ('last_submitted_at', models.DateTimeField(null=True)),
+                ('last_feedback_at', models.DateTimeField(null=True)),
+            ],
+        ),
+        migrations.RunPython(forwards, migrations.RunPython.noop),
+    ]
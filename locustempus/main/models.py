@@ -1,13 +1,19 @@
 """Models for the Locus Tempus application"""
+from datetime import timedelta
 from courseaffils.models import Course
-from django.contrib.auth.models import User
+from django.contrib.auth.models import Group, User
 from django.contrib.contenttypes.fields import (
     GenericForeignKey, GenericRelation
 )
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.gis.db.models.fields import PointField, PolygonField
+from django.core.cache import caches
+from django.core.mail import EmailMessage
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.dispatch import receiver
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, F, Max, Q, Value
+from django.db.models.functions import Coalesce, Greatest
 from django_registration.signals import user_activated
 from django.utils import timezone
 from django.conf import settings
@@ -61,6 +67,14 @@ class Layer(models.Model):
         else:
             return ''
 
+    class Meta:
+        indexes = [
+            # Layers are reached through their project or response
+            models.Index(
+                fields=['content_type', 'object_id'],
+                name='layer_content_object_idx'),
+        ]
+
 
 class RasterLayer(Layer):
     url = models.CharField(max_length=2048)
@@ -120,6 +134,14 @@ class Event(models.Model):
     def short_description(self):
         return truncatechars_html(self.description, 100)
 
+    class Meta:
+        indexes = [
+            # Time range queries and histograms, usually within a layer
+            models.Index(
+                fields=['layer', 'datetime'],
+                name='event_layer_datetime_idx'),
+        ]
+
 
 class Location(models.Model):
     event = models.OneToOneField(
@@ -211,19 +233,22 @@ class Activity(models.Model):
         null=True
     )
 
+    def get_stats(self) -> 'ActivityStats':
+        try:
+            return self.stats
+        except ActivityStats.DoesNotExist:
+            # e.g. an activity made with bulk_create
+            ActivityStats.rebuild([self.pk])
+            return ActivityStats.objects.get(activity=self)
+
     def submitted_response_count(self):
-        return self.responses.filter(
-            status__in=['SUBMITTED', 'REVIEWED']).count()
+        return self.get_stats().submitted_response_count
 
     def feedback_count(self):
-        return self.responses.filter(status='REVIEWED').count()
+        return self.get_stats().reviewed_count
 
 
 class Response(models.Model):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self._old_status = self.status
-
     DRAFT = 'DRAFT'
     SUBMITTED = 'SUBMITTED'
     REVIEWED = 'REVIEWED'
@@ -287,17 +312,90 @@ class Response(models.Model):
 
     def owner_strings(self):
         return [
-            owner.get_full_name() if owner.get_full_name() else owner.username
+            owner.get_full_name() or owner.username
             for owner in self.owners.all()
         ]
 
+    # The fields that ActivityStats counts, and those set on submission
+    STATS_FIELDS = ('activity_id', 'status', 'submitted_at')
+    SUBMISSION_FIELDS = ('status', 'submitted_at', 'submitted_by')
+    # The STATS_FIELDS values as last read from or written to the database
+    _saved_stats = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if set(cls.STATS_FIELDS) <= set(field_names):
+            instance._saved_stats = instance.stats_state()
+        return instance
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self._saved_stats = self.stats_state()
+
+    def stats_state(self):
+        return tuple(getattr(self, f) for f in self.STATS_FIELDS)
+
     def save(self, *args, **kwargs):
-        if self.status == self.SUBMITTED and \
-                self._old_status != self.SUBMITTED:
-            self.submitted_at = self.modified_at
-            self.submitted_by = self.modified_by
+        if self.pk is not None and self._saved_stats is not None and \
+                self.stats_state() == self._saved_stats:
+            # Nothing ActivityStats counts has changed, so there is no
+            # transition to lock and count. The submission fields are
+            # left as stored, in case this copy is stale.
+            fields = kwargs.get('update_fields')
+            if fields is None:
+                fields = [
+                    f.name for f in self._meta.concrete_fields
+                    if not f.primary_key]
+            kwargs['update_fields'] = [
+                f for f in fields if f not in self.SUBMISSION_FIELDS]
+            super().save(*args, **kwargs)
+            return
+
+        with transaction.atomic():
+            # The row this save replaces is read under a lock, rather than
+            # trusting the instance, so that concurrent saves of one
+            # response each see the transition they actually make
+            old = None
+            if self.pk is not None:
+                old = Response.objects.select_for_update().filter(
+                    pk=self.pk).values_list(
+                        'activity_id', 'status', 'submitted_at',
+                        'submitted_by').first()
+
+            if self.status == self.SUBMITTED and (
+                    old is None or old[1] != self.SUBMITTED):
+                self.submitted_at = timezone.now()
+                self.submitted_by = self.modified_by
+            elif old is not None:
+                # Only a submission changes these, whatever a stale
+                # instance holds
+                self.submitted_at, self.submitted_by_id = old[2:]
+
+            super().save(*args, **kwargs)
+            self._saved_stats = self.stats_state()
+
+            if old is not None:
+                old = old[:2]
+            new = (self.activity_id, self.status)
+            if old != new:
+                if old is not None:
+                    ActivityStats.count_response(*old, -1)
+                if not ActivityStats.count_response(
+                        *new, 1, submitted_at=self.submitted_at):
+                    ActivityStats.rebuild([self.activity_id])
 
-        super().save(*args, **kwargs)
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['activity', 'status'],
+                name='response_activity_status_idx'),
+            # Most reads skip drafts: faculty views, aggregated layers
+            models.Index(
+                fields=['activity'],
+                condition=~models.Q(status='DRAFT'),
+                name='response_not_draft_idx'),
+        ]
 
 
 class ResponseOwner(models.Model):
@@ -353,11 +451,16 @@ class Feedback(models.Model):
                 'Feedback can not be saved for a response '
                 'that is not submitted or already reviewed')
 
-        if self.response.status == 'SUBMITTED':
-            self.response.status = 'REVIEWED'
-            self.response.save()
+        with transaction.atomic():
+            if self.response.status == 'SUBMITTED':
+                self.response.status = 'REVIEWED'
+                self.response.save()
 
-        super().save(*args, **kwargs)
+            super().save(*args, **kwargs)
+            ActivityStats.objects.filter(
+                activity_id=self.response.activity_id
+            ).update(last_feedback_at=latest(
+                'last_feedback_at', self.modified_at))
 
     def submitted_at_formatted(self):
         # Note the shift from created_at -> submitted_at to better align
@@ -375,6 +478,134 @@ class Feedback(models.Model):
             return ''
 
 
+def latest(field: str, value):
+    """An update expression keeping the later of field and value"""
+    return Greatest(Coalesce(F(field), Value(value)), Value(value))
+
+
+class ActivityStats(models.Model):
+    """
+    An activity's response counts, kept current as responses, owners and
+    feedback are saved, so that dashboards read one row rather than
+    counting responses. The counts are changed with F() expressions in
+    the same transaction as the change they count; the
+    rebuild_activity_stats command recomputes them.
+
+    The last_*_at times aren't moved back when a response or feedback is
+    deleted, until the next rebuild.
+    """
+    activity = models.OneToOneField(
+        Activity,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stats'
+    )
+    draft_count = models.IntegerField(default=0)
+    submitted_count = models.IntegerField(default=0)
+    reviewed_count = models.IntegerField(default=0)
+    # Students with a response, see ResponseOwner
+    owner_count = models.IntegerField(default=0)
+    last_submitted_at = models.DateTimeField(null=True)
+    last_feedback_at = models.DateTimeField(null=True)
+
+    STATUS_FIELDS = {
+        Response.DRAFT: 'draft_count',
+        Response.SUBMITTED: 'submitted_count',
+        Response.REVIEWED: 'reviewed_count',
+    }
+
+    @property
+    def submitted_response_count(self) -> int:
+        return self.submitted_count + self.reviewed_count
+
+    @property
+    def response_count(self) -> int:
+        return self.draft_count + self.submitted_response_count
+
+    @classmethod
+    def count_response(cls, activity_id: int, status: str, delta: int,
+                       submitted_at=None) -> int:
+        """
+        Adds delta to the activity's count of responses with the status,
+        and returns the number of rows updated: 0 if the activity has no
+        stats yet
+        """
+        field = cls.STATUS_FIELDS[status]
+        changes = {field: F(field) + delta}
+        if delta > 0 and status == Response.SUBMITTED and submitted_at:
+            changes['last_submitted_at'] = latest(
+                'last_submitted_at', submitted_at)
+        return cls.objects.filter(activity_id=activity_id).update(**changes)
+
+    @classmethod
+    def count_owners(cls, activity_id: int, delta: int) -> int:
+        return cls.objects.filter(activity_id=activity_id).update(
+            owner_count=F('owner_count') + delta)
+
+    @classmethod
+    def rebuild(cls, activity_ids=None, batch_size: int = 500) -> int:
+        """
+        Recomputes the stats of the given activities, or of all of them,
+        batch_size at a time, and returns the number rebuilt
+        """
+        activities = Activity.objects.order_by('pk')
+        if activity_ids is not None:
+            activities = activities.filter(pk__in=activity_ids)
+        activity_ids = list(activities.values_list('pk', flat=True))
+
+        for i in range(0, len(activity_ids), batch_size):
+            cls.rebuild_batch(activity_ids[i:i + batch_size])
+        return len(activity_ids)
+
+    @classmethod
+    def rebuild_batch(cls, activity_ids) -> None:
+        # Migration 0032 has its own frozen copy of this, which filled in
+        # the existing activities. Changes here don't need to go there.
+        responses = {
+            row['activity_id']: row
+            for row in Response.objects.filter(
+                activity_id__in=activity_ids
+            ).values('activity_id').annotate(
+                draft_count=Count('pk', filter=Q(status=Response.DRAFT)),
+                submitted_count=Count(
+                    'pk', filter=Q(status=Response.SUBMITTED)),
+                reviewed_count=Count(
+                    'pk', filter=Q(status=Response.REVIEWED)),
+                last_submitted_at=Max('submitted_at'),
+            ).order_by()
+        }
+        owners = dict(ResponseOwner.objects.filter(
+            activity_id__in=activity_ids
+        ).values('activity_id').annotate(
+            count=Count('pk')
+        ).order_by().values_list('activity_id', 'count'))
+        feedback = dict(Feedback.objects.filter(
+            response__activity_id__in=activity_ids
+        ).values('response__activity_id').annotate(
+            last=Max('modified_at')
+        ).order_by().values_list('response__activity_id', 'last'))
+
+        stats = []
+        for pk in activity_ids:
+            row = responses.get(pk, {})
+            stats.append(cls(
+                activity_id=pk,
+                draft_count=row.get('draft_count', 0),
+                submitted_count=row.get('submitted_count', 0),
+                reviewed_count=row.get('reviewed_count', 0),
+                owner_count=owners.get(pk, 0),
+                last_submitted_at=row.get('last_submitted_at'),
+                last_feedback_at=feedback.get(pk),
+            ))
+
+        cls.objects.bulk_create(
+            stats, update_conflicts=True, unique_fields=['activity'],
+            update_fields=[
+                'draft_count', 'submitted_count', 'reviewed_count',
+                'owner_count', 'last_submitted_at', 'last_feedback_at'
+            ])
+
+
 class GuestUserAffil(models.Model):
     course = models.ForeignKey(Course, on_delete=models.CASCADE)
     guest_email = models.EmailField()
@@ -387,6 +618,78 @@ class GuestUserAffil(models.Model):
         User, on_delete=models.CASCADE, null=True)
 
 
+class QueuedEmail(models.Model):
+    """
+    An email rendered in a request and sent later by the
+    send_queued_email command. Failed sends are retried with a growing
+    delay, up to MAX_ATTEMPTS times.
+    """
+    PENDING = 'PENDING'
+    SENT = 'SENT'
+    FAILED = 'FAILED'
+
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed')
+    ]
+
+    MAX_ATTEMPTS = 5
+    RETRY_DELAY = timedelta(minutes=1)
+    # How long a worker has to send a claimed batch before it's sent again
+    CLAIM_TIMEOUT = timedelta(minutes=30)
+
+    course = models.ForeignKey(
+        Course,
+        on_delete=models.CASCADE,
+        related_name='queued_emails',
+        null=True
+    )
+    recipient = models.EmailField()
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    status = models.CharField(
+        max_length=12,
+        choices=STATUS_CHOICES,
+        default=PENDING
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(null=True)
+
+    def message(self, connection=None):
+        return EmailMessage(
+            self.subject, self.body, settings.SERVER_EMAIL,
+            [self.recipient], connection=connection)
+
+    def mark_sent(self):
+        self.attempts += 1
+        self.status = self.SENT
+        self.sent_at = timezone.now()
+        self.last_error = ''
+
+    def mark_failed(self, error):
+        """Schedules a retry, or gives up after MAX_ATTEMPTS"""
+        self.attempts += 1
+        self.last_error = str(error) or error.__class__.__name__
+        if self.attempts >= self.MAX_ATTEMPTS:
+            self.status = self.FAILED
+        else:
+            self.next_attempt_at = timezone.now() + \
+                self.RETRY_DELAY * 2 ** (self.attempts - 1)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['next_attempt_at'],
+                condition=models.Q(status='PENDING'),
+                name='queuedemail_pending_idx'),
+        ]
+
+
 @receiver(user_activated)
 def add_user_to_course(sender, **kwargs):
     user = kwargs.get('user')
@@ -395,3 +698,129 @@ def add_user_to_course(sender, **kwargs):
         affil.course.group.user_set.add(user)
     except GuestUserAffil.DoesNotExist:
         pass
+
+
+def course_role_cache():
+    """
+    Returns the cache that holds users' course roles across requests, or
+    None if settings.COURSE_ROLE_CACHE is not set
+    """
+    alias = getattr(settings, 'COURSE_ROLE_CACHE', None)
+    return caches[alias] if alias else None
+
+
+def course_role_cache_key(user_id):
+    return 'locustempus:course_roles:{}'.format(user_id)
+
+
+def invalidate_course_roles(user_ids):
+    cache = course_role_cache()
+    if cache is None:
+        return
+
+    keys = [course_role_cache_key(pk) for pk in user_ids]
+    if not keys:
+        return
+
+    cache.delete_many(keys)
+    # Another request may have cached the old roles before this
+    # transaction commits
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+@receiver(m2m_changed, sender=Group.user_set.through)
+def membership_changed(sender, instance, action, pk_set, **kwargs):
+    """
+    Course roles are group memberships, so drop the cached roles of
+    anyone added to or removed from a group, from either side of the
+    relation
+    """
+    if action not in ('post_add', 'post_remove', 'pre_clear') or \
+            course_role_cache() is None:
+        return
+
+    if isinstance(instance, User):
+        invalidate_course_roles([instance.pk])
+    elif pk_set is not None:
+        invalidate_course_roles(pk_set)
+    else:
+        invalidate_course_roles(
+            instance.user_set.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+def course_changed(sender, instance, **kwargs):
+    """
+    A course's groups may have members before the course exists, e.g. in
+    LTICourseCreate, so drop their cached roles when it is saved
+    """
+    if course_role_cache() is None:
+        return
+
+    invalidate_course_roles(User.objects.filter(
+        groups__in=[instance.group_id, instance.faculty_group_id]
+    ).values_list('pk', flat=True).distinct())
+
+
+@receiver(post_save, sender=User)
+def user_created(sender, instance, created, **kwargs):
+    # Guards against stale roles if a user id is ever reused
+    if created:
+        invalidate_course_roles([instance.pk])
+
+
+@receiver(post_save, sender=Location)
+@receiver(post_delete, sender=Location)
+def location_changed(sender, instance, raw=False, **kwargs):
+    """
+    Tile ETags and cached clusters follow the events' modified_at, so a
+    location saved or deleted on its own marks its event as modified
+    """
+    if not raw:
+        Event.objects.filter(pk=instance.event_id).update(
+            modified_at=timezone.now())
+
+
+@receiver(post_save, sender=Activity)
+def activity_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        ActivityStats.objects.create(activity=instance)
+
+
+@receiver(post_delete, sender=Response)
+def response_deleted(sender, instance, **kwargs):
+    ActivityStats.count_response(instance.activity_id, instance.status, -1)
+
+
+@receiver(post_save, sender=ResponseOwner)
+def response_owner_created(sender, instance, created, raw=False,
+                           **kwargs):
+    if created and not raw:
+        ActivityStats.count_owners(instance.activity_id, 1)
+
+
+@receiver(post_delete, sender=ResponseOwner)
+def response_owner_deleted(sender, instance, **kwargs):
+    ActivityStats.count_owners(instance.activity_id, -1)
+
+
+@receiver(m2m_changed, sender=ResponseOwner)
+def response_owners_added(sender, instance, action, reverse, pk_set,
+                          **kwargs):
+    """
+    Response.owners.add() inserts ResponseOwners without saving them, so
+    count them here. Removals delete them, which sends post_delete.
+    """
+    if action != 'post_add' or not pk_set:
+        return
+
+    if not reverse:
+        ActivityStats.count_owners(instance.activity_id, len(pk_set))
+        return
+
+    # A user added to responses, possibly in several activities
+    activities = Response.objects.filter(pk__in=pk_set).values(
+        'activity_id').annotate(count=Count('pk')).order_by()
+    for row in activities:
+        ActivityStats.count_owners(row['activity_id'], row['count'])
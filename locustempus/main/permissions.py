@@ -1,6 +1,6 @@
 from django.urls import resolve
-from courseaffils.lib import in_course
 from locustempus.main.models import Activity, Response, Project
+from locustempus.main.utils import CourseRoles, get_course_roles
 from rest_framework import permissions
 
 
@@ -32,12 +32,13 @@ class IsLoggedInCourse(permissions.IsAuthenticated):
         if request.method == 'POST':
             return False
 
+        roles = get_course_roles(request)
         if request.method not in permissions.SAFE_METHODS:
-            return obj.course.is_faculty(request.user)
+            return roles.is_faculty(obj.course)
 
         return (
-            obj.course.is_faculty(request.user) or
-            (in_course(request.user.username, obj.course) and
+            roles.is_faculty(obj.course) or
+            (roles.is_true_member(obj.course) and
              hasattr(obj, 'activity'))
         )
 
@@ -53,7 +54,7 @@ class ActivityPermission(permissions.IsAuthenticated):
             try:
                 proj = Project.objects.get(
                     pk=request.data.get('project', None))
-                return proj.course.is_true_faculty(user)
+                return get_course_roles(request).is_true_faculty(proj.course)
             except Project.DoesNotExist:
                 return False
 
@@ -65,10 +66,10 @@ class ActivityPermission(permissions.IsAuthenticated):
         An authenticated user may POST, PUT, DELETE an activity if they are
         faculty in the course.
         """
-        user = request.user
+        roles = get_course_roles(request)
         course = obj.project.course
-        in_course = course.is_true_member(user)
-        is_faculty = course.is_true_faculty(user)
+        in_course = roles.is_true_member(course)
+        is_faculty = roles.is_true_faculty(course)
 
         if request.method in permissions.SAFE_METHODS:
             return in_course
@@ -77,10 +78,11 @@ class ActivityPermission(permissions.IsAuthenticated):
 
 
 class LayerPermission(permissions.IsAuthenticated):
-    def layer_permission_helper(self, layer, user):
+    def layer_permission_helper(self, layer, user, roles=None):
         """
         Checks all the possible conditions for a user to be able
-        to read a layer.
+        to read a layer. The user's CourseRoles are looked up unless
+        passed in.
 
         Project Layer:
         - If the Layer is associated with a Project, and the user is faculty in
@@ -100,13 +102,14 @@ class LayerPermission(permissions.IsAuthenticated):
           user is a student in Layer => Response => Activity => Project =>
           Course
         """
+        roles = roles or CourseRoles(user)
+
         # Project Layer
         if isinstance(layer.content_object, Project):
             project = layer.content_object
             course = project.course
-            is_faculty = course.is_true_faculty(user)
-            is_student = not is_faculty \
-                and course.is_true_member(user)
+            is_faculty = roles.is_true_faculty(course)
+            is_student = roles.is_student(course)
 
             if is_faculty:
                 return True
@@ -124,9 +127,8 @@ class LayerPermission(permissions.IsAuthenticated):
             # Predicates
             is_not_draft = response.status in [
                 Response.SUBMITTED, Response.REVIEWED]
-            is_faculty = course.is_true_faculty(user)
-            is_student = not is_faculty \
-                and course.is_true_member(user)
+            is_faculty = roles.is_true_faculty(course)
+            is_student = roles.is_student(course)
 
             if user in response.owners.all():
                 return True
@@ -153,7 +155,9 @@ class LayerPermission(permissions.IsAuthenticated):
         if user.is_anonymous:
             return False
 
-        if request.method == 'POST':
+        # POSTs to an existing layer, e.g. an import, are checked in
+        # has_object_permission instead
+        if request.method == 'POST' and not getattr(view, 'detail', False):
             view, args, kwargs = resolve(request.data['content_object'])
             model_cls = view.cls._lt_model_cls
             if model_cls is Project:
@@ -162,7 +166,8 @@ class LayerPermission(permissions.IsAuthenticated):
                 except Project.DoesNotExist:
                     return False
 
-                return proj.course.is_true_faculty(user)
+                return get_course_roles(request).is_true_faculty(
+                    proj.course)
 
             if model_cls is Response:
                 try:
@@ -180,12 +185,14 @@ class LayerPermission(permissions.IsAuthenticated):
     def has_object_permission(self, request, view, obj):
         user = request.user
 
+        roles = get_course_roles(request)
+
         if request.method in permissions.SAFE_METHODS:
-            return self.layer_permission_helper(obj, user)
+            return self.layer_permission_helper(obj, user, roles)
 
         else:
             if isinstance(obj.content_object, Project):
-                return obj.content_object.course.is_true_faculty(user)
+                return roles.is_true_faculty(obj.content_object.course)
 
             if isinstance(obj.content_object, Response):
                 return user in obj.content_object.owners.all()
@@ -249,9 +256,10 @@ class IsResponseOwnerOrFaculty(permissions.IsAuthenticated):
                 return False
 
             course = activity.project.course
-            if course.is_true_faculty(user):
+            roles = get_course_roles(request)
+            if roles.is_true_faculty(course):
                 return False
-            elif course.is_true_member(user):
+            elif roles.is_true_member(course):
                 return True
             else:
                 return False
@@ -265,7 +273,7 @@ class IsResponseOwnerOrFaculty(permissions.IsAuthenticated):
             return False
 
         course = obj.activity.project.course
-        if course.is_true_faculty(user) and\
+        if get_course_roles(request).is_true_faculty(course) and\
                 request.method in permissions.SAFE_METHODS and\
                 obj.status is not obj.DRAFT:
             return True
@@ -294,24 +302,33 @@ class IsFeedbackFacultyOrStudentRecipient(permissions.IsAuthenticated):
         if user.is_anonymous:
             return False
 
-        # First try to get an activity from query string params, then
-        # from data in the reqest, else None
-        response_pk = request.data.get('response', None)
-
-        if not response_pk:
-            return False
-
-        try:
-            activity = Response.objects.get(pk=response_pk).activity
-        except Response.DoesNotExist:
+        activity = self.get_activity(request)
+        if activity is None:
             return False
 
         course = activity.project.course
+        roles = get_course_roles(request)
 
         if request.method not in permissions.SAFE_METHODS:
-            return course.is_true_faculty(user)
+            return roles.is_true_faculty(course)
         else:
-            return course.is_true_member(user)
+            return roles.is_true_member(course)
+
+    def get_activity(self, request):
+        """
+        Returns the activity of the response in the request's data, or
+        for reads, of the activity in the query string, else None
+        """
+        response_pk = request.data.get('response', None)
+        activity_pk = request.query_params.get('activity', None)
+        try:
+            if response_pk:
+                return Response.objects.get(pk=response_pk).activity
+            if activity_pk and request.method in permissions.SAFE_METHODS:
+                return Activity.objects.get(pk=activity_pk)
+        except (Response.DoesNotExist, Activity.DoesNotExist, ValueError):
+            pass
+        return None
 
     def has_object_permission(self, request, view, obj):
         # Note that this will not run when the user is requesting a list
@@ -321,9 +338,10 @@ class IsFeedbackFacultyOrStudentRecipient(permissions.IsAuthenticated):
             return False
 
         course = obj.response.activity.project.course
-        if course.is_true_faculty(user):
+        roles = get_course_roles(request)
+        if roles.is_true_faculty(course):
             return True
-        elif course.is_true_member(user) and \
+        elif roles.is_true_member(course) and \
                 request.method in permissions.SAFE_METHODS and \
                 user in obj.response.owners.all():
             return True
@@ -2,8 +2,12 @@ from courseaffils.models import Course
 from django.contrib.gis.geos import Point
 from generic_relations.relations import GenericRelatedField
 from locustempus.main.models import (
-    Layer, Project, Response, Event, Location, Activity, ResponseOwner,
-    MediaObject, Feedback, RasterLayer
+    Layer, Project, Response, Event, Location, Activity, ActivityStats,
+    ResponseOwner, MediaObject, Feedback, RasterLayer
+)
+from locustempus.main.middleware import stamp_whodidit
+from locustempus.main.utils import (
+    get_course_roles, get_layers_for_user, prefetch_layer_relations
 )
 from rest_framework import serializers
 from rest_framework.reverse import reverse
@@ -38,25 +42,23 @@ class ProjectSerializer(serializers.ModelSerializer):
 
     aggregated_layers = serializers.SerializerMethodField()
 
-    def get_aggregated_layers(self, obj):
+    def shares_aggregated_layers(self, obj):
         # If:
         # - the user is a contributor in the project's course
         # - the project has an activity
         # - the user has response for the activity
         # - the status of the user's response is either submitted or reviewed
-        # THEN return a list of other contributor's submitted
+        # THEN the user may see other contributor's submitted
         #   or reviewed response layers
 
         request = self.context['request']
         user = request.user
-        course = obj.course
 
         if not flag_is_active(request, 'share_response_layers'):
-            return []
+            return False
 
         # Conditions
-        is_contributor = course.is_true_member(user) and \
-            not course.is_true_faculty(user)
+        is_contributor = get_course_roles(request).is_student(obj.course)
         has_activity = hasattr(obj, 'activity')
         has_submitted_response = False
         if has_activity:
@@ -66,23 +68,36 @@ class ProjectSerializer(serializers.ModelSerializer):
                 status__in=[Response.SUBMITTED, Response.REVIEWED]
             ).exists()
 
-        if is_contributor and has_activity and has_submitted_response:
-            aggregated_layers = []
-            responses = obj.activity.responses.filter(
-                status__in=[Response.SUBMITTED, Response.REVIEWED]
-            )
-            for response in responses:
-                aggregated_layers.extend([
-                    reverse(
-                        'api-layer-detail',
-                        args=[lyr.pk],
-                        request=request
-                    ) for lyr in response.layers.all()
-                ])
+        return is_contributor and has_activity and has_submitted_response
+
+    def aggregated_layer_queryset(self, obj):
+        """
+        The layers of every submitted or reviewed response to the
+        project's activity, in a single joined query
+        """
+        return Layer.objects.filter(
+            response__activity=obj.activity,
+            response__status__in=[Response.SUBMITTED, Response.REVIEWED]
+        ).order_by('object_id', 'pk')
+
+    def get_aggregated_layers(self, obj):
+        # Returns a list of other contributor's submitted or reviewed
+        # response layers, see shares_aggregated_layers
+        if not self.shares_aggregated_layers(obj):
+            return []
 
-            return aggregated_layers
+        # Reverse the layer detail url once, then fill in each pk
+        prefix, suffix = reverse(
+            'api-layer-detail',
+            args=['PK'],
+            request=self.context['request']
+        ).rsplit('PK', 1)
 
-        return []
+        return [
+            '{}{}{}'.format(prefix, pk, suffix)
+            for pk in self.aggregated_layer_queryset(obj).values_list(
+                'pk', flat=True)
+        ]
 
     class Meta:
         model = Project
@@ -102,6 +117,32 @@ class ActivitySerializer(serializers.ModelSerializer):
         )
 
 
+class ActivityProgressSerializer(serializers.ModelSerializer):
+    """
+    An activity's response counts, read from its ActivityStats.
+    member_count and without_response_count are given in the context.
+    """
+    submitted_response_count = serializers.IntegerField(read_only=True)
+    member_count = serializers.SerializerMethodField()
+    without_response_count = serializers.SerializerMethodField()
+
+    def get_member_count(self, obj):
+        return self.context['member_count']
+
+    def get_without_response_count(self, obj):
+        return max(self.context['member_count'] - obj.owner_count, 0)
+
+    class Meta:
+        model = ActivityStats
+        fields = (
+            'activity', 'draft_count', 'submitted_count', 'reviewed_count',
+            'submitted_response_count', 'owner_count', 'member_count',
+            'without_response_count', 'last_submitted_at',
+            'last_feedback_at'
+        )
+        read_only_fields = fields
+
+
 class FeedbackSerializer(serializers.ModelSerializer):
     class Meta:
         model = Feedback
@@ -116,6 +157,10 @@ class FeedbackSerializer(serializers.ModelSerializer):
 
 
 class ResponseSerializer(serializers.HyperlinkedModelSerializer):
+    """
+    Reads each response's owners, layers, raster layers and feedback, see
+    prefetch_response_relations
+    """
     layers = serializers.HyperlinkedRelatedField(
         read_only=True,
         many=True,
@@ -236,6 +281,78 @@ class EventSerializer(serializers.ModelSerializer):
         read_only_fields = ('owner', 'short_description')
 
 
+class EventListSerializer(serializers.ListSerializer):
+    """
+    Inserts a list of events, with their locations and media, using one
+    bulk_create per table. The created events are returned in the order
+    they were posted.
+    """
+    def create(self, validated_data):
+        layer = self.context['layer']
+        user = self.context['request'].user
+
+        events = []
+        locations = []
+        event_media = []
+        for data in validated_data:
+            data = dict(data)
+            location_data = data.pop('location')
+            media_lst = data.pop('media') or []
+
+            event = Event(layer=layer, **data)
+            events.append(event)
+            locations.append(Location(event=event, **location_data))
+            event_media.append([MediaObject(**m) for m in media_lst])
+
+        # bulk_create skips the pre_save signal that sets created_by
+        media = [m for media_lst in event_media for m in media_lst]
+        stamp_whodidit(events, user)
+        stamp_whodidit(media, user)
+        Event.objects.bulk_create(events)
+        Location.objects.bulk_create(locations)
+        MediaObject.objects.bulk_create(media)
+
+        EventMedia = Event.media.through
+        EventMedia.objects.bulk_create([
+            EventMedia(event_id=event.pk, mediaobject_id=m.pk)
+            for event, media_lst in zip(events, event_media)
+            for m in media_lst
+        ])
+
+        return events
+
+
+class BulkEventItemSerializer(EventSerializer):
+    """An event posted in a bulk request, without its own layer"""
+    class Meta(EventSerializer.Meta):
+        fields = tuple(
+            f for f in EventSerializer.Meta.fields if f != 'layer')
+        list_serializer_class = EventListSerializer
+
+
+class VisibleLayerField(serializers.PrimaryKeyRelatedField):
+    """
+    A layer the requesting user can see. Other layers are reported as
+    not existing, so their ids aren't revealed by a different error.
+    """
+    def get_queryset(self):
+        return get_layers_for_user(self.context['request'].user)
+
+
+class BulkEventSerializer(serializers.Serializer):
+    """
+    Validates a list of events posted together for a single layer, e.g.
+    {"layer": 1, "events": [{"label": "...", "location": {...}}, ...]}
+    """
+    layer = VisibleLayerField()
+    events = BulkEventItemSerializer(many=True, allow_empty=False)
+
+    def create(self, validated_data):
+        events = BulkEventItemSerializer(many=True, context={
+            **self.context, 'layer': validated_data['layer']})
+        return events.create(validated_data['events'])
+
+
 class LayerSerializer(serializers.ModelSerializer):
     events = EventSerializer(many=True, read_only=True)
     content_object = GenericRelatedField({
@@ -255,3 +372,20 @@ class LayerSerializer(serializers.ModelSerializer):
         fields = (
             'title', 'pk', 'content_object', 'events', 'owner', 'color'
         )
+
+
+class ProjectBundleSerializer(ProjectSerializer):
+    """
+    Serializes a project with its layers and aggregated layers inline,
+    rather than as hyperlinks. An 'events' queryset in the context limits
+    the events included in the aggregated layers.
+    """
+    layers = LayerSerializer(read_only=True, many=True)
+
+    def get_aggregated_layers(self, obj):
+        if not self.shares_aggregated_layers(obj):
+            return []
+
+        layers = prefetch_layer_relations(
+            self.aggregated_layer_queryset(obj), self.context.get('events'))
+        return LayerSerializer(layers, many=True, context=self.context).data
@@ -3,10 +3,11 @@ from random import randrange
 
 from courseaffils.models import Course
 from django.contrib.auth.models import User, Group
+from django.contrib.gis.geos import Point
 import factory
 
 from locustempus.main.models import (
-    Project, Activity, Response, Feedback, Layer)
+    Project, Activity, Response, Feedback, Layer, Event, Location)
 
 
 class UserFactory(factory.django.DjangoModelFactory):
@@ -59,6 +60,17 @@ class LayerFactory(factory.django.DjangoModelFactory):
         model = Layer
 
 
+class EventFactory(factory.django.DjangoModelFactory):
+    class Meta:
+        model = Event
+    label = factory.Sequence('Event {}'.format)
+    description = factory.Faker('paragraph')
+
+    @factory.post_generation
+    def generate_location(obj, create, extracted, **kwargs):
+        Location.objects.create(event=obj, point=Point(-73.96, 40.81))
+
+
 class ProjectFactory(factory.django.DjangoModelFactory):
     class Meta:
         model = Project
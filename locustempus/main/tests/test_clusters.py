@@ -0,0 +1,179 @@
+from django.contrib.gis.geos import Point, Polygon
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls.base import reverse
+from locustempus.main.clusters import (
+    CLUSTER_SAMPLE, event_clusters, event_clusters_cache_key, grid_cell
+)
+from locustempus.main.models import Event, Layer, Location
+from locustempus.main.tests.factories import CourseTestMixin, EventFactory
+
+
+class GridCellTest(TestCase):
+    def test_grid_cell(self):
+        # Four cells across the world at zoom 0
+        self.assertEqual(grid_cell(-179, 80, 0), (0, 0))
+        self.assertEqual(grid_cell(1, -1, 0), (2, 2))
+        self.assertEqual(grid_cell(179, -80, 0), (3, 3))
+        self.assertEqual(grid_cell(1, -1, 1), (4, 4))
+        # The edges of the world stay in the grid
+        self.assertEqual(grid_cell(180, -90, 0), (3, 3))
+        self.assertEqual(grid_cell(-180, 90, 0), (0, 0))
+
+
+class ClusterTestMixin(CourseTestMixin):
+    def setUp(self):
+        self.setup_course()
+        self.layer = Layer.objects.create(
+            title='Dense', content_object=self.sandbox_course_project)
+
+        # Points around New York and London
+        self.new_york = [
+            self.create_event(-73.96 + i / 100, 40.81) for i in range(7)]
+        self.london = [self.create_event(-0.12, 51.5 + i / 100)
+                       for i in range(3)]
+
+    def create_event(self, lng, lat, layer=None):
+        event = EventFactory.create(
+            layer=layer or self.layer, created_by=self.faculty)
+        Location.objects.filter(event=event).update(point=Point(lng, lat))
+        return event
+
+
+class EventClustersTest(ClusterTestMixin, TestCase):
+    def test_clusters(self):
+        events = Event.objects.filter(layer=self.layer)
+        new_york, london = event_clusters(events, 3)
+
+        self.assertEqual(new_york['count'], 7)
+        self.assertEqual(
+            new_york['pks'], [e.pk for e in self.new_york[:CLUSTER_SAMPLE]])
+        self.assertAlmostEqual(new_york['centroid'][0], -73.93)
+        self.assertAlmostEqual(new_york['centroid'][1], 40.81)
+        for actual, expected in zip(
+                new_york['bbox'], [-73.96, 40.81, -73.90, 40.81]):
+            self.assertAlmostEqual(actual, expected)
+
+        self.assertEqual(london['count'], 3)
+        self.assertEqual(london['pks'], [e.pk for e in self.london])
+
+    def test_zoom(self):
+        events = Event.objects.filter(layer=self.layer)
+        # Both cities are in the same quarter of the world
+        cluster, = event_clusters(events, 0)
+        self.assertEqual(cluster['count'], 10)
+
+        # Zoomed in far enough, each New York event is on its own
+        clusters = event_clusters(events, 16)
+        self.assertEqual(len(clusters), 10)
+        self.assertEqual({c['count'] for c in clusters}, {1})
+
+    def test_polygon(self):
+        event = self.create_event(10, 10)
+        Location.objects.filter(event=event).update(
+            point=None,
+            polygon=Polygon(((10, 10), (12, 10), (12, 12), (10, 12),
+                             (10, 10))))
+
+        cluster, = event_clusters(Event.objects.filter(pk=event.pk), 3)
+        self.assertEqual(cluster['count'], 1)
+        self.assertAlmostEqual(cluster['centroid'][0], 11)
+        self.assertAlmostEqual(cluster['centroid'][1], 11)
+        self.assertEqual(cluster['bbox'], [10, 10, 12, 12])
+
+    def test_empty(self):
+        self.assertEqual(event_clusters(Event.objects.none(), 3), [])
+
+
+@override_settings(EVENT_CLUSTER_CACHE='default')
+class EventClustersAPITest(ClusterTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.client.force_login(self.faculty)
+
+    def get_clusters(self, **params):
+        r = self.client.get(reverse('api-event-clusters'), params)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.json()['zoom'], params['zoom'])
+        return r.json()['clusters']
+
+    def test_clusters(self):
+        clusters = self.get_clusters(zoom=3, layer=self.layer.pk)
+        self.assertEqual([c['count'] for c in clusters], [7, 3])
+
+        # Filtered to a place
+        clusters = self.get_clusters(zoom=3, bbox='-10,35,30,60')
+        self.assertEqual([c['count'] for c in clusters], [3])
+
+    def test_visibility(self):
+        alt_layer = Layer.objects.create(
+            title='Alt', content_object=self.alt_course_project)
+        self.create_event(-0.12, 51.5, layer=alt_layer)
+
+        self.assertEqual(
+            [c['count'] for c in self.get_clusters(zoom=3)], [7, 3])
+        self.client.force_login(self.alt_faculty)
+        self.assertEqual(
+            [c['count'] for c in self.get_clusters(zoom=3)], [1])
+
+    def test_cache(self):
+        self.get_clusters(zoom=3)
+        with CaptureQueriesContext(connection) as cached:
+            self.get_clusters(zoom=3)
+        # Only the visible layers and the events' state are read
+        self.assertFalse(any(
+            'main_location' in q['sql'] for q in cached.captured_queries))
+
+        # Editing an event clusters again
+        event = self.new_york[0]
+        Location.objects.filter(event=event).update(point=Point(2, 48))
+        event.save()
+        clusters = self.get_clusters(zoom=3)
+        self.assertEqual([c['count'] for c in clusters], [6, 3, 1])
+
+        # As does deleting one
+        self.london[0].delete()
+        clusters = self.get_clusters(zoom=3)
+        self.assertEqual([c['count'] for c in clusters], [6, 2, 1])
+
+    def test_cache_location_saved(self):
+        """Saving only an event's location clusters again"""
+        self.get_clusters(zoom=3)
+        location = self.london[0].location
+        location.point = Point(2, 48)
+        location.save()
+        clusters = self.get_clusters(zoom=3)
+        self.assertEqual([c['count'] for c in clusters], [7, 2, 1])
+
+    def test_query_size(self):
+        """The query and its cache key don't grow with the layers"""
+        def cluster_queries():
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                self.get_clusters(zoom=3)
+            return [len(q['sql']) for q in queries.captured_queries]
+
+        few = cluster_queries()
+        for i in range(50):
+            layer = Layer.objects.create(
+                title='More', content_object=self.sandbox_course_project)
+            self.create_event(-0.12, 51.5, layer=layer)
+        self.assertEqual(cluster_queries(), few)
+
+        key = event_clusters_cache_key(Event.objects.all(), 3)
+        self.assertEqual(
+            len(key), len(event_clusters_cache_key(
+                Event.objects.filter(pk__in=range(1000)), 3)))
+
+    def test_invalid(self):
+        for params in [{}, {'zoom': 'a'}, {'zoom': 30}, {'zoom': -1},
+                       {'zoom': 3, 'bbox': 'a'}]:
+            r = self.client.get(reverse('api-event-clusters'), params)
+            self.assertEqual(r.status_code, 400, params)
+
+        self.client.logout()
+        r = self.client.get(reverse('api-event-clusters'), {'zoom': 3})
+        self.assertEqual(r.status_code, 403)
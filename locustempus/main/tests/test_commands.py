@@ -0,0 +1,112 @@
+from io import StringIO
+import json
+import os
+import tempfile
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from locustempus.main.management.commands.benchmark_indexes import (
+    BENCHMARKED_INDEXES
+)
+from locustempus.main.models import ActivityStats, Layer, Response
+from locustempus.main.tests.factories import CourseTestMixin
+
+
+class BenchmarkIndexesTest(TestCase):
+    def test_benchmark_indexes(self):
+        out = StringIO()
+        call_command(
+            'benchmark_indexes', activities=2, responses=3, layers=2,
+            repeat=1, stdout=out)
+        self.assertIn('layers by content object', out.getvalue())
+        self.assertIn('aggregated layer pks', out.getvalue())
+
+        # The seeded data is rolled back
+        self.assertFalse(Response.objects.exists())
+        self.assertFalse(Layer.objects.exists())
+
+    def test_benchmarked_indexes(self):
+        names = [
+            index.name for model in (Layer, Response)
+            for index in model._meta.indexes
+        ]
+        for name in BENCHMARKED_INDEXES:
+            self.assertIn(name, names)
+
+
+class RebuildActivityStatsTest(CourseTestMixin, TestCase):
+    def setUp(self):
+        self.setup_course()
+
+    def test_rebuild(self):
+        # As after a bulk update around Response.save
+        Response.objects.update(status=Response.SUBMITTED)
+        ActivityStats.objects.filter(
+            activity=self.alt_course_activity).delete()
+
+        out = StringIO()
+        call_command(
+            'rebuild_activity_stats', activities=[
+                self.sandbox_course_activity.pk,
+                self.alt_course_activity.pk
+            ], stdout=out)
+        self.assertIn('Rebuilt the stats of 2 activities.', out.getvalue())
+
+        for activity in [self.sandbox_course_activity,
+                         self.alt_course_activity]:
+            stats = ActivityStats.objects.get(activity=activity)
+            self.assertEqual(stats.draft_count, 0)
+            self.assertEqual(stats.submitted_count, 1)
+            self.assertEqual(stats.owner_count, 1)
+        self.assertEqual(ActivityStats.objects.get(
+            activity=self.registrar_course_activity).submitted_count, 0)
+
+        call_command('rebuild_activity_stats', batch_size=1, verbosity=0)
+        self.assertEqual(ActivityStats.objects.get(
+            activity=self.registrar_course_activity).submitted_count, 1)
+
+
+class ImportLayerTest(CourseTestMixin, TestCase):
+    def setUp(self):
+        self.setup_course()
+        self.layer = Layer.objects.create(
+            title='Import', content_object=self.sandbox_course_project)
+
+        fd, self.path = tempfile.mkstemp(suffix='.geojson')
+        self.addCleanup(os.remove, self.path)
+        with os.fdopen(fd, 'w') as f:
+            for i in range(5):
+                f.write(json.dumps({
+                    'type': 'Feature',
+                    'properties': {'label': str(i)},
+                    'geometry': {
+                        'type': 'Point', 'coordinates': [i * 100, 0]}
+                }) + '\n')
+
+    def test_import_layer(self):
+        out = StringIO()
+        err = StringIO()
+        call_command(
+            'import_layer', self.layer.pk, self.path, chunk_size=2,
+            user=self.faculty.username, stdout=out, stderr=err)
+
+        self.assertIn('Imported 2 events, 0 errors', out.getvalue())
+        self.assertIn('Imported 2 events into "Import"', out.getvalue())
+        self.assertIn('Row 3: Coordinates out of range', err.getvalue())
+        self.assertEqual(self.layer.events.count(), 2)
+        self.assertEqual(
+            self.layer.events.first().created_by, self.faculty)
+
+    def test_import_layer_errors(self):
+        with self.assertRaises(CommandError):
+            call_command('import_layer', 0, self.path)
+        with self.assertRaises(CommandError):
+            call_command(
+                'import_layer', self.layer.pk, self.path, user='nobody')
+        with self.assertRaises(CommandError):
+            call_command('import_layer', self.layer.pk, self.path + '.kml')
+        with self.assertRaises(CommandError):
+            call_command(
+                'import_layer', self.layer.pk, self.path + '.missing',
+                format='csv')
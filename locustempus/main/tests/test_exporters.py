@@ -0,0 +1,80 @@
+import json
+
+from django.contrib.gis.geos import Polygon
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from locustempus.main.exporters import iter_feature_collection
+from locustempus.main.models import Layer, Location, MediaObject
+from locustempus.main.tests.factories import CourseTestMixin, EventFactory
+
+
+class IterFeatureCollectionTest(CourseTestMixin, TestCase):
+    def setUp(self):
+        self.setup_course()
+        self.layer = Layer.objects.create(
+            title='Export', color='blue',
+            content_object=self.sandbox_course_project)
+        self.empty_layer = Layer.objects.create(
+            title='Empty', content_object=self.sandbox_course_project)
+
+    def export(self, layers, chunk_size=1000):
+        return ''.join(iter_feature_collection(layers, chunk_size))
+
+    def test_empty(self):
+        data = json.loads(self.export(Layer.objects.none()))
+        self.assertEqual(data, {
+            'type': 'FeatureCollection', 'layers': [], 'features': []})
+
+    def test_features(self):
+        point_event = EventFactory.create(layer=self.layer)
+        point_event.media.add(MediaObject.objects.create(
+            url='https://example.com/a.jpg', caption='A caption'))
+
+        polygon_event = EventFactory.create(layer=self.layer)
+        Location.objects.filter(event=polygon_event).update(
+            point=None, polygon=Polygon(((0, 0), (0, 1), (1, 1), (0, 0))))
+
+        layers = Layer.objects.filter(
+            pk__in=[self.layer.pk, self.empty_layer.pk])
+        data = json.loads(self.export(layers))
+
+        self.assertEqual(data['layers'], [
+            {'id': self.layer.pk, 'title': 'Export', 'color': 'blue'},
+            {'id': self.empty_layer.pk, 'title': 'Empty', 'color': 'amber'},
+        ])
+        point, polygon = data['features']
+        self.assertEqual(point['id'], point_event.pk)
+        self.assertEqual(point['geometry'], {
+            'type': 'Point', 'coordinates': [-73.96, 40.81]})
+        self.assertEqual(point['properties']['label'], point_event.label)
+        self.assertEqual(point['properties']['layer'], self.layer.pk)
+        self.assertEqual(point['properties']['media'], [{
+            'url': 'https://example.com/a.jpg', 'source': '',
+            'caption': 'A caption', 'alt': ''
+        }])
+        self.assertEqual(polygon['geometry'], {
+            'type': 'Polygon',
+            'coordinates': [[[0, 0], [0, 1], [1, 1], [0, 0]]]
+        })
+
+    def test_chunks(self):
+        for _ in range(7):
+            EventFactory.create(layer=self.layer)
+        layers = Layer.objects.filter(pk=self.layer.pk)
+
+        chunks = list(iter_feature_collection(layers, chunk_size=3))
+        # The opening, two full chunks, and the rest with the closing
+        self.assertEqual(len(chunks), 4)
+        self.assertEqual(len(json.loads(''.join(chunks))['features']), 7)
+
+    def test_constant_memory_queries(self):
+        """The events are read a chunk at a time"""
+        for _ in range(10):
+            EventFactory.create(layer=self.layer)
+        layers = Layer.objects.filter(pk=self.layer.pk)
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.export(layers, chunk_size=5)
+        # The layers, then the events, with a media query per chunk
+        self.assertEqual(len(ctx), 4)
@@ -0,0 +1,232 @@
+from io import BytesIO
+import json
+
+from django.test import TestCase
+from locustempus.main.importers import (
+    ImportFormatError, JSONStream, LayerImporter, detect_format, import_layer,
+    iter_csv, iter_geojson
+)
+from locustempus.main.models import Event, Layer
+from locustempus.main.tests.factories import CourseTestMixin
+
+
+def feature(label, geometry, **properties):
+    properties['label'] = label
+    return {
+        'type': 'Feature',
+        'properties': properties,
+        'geometry': geometry,
+    }
+
+
+def point(lng, lat):
+    return {'type': 'Point', 'coordinates': [lng, lat]}
+
+
+SQUARE = {
+    'type': 'Polygon',
+    'coordinates': [[[0, 0], [0, 1], [1, 1], [1, 0], [0, 0]]]
+}
+
+
+class JSONStreamTest(TestCase):
+    def test_small_chunks(self):
+        """Values split across reads are decoded whole"""
+        stream = JSONStream(BytesIO(b'  [12345, {"a": "\xc3\xa9"}]'), 1)
+        self.assertEqual(stream.expect('['), '[')
+        self.assertEqual(stream.decode(), 12345)
+        self.assertEqual(stream.expect(','), ',')
+        self.assertEqual(stream.decode(), {'a': 'é'})
+        self.assertEqual(stream.expect(']'), ']')
+        self.assertEqual(stream.peek(), '')
+
+    def test_split_character(self):
+        """A read that ends inside a character isn't the end of the file"""
+        data = BytesIO('["é", "日本"]'.encode('utf-8'))
+        data.read = lambda size=-1, read=data.read: read(1)
+        stream = JSONStream(data, 1)
+        self.assertEqual(stream.expect('['), '[')
+        self.assertEqual(stream.decode(), 'é')
+        self.assertEqual(stream.expect(','), ',')
+        self.assertEqual(stream.decode(), '日本')
+        self.assertEqual(stream.expect(']'), ']')
+        self.assertEqual(stream.peek(), '')
+
+    def test_max_value_size(self):
+        """Malformed JSON isn't read past max_value_size"""
+        data = BytesIO(b'[{"a": 1}, {"b": "' + b'x' * 10000 + b'"]')
+        stream = JSONStream(data, 16, max_value_size=100)
+        stream.expect('[')
+        self.assertEqual(stream.decode(), {'a': 1})
+        stream.expect(',')
+        with self.assertRaises(ImportFormatError):
+            stream.decode()
+        self.assertLessEqual(len(stream.buf), 100)
+        self.assertLess(data.tell(), 200)
+
+        # Values up to the limit are read whole
+        value = {'c': 'x' * 80}
+        stream = JSONStream(
+            BytesIO(json.dumps([value]).encode('utf-8')), 16,
+            max_value_size=100)
+        stream.expect('[')
+        self.assertEqual(stream.decode(), value)
+
+    def test_invalid(self):
+        stream = JSONStream(BytesIO(b'{"a": '), 2)
+        stream.expect('{')
+        stream.decode()
+        stream.expect(':')
+        with self.assertRaises(ImportFormatError):
+            stream.decode()
+
+
+class IterGeoJSONTest(TestCase):
+    def read(self, data, chunk_size=7):
+        stream = BytesIO(data.encode('utf-8'))
+        stream.read = lambda size=-1, read=stream.read: read(chunk_size)
+        return list(iter_geojson(stream))
+
+    def test_feature_collection(self):
+        data = json.dumps({
+            'type': 'FeatureCollection',
+            'name': 'test',
+            'features': [
+                feature('A', point(1, 2)),
+                feature('B', SQUARE, Date='2020-01-01'),
+            ],
+            'crs': {'type': 'name'},
+        }, indent=2)
+        records = self.read(data)
+        self.assertEqual(len(records), 2)
+        self.assertEqual(records[0], (1, {'label': 'A'}, point(1, 2)))
+        # Property names are lower-cased
+        self.assertEqual(records[1][1], {'label': 'B', 'date': '2020-01-01'})
+        self.assertEqual(records[1][2], SQUARE)
+
+    def test_feature_sequence(self):
+        data = '\n'.join([
+            json.dumps(feature('A', point(1, 2))),
+            json.dumps(feature('B', point(3, 4))),
+        ])
+        records = self.read(data)
+        self.assertEqual([r[0] for r in records], [1, 2])
+        self.assertEqual(records[1][2], point(3, 4))
+
+    def test_empty_collection(self):
+        self.assertEqual(
+            self.read('{"type": "FeatureCollection", "features": []}'), [])
+
+    def test_not_geojson(self):
+        with self.assertRaises(ImportFormatError):
+            self.read('[1, 2, 3]')
+        with self.assertRaises(ImportFormatError):
+            self.read('{"type": "Topology"}')
+
+
+class IterCSVTest(TestCase):
+    def test_rows(self):
+        data = (
+            'Name,Latitude,Longitude,Date\n'
+            'A,40.5,-73.9,2020-01-01\n'
+            'B,,,\n'
+        )
+        records = list(iter_csv(BytesIO(data.encode('utf-8-sig'))))
+        self.assertEqual(len(records), 2)
+        row, properties, geometry = records[0]
+        self.assertEqual(row, 2)
+        self.assertEqual(properties['name'], 'A')
+        self.assertEqual(geometry, point('-73.9', '40.5'))
+        self.assertEqual(records[1][2], None)
+
+    def test_empty(self):
+        self.assertEqual(list(iter_csv(BytesIO(b''))), [])
+
+
+class LayerImporterTest(CourseTestMixin, TestCase):
+    def setUp(self):
+        self.setup_course()
+        self.layer = Layer.objects.create(
+            title='Import', content_object=self.sandbox_course_project)
+
+    def test_import(self):
+        records = [
+            (1, {'label': 'A', 'date': '1969-07-20'}, point(-73.9, 40.8)),
+            (2, {'title': 'B', 'description': 'Square'}, SQUARE),
+            (3, {}, point(1, 1)),
+        ]
+        importer = LayerImporter(self.layer, self.faculty)
+        result = importer.run(iter(records))
+        self.assertEqual(result.created, 3)
+        self.assertEqual(result.error_count, 0)
+
+        a, b, c = Event.objects.filter(layer=self.layer).order_by('pk')
+        self.assertEqual(a.label, 'A')
+        self.assertEqual(a.datetime.year, 1969)
+        self.assertEqual(a.location.point.coords, (-73.9, 40.8))
+        self.assertIsNone(a.location.polygon)
+        self.assertEqual(a.created_by, self.faculty)
+        self.assertEqual(b.label, 'B')
+        self.assertEqual(b.description, 'Square')
+        self.assertIsNone(b.location.point)
+        self.assertEqual(b.location.polygon.num_points, 5)
+        self.assertEqual(c.label, 'Row 3')
+
+    def test_row_errors(self):
+        records = [
+            (1, {'label': 'ok'}, point(1, 1)),
+            (2, {'label': 'no geometry'}, None),
+            (3, {'label': 'bad point'}, point('a', 1)),
+            (4, {'label': 'out of range'}, point(200, 1)),
+            (5, {'label': 'open ring'}, {
+                'type': 'Polygon',
+                'coordinates': [[[0, 0], [0, 1], [1, 1], [1, 0]]]
+            }),
+            (6, {'label': 'line'}, {
+                'type': 'LineString', 'coordinates': [[0, 0], [1, 1]]
+            }),
+            (7, {'label': 'bad date', 'date': 'not a date'}, point(1, 1)),
+            (8, {'label': 'ok'}, point(2, 2)),
+        ]
+        result = LayerImporter(self.layer).run(iter(records))
+        self.assertEqual(result.created, 2)
+        self.assertEqual(result.error_count, 6)
+        self.assertEqual(
+            [e['row'] for e in result.errors], [2, 3, 4, 5, 6, 7])
+        self.assertEqual(self.layer.events.count(), 2)
+
+    def test_max_errors(self):
+        records = ((i, {}, None) for i in range(150))
+        result = LayerImporter(self.layer).run(records)
+        self.assertEqual(result.error_count, 150)
+        self.assertEqual(len(result.errors), result.max_errors)
+
+    def test_chunks(self):
+        progress = []
+        data = '\n'.join(
+            json.dumps(feature(str(i), point(i % 180, 0)))
+            for i in range(25)
+        ) + '\n{"type": "Feature", "geometry": '
+
+        result = import_layer(
+            self.layer, BytesIO(data.encode('utf-8')), 'geojson',
+            chunk_size=10,
+            progress=lambda r: progress.append(r.created))
+
+        # The events read before the truncated feature are kept
+        self.assertEqual(progress, [10, 20, 25])
+        self.assertEqual(result.created, 25)
+        self.assertEqual(result.error_count, 1)
+        self.assertIsNone(result.errors[0]['row'])
+        self.assertEqual(self.layer.events.count(), 25)
+
+    def test_unsupported_format(self):
+        with self.assertRaises(ImportFormatError):
+            import_layer(self.layer, BytesIO(b''), 'kml')
+
+    def test_detect_format(self):
+        self.assertEqual(detect_format('a.geojson'), 'geojson')
+        self.assertEqual(detect_format('a.JSON'), 'geojson')
+        self.assertEqual(detect_format('a.csv'), 'csv')
+        self.assertIsNone(detect_format('a.kml'))
+        self.assertIsNone(detect_format(None))
@@ -0,0 +1,267 @@
+from datetime import timedelta
+from smtplib import SMTPRecipientsRefused, SMTPServerDisconnected
+
+from django.core import mail
+from django.core.exceptions import ValidationError
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls.base import reverse
+from django.utils import timezone
+from locustempus.main.mailqueue import (
+    queue_emails, send_queued_emails, template_email, template_emails
+)
+from locustempus.main.models import QueuedEmail
+from locustempus.main.tests.factories import CourseTestMixin
+
+
+class FlakyBackend(BaseEmailBackend):
+    """Rejects addresses at bounce.example.com, and counts connections"""
+    def __init__(self, fail_open=False, **kwargs):
+        super().__init__(**kwargs)
+        self.fail_open = fail_open
+        self.opened = 0
+        self.sent = []
+
+    def open(self):
+        if self.fail_open:
+            raise SMTPServerDisconnected('Connection unexpectedly closed')
+        self.opened += 1
+        return True
+
+    def send_messages(self, messages):
+        for message in messages:
+            if message.to[0].endswith('@bounce.example.com'):
+                raise SMTPRecipientsRefused({message.to[0]: (550, b'No')})
+            self.sent.append(message)
+        return len(messages)
+
+
+class MailQueueTest(CourseTestMixin, TestCase):
+    def setUp(self):
+        self.setup_course()
+
+    def queue(self, *recipients):
+        emails = [
+            template_email(
+                'Locus Tempus Invitation', 'main/email/new_user.txt',
+                {'course_title': self.sandbox_course.title}, recipient,
+                course=self.sandbox_course)
+            for recipient in recipients
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            queue_emails(emails)
+
+    def test_template_email(self):
+        email = template_email(
+            'Locus Tempus Invitation', 'main/email/new_user.txt',
+            {'course_title': 'Maps'}, 'abc123@columbia.edu')
+        self.assertIn('Locus Tempus course: Maps', email.body)
+        self.assertIsNone(email.pk)
+
+        with self.assertRaises(ValidationError):
+            template_email(
+                'Locus Tempus Invitation', 'main/email/new_user.txt',
+                {}, 'not an address')
+
+    def test_template_emails(self):
+        emails = template_emails(
+            'Locus Tempus Invitation', 'main/email/new_guest_user.txt', [
+                ('a@example.com', {'guest_email': 'a@example.com'}),
+                ('b@example.com', {'guest_email': 'b@example.com'}),
+            ], course=self.sandbox_course)
+        self.assertEqual(
+            [e.recipient for e in emails], ['a@example.com', 'b@example.com'])
+        self.assertIn('b@example.com', emails[1].body)
+        self.assertEqual(emails[0].course, self.sandbox_course)
+
+        # Every address is checked before anything is rendered
+        with self.assertRaises(ValidationError):
+            template_emails(
+                'Locus Tempus Invitation', 'main/email/new_user.txt',
+                [('a@example.com', {}), ('not an address', {})])
+
+    def test_queue_on_commit(self):
+        email = template_email(
+            'Locus Tempus Invitation', 'main/email/new_user.txt', {},
+            'abc123@columbia.edu')
+        with self.captureOnCommitCallbacks() as callbacks:
+            queue_emails([email])
+            self.assertFalse(QueuedEmail.objects.exists())
+
+        self.assertEqual(len(callbacks), 1)
+        callbacks[0]()
+        self.assertEqual(QueuedEmail.objects.get().status, QueuedEmail.PENDING)
+
+    def test_send(self):
+        self.queue('a@example.com', 'b@example.com', 'c@example.com')
+        backend = FlakyBackend()
+        self.assertEqual(send_queued_emails(connection=backend), 3)
+
+        # One connection for the batch
+        self.assertEqual(backend.opened, 1)
+        self.assertEqual(
+            [m.to for m in backend.sent],
+            [['a@example.com'], ['b@example.com'], ['c@example.com']])
+        for email in QueuedEmail.objects.all():
+            self.assertEqual(email.status, QueuedEmail.SENT)
+            self.assertEqual(email.attempts, 1)
+            self.assertIsNotNone(email.sent_at)
+
+        # Nothing is sent twice
+        self.assertEqual(send_queued_emails(connection=FlakyBackend()), 0)
+
+    def test_batch_size(self):
+        self.queue(*['{}@example.com'.format(i) for i in range(5)])
+        self.assertEqual(send_queued_emails(batch_size=2), 2)
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(QueuedEmail.objects.filter(
+            status=QueuedEmail.PENDING).count(), 3)
+
+    def test_retry(self):
+        self.queue('a@example.com', 'x@bounce.example.com')
+        send_queued_emails(connection=FlakyBackend())
+
+        bounced = QueuedEmail.objects.get(recipient='x@bounce.example.com')
+        self.assertEqual(bounced.status, QueuedEmail.PENDING)
+        self.assertEqual(bounced.attempts, 1)
+        self.assertIn('x@bounce.example.com', bounced.last_error)
+        self.assertGreater(bounced.next_attempt_at, timezone.now())
+        self.assertEqual(
+            QueuedEmail.objects.get(recipient='a@example.com').status,
+            QueuedEmail.SENT)
+
+        # Retries wait for their delay, which doubles each time
+        self.assertEqual(send_queued_emails(connection=FlakyBackend()), 0)
+        delays = []
+        for attempt in range(2, QueuedEmail.MAX_ATTEMPTS + 1):
+            QueuedEmail.objects.filter(pk=bounced.pk).update(
+                next_attempt_at=timezone.now())
+            before = timezone.now()
+            self.assertEqual(
+                send_queued_emails(connection=FlakyBackend()), 1)
+            bounced.refresh_from_db()
+            self.assertEqual(bounced.attempts, attempt)
+            delays.append(bounced.next_attempt_at - before)
+
+        self.assertEqual(bounced.status, QueuedEmail.FAILED)
+        self.assertGreater(delays[1], delays[0])
+        self.assertGreaterEqual(delays[0], timedelta(minutes=2))
+
+        QueuedEmail.objects.filter(pk=bounced.pk).update(
+            next_attempt_at=timezone.now())
+        self.assertEqual(send_queued_emails(connection=FlakyBackend()), 0)
+
+    def test_connection_error(self):
+        self.queue('a@example.com', 'b@example.com')
+        send_queued_emails(connection=FlakyBackend(fail_open=True))
+        for email in QueuedEmail.objects.all():
+            self.assertEqual(email.status, QueuedEmail.PENDING)
+            self.assertEqual(email.attempts, 1)
+            self.assertEqual(
+                email.last_error, 'Connection unexpectedly closed')
+
+    def test_claim(self):
+        """A worker doesn't pick up another's batch while it's sent"""
+        self.queue('a@example.com', 'b@example.com')
+        test = self
+
+        class OtherWorkerBackend(FlakyBackend):
+            def send_messages(self, messages):
+                test.assertEqual(
+                    send_queued_emails(connection=FlakyBackend()), 0)
+                return super().send_messages(messages)
+
+        self.assertEqual(
+            send_queued_emails(connection=OtherWorkerBackend()), 2)
+        self.assertEqual(QueuedEmail.objects.filter(
+            status=QueuedEmail.SENT).count(), 2)
+
+    def test_result_per_email(self):
+        """
+        Each result is saved as it's sent, so a worker that stops partway
+        only sends the rest again, once their claim runs out
+        """
+        self.queue('a@example.com', 'b@example.com', 'c@example.com')
+
+        class StoppingBackend(FlakyBackend):
+            def send_messages(self, messages):
+                if len(self.sent) == 1:
+                    raise KeyboardInterrupt
+                return super().send_messages(messages)
+
+        with self.assertRaises(KeyboardInterrupt):
+            send_queued_emails(connection=StoppingBackend())
+
+        self.assertEqual(
+            QueuedEmail.objects.get(recipient='a@example.com').status,
+            QueuedEmail.SENT)
+        unsent = QueuedEmail.objects.exclude(recipient='a@example.com')
+        for email in unsent:
+            self.assertEqual(email.status, QueuedEmail.PENDING)
+            self.assertEqual(email.attempts, 0)
+            self.assertGreater(email.next_attempt_at, timezone.now())
+        self.assertEqual(send_queued_emails(connection=FlakyBackend()), 0)
+
+        unsent.update(next_attempt_at=timezone.now())
+        backend = FlakyBackend()
+        self.assertEqual(send_queued_emails(connection=backend), 2)
+        self.assertEqual(
+            [m.to for m in backend.sent],
+            [['b@example.com'], ['c@example.com']])
+
+    def test_command(self):
+        self.queue(*['{}@example.com'.format(i) for i in range(5)])
+        call_command('send_queued_email', batch_size=2, verbosity=0)
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertFalse(QueuedEmail.objects.filter(
+            status=QueuedEmail.PENDING).exists())
+
+
+class RosterInviteQueueTest(CourseTestMixin, TestCase):
+    def setUp(self):
+        self.setup_course()
+        self.client.force_login(self.faculty)
+
+    def invite(self, *unis):
+        data = {
+            'uni-TOTAL_FORMS': str(len(unis)),
+            'uni-INITIAL_FORMS': '0',
+            'email-TOTAL_FORMS': '1',
+            'email-INITIAL_FORMS': '0',
+            'email-0-invitee': 'guest@example.com',
+        }
+        for i, uni in enumerate(unis):
+            data['uni-{}-invitee'.format(i)] = uni
+
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(
+                reverse('course-roster-invite-user',
+                        args=[self.sandbox_course.pk]), data)
+
+    def test_invite(self):
+        response = self.invite('abc123', 'def456')
+        self.assertEqual(response.status_code, 302)
+
+        # Nothing is sent during the request
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(
+            set(QueuedEmail.objects.filter(
+                course=self.sandbox_course).values_list(
+                    'recipient', flat=True)),
+            {'abc123@columbia.edu', 'def456@columbia.edu',
+             'guest@example.com'})
+
+        roster = reverse('course-roster-view', args=[self.sandbox_course.pk])
+        response = self.client.get(roster)
+        self.assertContains(response, 'abc123@columbia.edu')
+        self.assertContains(response, 'Pending', count=3)
+
+        send_queued_emails()
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertContains(self.client.get(roster), 'Sent', count=3)
+
+    def test_invalid(self):
+        # An invalid form changes nothing, so queues nothing
+        self.invite('foobar')
+        self.assertFalse(QueuedEmail.objects.exists())
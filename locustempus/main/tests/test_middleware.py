@@ -0,0 +1,185 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import AnonymousUser
+from django.conf import settings
+from django.contrib.gis.geos import Point
+from django.db.models import signals
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from django.utils.module_loading import import_string
+from locustempus.lti.middleware import LtiLaunchMiddleware
+from locustempus.main.middleware import (
+    WhoDidItMiddleware, acting_user, get_acting_user, stamp_whodidit
+)
+from locustempus.main.models import Event, Layer, Location
+from locustempus.main.tests.factories import CourseTestMixin, UserFactory
+from lti_tool.models import AbsentLtiLaunch
+
+
+def stamped_layer():
+    """Sends pre_save for a new layer, as Layer.save() would"""
+    layer = Layer(title='Layer')
+    signals.pre_save.send(sender=Layer, instance=layer)
+    return layer
+
+
+class WhoDidItMiddlewareTest(SimpleTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.user = UserFactory.build(pk=1)
+
+    def request(self, method, user):
+        request = getattr(self.factory, method)('/')
+        request.user = user
+
+        async def auser():
+            return user
+        request.auser = auser
+        return request
+
+    def test_write(self):
+        middleware = WhoDidItMiddleware(lambda r: stamped_layer())
+        layer = middleware(self.request('post', self.user))
+        self.assertEqual(layer.created_by, self.user)
+        self.assertEqual(layer.modified_by, self.user)
+
+        # The user is only stamped during the request
+        self.assertIsNone(get_acting_user())
+        self.assertIsNone(stamped_layer().created_by)
+
+    def test_read(self):
+        middleware = WhoDidItMiddleware(lambda r: stamped_layer())
+        layer = middleware(self.request('get', self.user))
+        self.assertIsNone(layer.created_by)
+
+    def test_anonymous(self):
+        middleware = WhoDidItMiddleware(lambda r: stamped_layer())
+        layer = middleware(self.request('post', AnonymousUser()))
+        self.assertIsNone(layer.created_by)
+
+    def test_created_by_kept(self):
+        other = UserFactory.build(pk=2)
+
+        def get_response(request):
+            layer = Layer(title='Layer', created_by=other)
+            signals.pre_save.send(sender=Layer, instance=layer)
+            return layer
+
+        layer = WhoDidItMiddleware(get_response)(
+            self.request('put', self.user))
+        self.assertEqual(layer.created_by, other)
+        self.assertEqual(layer.modified_by, self.user)
+
+    def test_receivers(self):
+        receivers = len(signals.pre_save.receivers)
+
+        def get_response(request):
+            self.assertEqual(len(signals.pre_save.receivers), receivers)
+            return HttpResponse()
+
+        WhoDidItMiddleware(get_response)(self.request('post', self.user))
+        self.assertEqual(len(signals.pre_save.receivers), receivers)
+
+    def test_concurrent_writers(self):
+        writers = 32
+        users = [UserFactory.build(pk=i) for i in range(1, writers + 1)]
+        # Every request is in flight before any of them saves
+        barrier = threading.Barrier(writers)
+
+        def get_response(request):
+            barrier.wait(timeout=10)
+            return stamped_layer()
+
+        middleware = WhoDidItMiddleware(get_response)
+        with ThreadPoolExecutor(max_workers=writers) as pool:
+            layers = list(pool.map(
+                lambda user: middleware(self.request('post', user)), users))
+
+        self.assertEqual([layer.created_by for layer in layers], users)
+        self.assertEqual([layer.modified_by for layer in layers], users)
+
+    async def test_async_concurrent_writers(self):
+        writers = 32
+        users = [UserFactory.build(pk=i) for i in range(1, writers + 1)]
+        started = asyncio.Event()
+        in_flight = []
+
+        async def get_response(request):
+            in_flight.append(request)
+            if len(in_flight) == writers:
+                started.set()
+            await started.wait()
+            return stamped_layer()
+
+        middleware = WhoDidItMiddleware(get_response)
+        layers = await asyncio.gather(*[
+            middleware(self.request('post', user)) for user in users])
+
+        self.assertEqual([layer.created_by for layer in layers], users)
+        self.assertEqual([layer.modified_by for layer in layers], users)
+        self.assertIsNone(get_acting_user())
+
+
+class StampWhoDidItTest(CourseTestMixin, TestCase):
+    def setUp(self):
+        self.setup_course()
+        self.layer = Layer.objects.create(
+            title='Layer', content_object=self.sandbox_course_project)
+
+    def test_save(self):
+        with acting_user(self.faculty):
+            layer = Layer.objects.create(
+                title='Saved', content_object=self.sandbox_course_project)
+        self.assertEqual(layer.created_by, self.faculty)
+        self.assertEqual(layer.modified_by, self.faculty)
+
+    def test_bulk_create(self):
+        with acting_user(self.faculty):
+            events = Event.objects.bulk_create(stamp_whodidit([
+                Event(layer=self.layer, label=str(i)) for i in range(3)]))
+        Location.objects.bulk_create(
+            [Location(event=e, point=Point(0, 0)) for e in events])
+
+        for event in Event.objects.filter(layer=self.layer):
+            self.assertEqual(event.created_by, self.faculty)
+            self.assertEqual(event.modified_by, self.faculty)
+
+    def test_explicit_user(self):
+        events = stamp_whodidit(
+            [Event(layer=self.layer, created_by=self.student)], self.faculty)
+        self.assertEqual(events[0].created_by, self.student)
+        self.assertEqual(events[0].modified_by, self.faculty)
+
+    def test_no_acting_user(self):
+        event, = stamp_whodidit([Event(layer=self.layer)])
+        self.assertIsNone(event.created_by)
+
+
+class AsyncMiddlewareTest(SimpleTestCase):
+    def test_async_capable(self):
+        # A sync-only middleware would run every request below it, async
+        # views included, in a thread under ASGI
+        for path in settings.MIDDLEWARE:
+            self.assertTrue(
+                getattr(import_string(path), 'async_capable', False), path)
+
+    def lti_request(self):
+        request = RequestFactory().get('/')
+        request.session = {}
+        return request
+
+    def test_lti_launch(self):
+        request = self.lti_request()
+        LtiLaunchMiddleware(lambda r: HttpResponse())(request)
+        self.assertIsInstance(request.lti_launch, AbsentLtiLaunch)
+
+    async def test_lti_launch_async(self):
+        async def get_response(request):
+            return HttpResponse()
+
+        request = self.lti_request()
+        response = await LtiLaunchMiddleware(get_response)(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsInstance(request.lti_launch, AbsentLtiLaunch)
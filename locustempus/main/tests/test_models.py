@@ -1,11 +1,37 @@
+import random
+import threading
+
 from django.contrib.auth.models import User
-from django.db.utils import IntegrityError
-from django.test import TestCase
+from django.db import connection, transaction
+from django.db.utils import IntegrityError, OperationalError
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from locustempus.main.models import (
+    Activity, ActivityStats, Feedback, Response, ResponseOwner
+)
 from locustempus.main.tests.factories import (
     RegistrarCourseFactory, ProjectFactory, ActivityFactory,
     ResponseFactory, UserFactory
 )
 
+STATS_FIELDS = [
+    'draft_count', 'submitted_count', 'reviewed_count', 'owner_count',
+    'last_submitted_at', 'last_feedback_at'
+]
+
+
+def stats_values(activity):
+    return ActivityStats.objects.filter(
+        activity=activity).values(*STATS_FIELDS).get()
+
+
+class ActivityStatsMixin(object):
+    def assertStatsRebuilt(self, activity):
+        """Checks the kept stats match a recount"""
+        kept = stats_values(activity)
+        ActivityStats.rebuild([activity.pk])
+        self.assertEqual(kept, stats_values(activity))
+
 
 class ResponseModelTest(TestCase):
     def test_unique_owner_per_response(self):
@@ -73,3 +99,205 @@ class ResponseModelTest(TestCase):
 
         # Check that the fields have updated
         self.assertIsNot(response.submitted_at, None)
+
+
+class ActivityStatsTest(ActivityStatsMixin, TestCase):
+    def setUp(self):
+        self.activity = ActivityFactory()
+
+    def test_counts(self):
+        students = UserFactory.create_batch(3)
+        responses = [
+            ResponseFactory(activity=self.activity, owners=[student])
+            for student in students
+        ]
+        stats = self.activity.stats
+        stats.refresh_from_db()
+        self.assertEqual(stats.draft_count, 3)
+        self.assertEqual(stats.owner_count, 3)
+
+        responses[0].status = Response.SUBMITTED
+        responses[0].save()
+        responses[1].status = Response.SUBMITTED
+        responses[1].save()
+        Feedback.objects.create(response=responses[1], body='Good')
+
+        stats.refresh_from_db()
+        self.assertEqual(stats.draft_count, 1)
+        self.assertEqual(stats.submitted_count, 1)
+        self.assertEqual(stats.reviewed_count, 1)
+        self.assertIsNotNone(stats.last_feedback_at)
+        self.assertEqual(self.activity.submitted_response_count(), 2)
+        self.assertEqual(self.activity.feedback_count(), 1)
+        self.assertStatsRebuilt(self.activity)
+
+        responses[2].delete()
+        stats.refresh_from_db()
+        self.assertEqual(stats.draft_count, 0)
+        self.assertEqual(stats.owner_count, 2)
+
+    def test_last_submitted_at(self):
+        response = ResponseFactory(activity=self.activity)
+        response.status = Response.SUBMITTED
+        response.save()
+        self.assertEqual(
+            stats_values(self.activity)['last_submitted_at'],
+            response.submitted_at)
+        self.assertStatsRebuilt(self.activity)
+
+    def test_owners(self):
+        response = ResponseFactory(activity=self.activity)
+        students = UserFactory.create_batch(3)
+        response.owners.add(
+            *students[:2], through_defaults={'activity': self.activity})
+        ResponseOwner.objects.create(
+            owner=students[2], response=response, activity=self.activity)
+        self.assertEqual(stats_values(self.activity)['owner_count'], 3)
+
+        response.owners.remove(students[0])
+        self.assertEqual(stats_values(self.activity)['owner_count'], 2)
+        response.owners.clear()
+        self.assertEqual(stats_values(self.activity)['owner_count'], 0)
+
+        # From the user's side, across activities
+        other = ResponseFactory()
+        students[0].response_set.add(
+            response, through_defaults={'activity': self.activity})
+        self.assertEqual(stats_values(self.activity)['owner_count'], 1)
+        self.assertStatsRebuilt(self.activity)
+        self.assertStatsRebuilt(other.activity)
+
+    def test_missing_stats(self):
+        activity = Activity.objects.bulk_create([
+            Activity(project=ProjectFactory(), instructions='Bulk')])[0]
+        self.assertFalse(ActivityStats.objects.filter(
+            activity=activity).exists())
+
+        # The first response rebuilds them
+        ResponseFactory(activity=activity, status=Response.SUBMITTED)
+        self.assertEqual(stats_values(activity)['submitted_count'], 1)
+
+        ActivityStats.objects.filter(activity=activity).delete()
+        activity = Activity.objects.get(pk=activity.pk)
+        self.assertEqual(activity.submitted_response_count(), 1)
+
+    def test_stale_instances(self):
+        """
+        Two requests that loaded a response as a draft both submit it:
+        the second save is no transition, and isn't counted again
+        """
+        response = ResponseFactory(activity=self.activity)
+        first = Response.objects.get(pk=response.pk)
+        second = Response.objects.get(pk=response.pk)
+
+        first.status = Response.SUBMITTED
+        first.save()
+        second.status = Response.SUBMITTED
+        second.save()
+        self.assertEqual(stats_values(self.activity)['submitted_count'], 1)
+        self.assertEqual(stats_values(self.activity)['draft_count'], 0)
+
+        # Feedback given on a copy loaded before a later unsubmit
+        stale = Response.objects.get(pk=response.pk)
+        first.status = Response.DRAFT
+        first.save()
+        Feedback.objects.create(response=stale, body='Good')
+        self.assertStatsRebuilt(self.activity)
+
+    def test_unchanged_status(self):
+        """A save that changes no counted field is a single UPDATE"""
+        response = ResponseFactory(
+            activity=self.activity, status=Response.SUBMITTED)
+        response = Response.objects.get(pk=response.pk)
+        submitted_at = response.submitted_at
+
+        response.reflection = 'Edited'
+        with CaptureQueriesContext(connection) as queries:
+            response.save()
+        self.assertEqual(len(queries), 1)
+        self.assertTrue(
+            queries[0]['sql'].startswith('UPDATE "main_response"'))
+
+        response.refresh_from_db()
+        self.assertEqual(response.reflection, 'Edited')
+        self.assertEqual(response.submitted_at, submitted_at)
+        self.assertStatsRebuilt(self.activity)
+
+    def test_stale_unchanged_status(self):
+        """A stale copy saved without a status change keeps the new one"""
+        response = ResponseFactory(activity=self.activity)
+        stale = Response.objects.get(pk=response.pk)
+        response.status = Response.SUBMITTED
+        response.save()
+
+        stale.reflection = 'Edited'
+        stale.save()
+        response.refresh_from_db()
+        self.assertEqual(response.status, Response.SUBMITTED)
+        self.assertIsNotNone(response.submitted_at)
+        self.assertEqual(response.reflection, 'Edited')
+        self.assertStatsRebuilt(self.activity)
+
+    def test_interleaved_transitions(self):
+        rng = random.Random(25)
+        responses = ResponseFactory.create_batch(10, activity=self.activity)
+        # Three copies of each response, as concurrent requests hold
+        copies = [
+            Response.objects.get(pk=r.pk) for r in responses for _ in range(3)
+        ]
+        statuses = [Response.DRAFT, Response.SUBMITTED, Response.REVIEWED]
+        for _ in range(200):
+            copy = rng.choice(copies)
+            copy.status = rng.choice(statuses)
+            copy.save()
+
+        self.assertEqual(
+            sum(stats_values(self.activity)[f] for f in STATS_FIELDS[:3]), 10)
+        self.assertStatsRebuilt(self.activity)
+
+
+class ActivityStatsConcurrencyTest(ActivityStatsMixin, TransactionTestCase):
+    def save(self, response, status):
+        # SQLite raises rather than waits when another thread is
+        # writing, so each transition is retried until it gets its turn
+        while True:
+            try:
+                with transaction.atomic():
+                    response.status = status
+                    response.save()
+                return
+            except OperationalError as e:
+                if 'locked' not in str(e):
+                    raise
+
+    def test_concurrent_transitions(self):
+        activity = ActivityFactory()
+        responses = ResponseFactory.create_batch(4, activity=activity)
+        threads = 8
+        barrier = threading.Barrier(threads)
+        errors = []
+
+        def work(n):
+            rng = random.Random(n)
+            # Every thread loads the responses before any saves
+            copies = [Response.objects.get(pk=r.pk) for r in responses]
+            try:
+                barrier.wait(timeout=10)
+                for _ in range(10):
+                    self.save(rng.choice(copies), rng.choice([
+                        Response.DRAFT, Response.SUBMITTED,
+                        Response.REVIEWED]))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        workers = [
+            threading.Thread(target=work, args=(n,)) for n in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(errors, [])
+        self.assertStatsRebuilt(activity)
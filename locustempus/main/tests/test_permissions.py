@@ -232,6 +232,24 @@ class IsFeedbackFacultyOrStudentRecipientTest(CourseTestMixin, TestCase):
         req.user = self.student
         self.assertFalse(perm.has_permission(req, None))
 
+    def test_has_permissions_list_get_activity(self):
+        """Tests GET list permissions for an activity's feedback"""
+        perm = IsFeedbackFacultyOrStudentRecipient()
+        req = RequestFactory().get(reverse('api-feedback-list'))
+        req.query_params = {'activity': self.sandbox_course_activity.pk}
+        req.data = dict()
+
+        req.user = self.faculty
+        self.assertTrue(perm.has_permission(req, None))
+        req.user = self.student
+        self.assertTrue(perm.has_permission(req, None))
+        req.user = self.alt_faculty
+        self.assertFalse(perm.has_permission(req, None))
+
+        req.query_params = {'activity': 'a'}
+        req.user = self.faculty
+        self.assertFalse(perm.has_permission(req, None))
+
     def test_has_permissions_obj_get(self):
         """Tests GET permissions"""
         perm = IsFeedbackFacultyOrStudentRecipient()
@@ -0,0 +1,303 @@
+import struct
+
+from django.contrib.gis.geos import Point, Polygon
+from django.test import TestCase
+from django.urls.base import reverse
+from locustempus.main.models import Layer, Location, Response
+from locustempus.main.tests.factories import (
+    CourseTestMixin, EventFactory, ResponseFactory, UserFactory
+)
+from locustempus.main.tiles import (
+    MVT_EXTENT, encode_tile, is_valid_tile, tile_bounds, tile_coords
+)
+
+
+def read_varint(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, pos
+
+
+def read_fields(data):
+    """Decodes a protocol buffer message to a list of (field, value)"""
+    fields = []
+    pos = 0
+    while pos < len(data):
+        key, pos = read_varint(data, pos)
+        field, wire_type = key >> 3, key & 0x7
+        if wire_type == 0:
+            value, pos = read_varint(data, pos)
+        elif wire_type == 1:
+            value = struct.unpack('<d', data[pos:pos + 8])[0]
+            pos += 8
+        else:
+            length, pos = read_varint(data, pos)
+            value = data[pos:pos + length]
+            pos += length
+        fields.append((field, value))
+    return fields
+
+
+def read_packed(data):
+    values = []
+    pos = 0
+    while pos < len(data):
+        value, pos = read_varint(data, pos)
+        values.append(value)
+    return values
+
+
+def unzigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+def decode_geometry(commands):
+    """Decodes geometry commands to a list of rings or points"""
+    parts = []
+    x = y = 0
+    i = 0
+    while i < len(commands):
+        cmd, count = commands[i] & 0x7, commands[i] >> 3
+        i += 1
+        if cmd == 7:
+            continue
+        if cmd == 1:
+            parts.append([])
+        for _ in range(count):
+            x += unzigzag(commands[i])
+            y += unzigzag(commands[i + 1])
+            i += 2
+            parts[-1].append((x, y))
+    return parts
+
+
+def decode_layer(data):
+    layer = dict(features=[], keys=[], values=[])
+    for field, value in read_fields(data):
+        if field == 1:
+            layer['name'] = value.decode('utf-8')
+        elif field == 2:
+            layer['features'].append(dict(read_fields(value)))
+        elif field == 3:
+            layer['keys'].append(value.decode('utf-8'))
+        elif field == 4:
+            (vf, v), = read_fields(value)
+            layer['values'].append(v.decode('utf-8') if vf == 1 else v)
+        elif field == 5:
+            layer['extent'] = value
+        elif field == 15:
+            layer['version'] = value
+    return layer
+
+
+def decode_tile(data):
+    layers = {}
+    for field, layer_data in read_fields(data):
+        if field != 3:
+            continue
+        layer = decode_layer(layer_data)
+
+        features = []
+        for feature in layer['features']:
+            tags = read_packed(feature.get(2, b''))
+            features.append({
+                'id': feature[1],
+                'type': feature[3],
+                'geometry': decode_geometry(read_packed(feature[4])),
+                'properties': {
+                    layer['keys'][k]: layer['values'][v]
+                    for k, v in zip(tags[::2], tags[1::2])
+                }
+            })
+        layer['features'] = features
+        layers[layer['name']] = layer
+    return layers
+
+
+class TileMathTest(TestCase):
+    def test_is_valid_tile(self):
+        self.assertTrue(is_valid_tile(0, 0, 0))
+        self.assertTrue(is_valid_tile(2, 3, 3))
+        self.assertFalse(is_valid_tile(2, 4, 0))
+        self.assertFalse(is_valid_tile(2, 0, 4))
+        self.assertFalse(is_valid_tile(25, 0, 0))
+
+    def test_tile_bounds(self):
+        west, south, east, north = tile_bounds(0, 0, 0)
+        self.assertAlmostEqual(west, -180)
+        self.assertAlmostEqual(east, 180)
+        self.assertAlmostEqual(north, 85.0511, places=4)
+        self.assertAlmostEqual(south, -85.0511, places=4)
+
+        west, south, east, north = tile_bounds(1, 1, 0)
+        self.assertAlmostEqual(west, 0)
+        self.assertAlmostEqual(south, 0)
+
+    def test_tile_coords(self):
+        self.assertEqual(tile_coords(0, 0, 0, 0, 0), (2048, 2048))
+        self.assertEqual(tile_coords(-180, 85.06, 0, 0, 0), (0, 0))
+        self.assertEqual(tile_coords(0, 0, 1, 1, 1), (0, 0))
+        # Coordinates outside the tile fall outside the extent
+        self.assertEqual(tile_coords(-90, 0, 1, 1, 1), (-2048, 0))
+
+
+class EncodeTileTest(TestCase):
+    def test_empty(self):
+        self.assertEqual(encode_tile([], 0, 0, 0), b'')
+
+    def test_point(self):
+        tile = decode_tile(encode_tile([
+            (7, Point(0, 0), {'label': 'A', 'datetime': None}),
+            (8, Point(90, 0), {'label': 'A', 'count': 2}),
+        ], 0, 0, 0))
+        layer = tile['events']
+        self.assertEqual(layer['version'], 2)
+        self.assertEqual(layer['extent'], MVT_EXTENT)
+        self.assertEqual(layer['keys'], ['label', 'count'])
+        # Values are shared between features
+        self.assertEqual(layer['values'], ['A', 4])
+
+        a, b = layer['features']
+        self.assertEqual(a['id'], 7)
+        self.assertEqual(a['type'], 1)
+        self.assertEqual(a['geometry'], [[(2048, 2048)]])
+        self.assertEqual(a['properties'], {'label': 'A'})
+        self.assertEqual(b['geometry'], [[(3072, 2048)]])
+
+    def test_polygon_winding(self):
+        # Counter-clockwise on a map, so clockwise in tile coordinates
+        # once reversed
+        exterior = ((0, 0), (90, 0), (90, 45), (0, 45), (0, 0))
+        hole = ((10, 10), (10, 20), (20, 20), (20, 10), (10, 10))
+        tile = decode_tile(encode_tile([
+            (1, Polygon(exterior, hole), {}),
+        ], 0, 0, 0))
+
+        feature, = tile['events']['features']
+        self.assertEqual(feature['type'], 3)
+        outer, inner = feature['geometry']
+        self.assertEqual(len(outer), 4)
+        self.assertEqual(len(inner), 4)
+
+        def area(ring):
+            return sum(
+                x1 * y2 - x2 * y1
+                for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1]))
+        self.assertGreater(area(outer), 0)
+        self.assertLess(area(inner), 0)
+
+    def test_polygon_too_small(self):
+        tiny = Polygon(((0, 0), (0.001, 0), (0.001, 0.001), (0, 0)))
+        self.assertEqual(encode_tile([(1, tiny, {})], 0, 0, 0), b'')
+
+
+class LayerTileViewTest(CourseTestMixin, TestCase):
+    def setUp(self):
+        self.setup_course()
+        self.layer = Layer.objects.create(
+            title='Tiles', content_object=self.sandbox_course_project)
+        self.new_york = EventFactory.create(layer=self.layer)
+        self.polygon_event = EventFactory.create(layer=self.layer)
+        Location.objects.filter(event=self.polygon_event).update(
+            point=None,
+            polygon=Polygon(
+                ((10, 10), (11, 10), (11, 11), (10, 11), (10, 10))))
+
+    def url(self, z, x, y, layer=None):
+        return reverse('layer-tile', kwargs={
+            'pk': (layer or self.layer).pk, 'z': z, 'x': x, 'y': y})
+
+    def test_tile(self):
+        self.client.force_login(self.faculty)
+        r = self.client.get(self.url(0, 0, 0))
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(
+            r['Content-Type'], 'application/vnd.mapbox-vector-tile')
+        self.assertIn('private', r['Cache-Control'])
+        self.assertTrue(r['ETag'])
+
+        features = decode_tile(r.content)['events']['features']
+        self.assertEqual(
+            [f['id'] for f in features],
+            [self.new_york.pk, self.polygon_event.pk])
+        self.assertEqual(
+            features[0]['properties'], {'label': self.new_york.label})
+        self.assertEqual(features[1]['type'], 3)
+
+        # The western hemisphere at zoom 1 only has New York
+        r = self.client.get(self.url(1, 0, 0))
+        features = decode_tile(r.content)['events']['features']
+        self.assertEqual([f['id'] for f in features], [self.new_york.pk])
+
+        # An empty tile
+        r = self.client.get(self.url(1, 0, 1))
+        self.assertEqual(r.status_code, 204)
+
+    def test_etag(self):
+        self.client.force_login(self.faculty)
+        r = self.client.get(self.url(0, 0, 0))
+        etag = r['ETag']
+
+        r = self.client.get(self.url(0, 0, 0), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(r.status_code, 304)
+        self.assertEqual(r.content, b'')
+
+        # Other tiles have other ETags
+        r = self.client.get(self.url(1, 0, 0))
+        self.assertNotEqual(r['ETag'], etag)
+
+        # Editing an event changes the ETag
+        self.new_york.label = 'Edited'
+        self.new_york.save()
+        r = self.client.get(self.url(0, 0, 0), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(r.status_code, 200)
+        self.assertNotEqual(r['ETag'], etag)
+
+        # And saving only its location
+        etag = r['ETag']
+        location = self.new_york.location
+        location.point = Point(-74, 40.7)
+        location.save()
+        r = self.client.get(self.url(0, 0, 0), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(r.status_code, 200)
+        self.assertNotEqual(r['ETag'], etag)
+
+        # As does deleting one
+        etag = r['ETag']
+        self.polygon_event.delete()
+        r = self.client.get(self.url(0, 0, 0), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(r.status_code, 200)
+
+    def test_access(self):
+        # Students can see project layers in projects with an activity
+        self.client.force_login(self.student)
+        self.assertEqual(self.client.get(self.url(0, 0, 0)).status_code, 200)
+
+        self.client.force_login(self.alt_faculty)
+        self.assertEqual(self.client.get(self.url(0, 0, 0)).status_code, 404)
+
+        self.client.logout()
+        self.assertEqual(self.client.get(self.url(0, 0, 0)).status_code, 403)
+
+        # A classmate's draft response layer is hidden
+        classmate = UserFactory.create()
+        self.sandbox_course.group.user_set.add(classmate)
+        response = ResponseFactory.create(
+            activity=self.sandbox_course_activity, owners=[classmate],
+            status=Response.DRAFT)
+        url = self.url(0, 0, 0, layer=response.layers.first())
+
+        self.client.force_login(classmate)
+        self.assertEqual(self.client.get(url).status_code, 204)
+        self.client.force_login(self.faculty)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_invalid_tile(self):
+        self.client.force_login(self.faculty)
+        self.assertEqual(self.client.get(self.url(1, 2, 0)).status_code, 404)
+        self.assertEqual(self.client.get(self.url(30, 0, 0)).status_code, 404)
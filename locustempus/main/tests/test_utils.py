@@ -1,14 +1,24 @@
 from courseaffils.tests.factories import (
     CourseFactory
 )
+from django.contrib.auth.models import AnonymousUser
+import time
+
 from django.core import mail
+from django.core.cache import caches
+from django.core.exceptions import ValidationError
+from django.core.mail.backends.locmem import EmailBackend
+from django.template import loader
+from django.test import RequestFactory, override_settings
 from django.test.testcases import TestCase
 from django.urls.base import reverse
 
-from locustempus.main.tests.factories import UserFactory
+from locustempus.main.tests.factories import UserFactory, GroupFactory
 from locustempus.main.utils import (
-    get_courses_for_user, get_courses_for_instructor, send_template_email
+    get_courses_for_user, get_courses_for_instructor, send_template_email,
+    send_template_emails, CourseRoles, get_course_roles
 )
+from unittest import mock
 
 
 class UtilTest(TestCase):
@@ -24,6 +34,54 @@ class UtilTest(TestCase):
                              'locustempus@example.com')
             self.assertTrue(mail.outbox[0].to, ['abc123@columbia.edu'])
 
+    def test_send_template_emails(self):
+        class Backend(EmailBackend):
+            opened = 0
+            chunks = []
+
+            def open(self):
+                Backend.opened += 1
+
+            def send_messages(self, messages):
+                Backend.chunks.append(len(messages))
+                return super().send_messages(messages)
+
+        recipients = [
+            ('{}@example.com'.format(i), {'user': UserFactory.build(
+                username='user{}'.format(i))})
+            for i in range(5)
+        ]
+        get_template = mock.Mock(wraps=loader.get_template)
+        with mock.patch.object(loader, 'get_template', get_template):
+            sent = send_template_emails(
+                'foo', 'main/notify_lti_course_connect.txt', recipients,
+                chunk_size=2, connection=Backend())
+
+        self.assertEqual(sent, 5)
+        self.assertEqual(get_template.call_count, 1)
+        self.assertEqual(Backend.opened, 1)
+        self.assertEqual(Backend.chunks, [2, 2, 1])
+        self.assertEqual(
+            [m.to for m in mail.outbox], [[r] for r, c in recipients])
+        self.assertIn('user3', mail.outbox[3].body)
+
+    def test_send_template_emails_validates_first(self):
+        with self.assertRaises(ValidationError):
+            send_template_emails(
+                'foo', 'main/notify_lti_course_connect.txt', [
+                    ('abc123@columbia.edu', {}), ('not an address', {})])
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_send_template_emails_rate_limit(self):
+        recipients = [('{}@example.com'.format(i), {}) for i in range(6)]
+        start = time.monotonic()
+        send_template_emails(
+            'foo', 'main/notify_lti_course_connect.txt', recipients,
+            chunk_size=2, rate_limit=50)
+        # The second and third chunks wait 2 / 50 seconds each
+        self.assertGreaterEqual(time.monotonic() - start, 0.08)
+        self.assertEqual(len(mail.outbox), 6)
+
     def test_sentry_dsn_processor(self):
         with self.settings(SENTRY_DSN='foo'):
             r = self.client.get(reverse('index-view'))
@@ -54,3 +112,118 @@ class UtilTest(TestCase):
         lst = get_courses_for_instructor(instructor)
         self.assertEqual(len(lst), 1)
         self.assertTrue(course in lst)
+
+    def test_course_roles(self):
+        course = CourseFactory()
+        other_course = CourseFactory()
+        student = UserFactory()
+        instructor = UserFactory()
+
+        course.group.user_set.add(student)
+        course.group.user_set.add(instructor)
+        course.faculty_group.user_set.add(instructor)
+        other_course.faculty_group.user_set.add(student)
+
+        with self.assertNumQueries(1):
+            roles = CourseRoles(student)
+        self.assertSetEqual(roles.member_course_ids, {course.pk})
+        self.assertSetEqual(roles.faculty_course_ids, {other_course.pk})
+        self.assertTrue(roles.is_student(course))
+        self.assertFalse(roles.is_student(other_course))
+
+        roles = CourseRoles(instructor)
+        for c in (course, other_course):
+            self.assertEqual(
+                roles.is_true_faculty(c), bool(c.is_true_faculty(instructor)))
+            self.assertEqual(
+                roles.is_true_member(c), c.is_true_member(instructor))
+            self.assertEqual(
+                roles.is_faculty(c), bool(c.is_faculty(instructor)))
+
+        with self.assertNumQueries(0):
+            roles = CourseRoles(AnonymousUser())
+        self.assertFalse(roles.is_true_member(course))
+
+    def test_get_course_roles(self):
+        course = CourseFactory()
+        student = UserFactory()
+        course.group.user_set.add(student)
+
+        request = RequestFactory().get('/')
+        request.user = student
+        with self.assertNumQueries(1):
+            roles = get_course_roles(request)
+            self.assertIs(get_course_roles(request), roles)
+            self.assertTrue(roles.is_true_member(course))
+
+        # A different user on the same request gets their own roles
+        request.user = UserFactory()
+        self.assertFalse(get_course_roles(request).is_true_member(course))
+
+
+@override_settings(
+    COURSE_ROLE_CACHE='course_roles',
+    CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+        'course_roles': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'course_roles',
+        },
+    })
+class CourseRoleCacheTest(TestCase):
+    def setUp(self):
+        caches['course_roles'].clear()
+        self.course = CourseFactory()
+        self.user = UserFactory()
+
+    def assertCachedRoles(self, faculty_course_ids, member_course_ids):
+        # Loads the roles if needed, then checks the cached copy
+        CourseRoles(self.user)
+        with self.assertNumQueries(0):
+            roles = CourseRoles(self.user)
+        self.assertSetEqual(roles.faculty_course_ids, faculty_course_ids)
+        self.assertSetEqual(roles.member_course_ids, member_course_ids)
+
+    def test_cached_across_requests(self):
+        self.course.group.user_set.add(self.user)
+        with self.assertNumQueries(1):
+            CourseRoles(self.user)
+        self.assertCachedRoles(set(), {self.course.pk})
+
+    def test_group_user_set_changes(self):
+        self.assertCachedRoles(set(), set())
+
+        self.course.group.user_set.add(self.user)
+        self.assertCachedRoles(set(), {self.course.pk})
+
+        self.course.faculty_group.user_set.add(self.user)
+        self.assertCachedRoles({self.course.pk}, {self.course.pk})
+
+        self.course.faculty_group.user_set.remove(self.user)
+        self.assertCachedRoles(set(), {self.course.pk})
+
+        self.course.group.user_set.clear()
+        self.assertCachedRoles(set(), set())
+
+    def test_user_groups_changes(self):
+        self.assertCachedRoles(set(), set())
+
+        self.user.groups.add(self.course.group)
+        self.assertCachedRoles(set(), {self.course.pk})
+
+        self.user.groups.clear()
+        self.assertCachedRoles(set(), set())
+
+    def test_course_created_for_existing_group(self):
+        group = GroupFactory()
+        faculty_group = GroupFactory()
+        self.user.groups.add(group, faculty_group)
+        self.assertCachedRoles(set(), set())
+
+        course = CourseFactory(group=group, faculty_group=faculty_group)
+        self.assertCachedRoles({course.pk}, {course.pk})
+
+        course.delete()
+        self.assertCachedRoles(set(), set())
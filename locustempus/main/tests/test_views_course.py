@@ -1,8 +1,12 @@
 """Tests for Course and dashbord views"""
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls.base import reverse
+from locustempus.main.models import ActivityStats
 from locustempus.main.tests.factories import (
-    SandboxCourseFactory, CourseTestMixin, UserFactory,
+    ActivityFactory, SandboxCourseFactory, CourseTestMixin, ProjectFactory,
+    ResponseFactory, UserFactory,
 )
 
 
@@ -307,6 +311,71 @@ class CourseTest(CourseTestMixin, TestCase):
         self.assertTrue(r3.context['project_grid_layout'])
 
 
+class CourseDetailQueryCountTest(CourseTestMixin, TestCase):
+    def setUp(self):
+        self.setup_course()
+        self.url = reverse('course-detail-view', args=[self.sandbox_course.pk])
+
+    def add_projects(self, count):
+        for _ in range(count):
+            activity = ActivityFactory.create(
+                project=ProjectFactory.create(course=self.sandbox_course))
+            ResponseFactory.create(
+                activity=activity, owners=[self.student], status='SUBMITTED')
+            ResponseFactory.create(
+                activity=activity, owners=[UserFactory.create()],
+                status='REVIEWED')
+            ResponseFactory.create(
+                activity=activity, owners=[UserFactory.create()])
+
+    def count_queries(self, user, grid=True):
+        self.client.force_login(user)
+        session = self.client.session
+        session['project_grid_layout'] = grid
+        session.save()
+        # Warm up per-process caches
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx), response
+
+    def test_precomputed_counts(self):
+        self.add_projects(1)
+        _, response = self.count_queries(self.faculty)
+        project = response.context['projects'].last()
+        self.assertEqual(project.submitted_response_count, 2)
+        self.assertEqual(project.feedback_count, 1)
+        self.assertContains(response, '2 Responses submitted')
+        self.assertContains(response, '1 Feedback sent')
+
+        _, response = self.count_queries(self.student)
+        project = response.context['projects'].last()
+        self.assertEqual(project.response_status, 'SUBMITTED')
+
+    def test_missing_stats(self):
+        """Activities without stats have them rebuilt, not shown as 0"""
+        self.add_projects(2)
+        ActivityStats.objects.filter(
+            activity__project__course=self.sandbox_course).delete()
+
+        _, response = self.count_queries(self.faculty)
+        project = response.context['projects'].last()
+        self.assertEqual(project.submitted_response_count, 2)
+        self.assertEqual(project.feedback_count, 1)
+        self.assertEqual(ActivityStats.objects.filter(
+            activity__project__course=self.sandbox_course).count(), 3)
+
+    def test_constant_query_count(self):
+        for user in [self.faculty, self.student]:
+            for grid in [True, False]:
+                self.add_projects(1)
+                small, _ = self.count_queries(user, grid)
+                self.add_projects(99)
+                large, _ = self.count_queries(user, grid)
+                self.assertEqual(small, large)
+
+
 class DashboardTest(CourseTestMixin, TestCase):
     def setUp(self):
         self.setup_course()
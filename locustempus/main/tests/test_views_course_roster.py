@@ -1,12 +1,18 @@
 """Tests Course Roster invite views"""
 from django.core import mail
-from django.test import TestCase
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls.base import reverse
 from django_registration.signals import user_activated
-from locustempus.main.models import GuestUserAffil
+from locustempus.main.mailqueue import send_queued_emails
+from locustempus.main.models import GuestUserAffil, QueuedEmail
 from locustempus.main.tests.factories import (
     SandboxCourseFactory, CourseTestMixin, UserFactory,
 )
+from locustempus.main.utils import CourseRoles
 from unittest.mock import MagicMock
 
 
@@ -193,16 +199,20 @@ class CourseRoster(CourseTestMixin, TestCase):
             invited_by=self.faculty
         )
         affil.save()
-        response = self.client.post(
-            reverse(
-                'course-roster-resend-invite-view',
-                args=[self.sandbox_course.pk]),
-            {'user_email': addr}
-        )
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse(
+                    'course-roster-resend-invite-view',
+                    args=[self.sandbox_course.pk]),
+                {'user_email': addr}
+            )
         self.assertEqual(response.status_code, 302)
         self.assertEqual(response.url,
                          "/course/{}/roster/".format(self.sandbox_course.pk))
 
+        # The invitation is sent by the queue's worker
+        self.assertEqual(len(mail.outbox), 0)
+        send_queued_emails()
         self.assertEqual(len(mail.outbox), 1)
 
         self.assertEqual(
@@ -491,3 +501,162 @@ class CourseRosterInviteUserTest(CourseTestMixin, TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertContains(
             response, 'A value must be entered in either field.')
+
+
+class CourseRosterBulkInviteTest(CourseTestMixin, TestCase):
+    def setUp(self):
+        self.setup_course()
+        self.client.force_login(self.faculty)
+        self.url = reverse(
+            'course-roster-invite-user', args=[self.sandbox_course.pk])
+
+    def post(self, unis=(), addrs=(), csv=None):
+        data = {
+            'uni-TOTAL_FORMS': str(len(unis)),
+            'uni-INITIAL_FORMS': '0',
+            'email-TOTAL_FORMS': str(len(addrs)),
+            'email-INITIAL_FORMS': '0',
+        }
+        for i, uni in enumerate(unis):
+            data['uni-{}-invitee'.format(i)] = uni
+        for i, addr in enumerate(addrs):
+            data['email-{}-invitee'.format(i)] = addr
+        if csv is not None:
+            data['uni_file'] = SimpleUploadedFile(
+                'unis.csv', csv.encode(), content_type='text/csv')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(self.url, data)
+
+    def invitees(self, n, prefix):
+        """
+        Returns n UNIs and n addresses of each kind: new, existing but
+        not in the course, already members, and already invited guests
+        """
+        unis = []
+        addrs = []
+        for i in range(n):
+            unis.append('{}{}'.format(prefix, i))
+            UserFactory(username='{}{}'.format(prefix, 1000 + i))
+            unis.append('{}{}'.format(prefix, 1000 + i))
+            member = UserFactory(
+                username='{}{}'.format(prefix, 2000 + i),
+                email='{}{}@example.com'.format(prefix, 2000 + i))
+            self.sandbox_course.group.user_set.add(member)
+            unis.append(member.username)
+
+            addrs.append('{}{}@example.com'.format(prefix, i))
+            UserFactory(email='{}{}@example.com'.format(prefix, 1000 + i))
+            addrs.append('{}{}@example.com'.format(prefix, 1000 + i))
+            addrs.append(member.email)
+            GuestUserAffil.objects.create(
+                course=self.sandbox_course, invited_by=self.faculty,
+                guest_email='{}{}@example.com'.format(prefix, 3000 + i))
+            addrs.append('{}{}@example.com'.format(prefix, 3000 + i))
+        return unis, addrs
+
+    def test_query_count(self):
+        counts = []
+        for n, prefix in [(1, 'ab'), (3, 'cd'), (12, 'ef')]:
+            unis, addrs = self.invitees(n, prefix)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.post(unis, addrs)
+            self.assertEqual(response.status_code, 302)
+            counts.append(len(queries))
+
+            group = self.sandbox_course.group
+            for uni in unis:
+                self.assertTrue(group.user_set.filter(username=uni).exists())
+            self.assertEqual(GuestUserAffil.objects.filter(
+                course=self.sandbox_course,
+                guest_email__startswith=prefix).count(), 2 * n)
+            # New invitees and users not yet in the course are emailed
+            self.assertEqual(QueuedEmail.objects.filter(
+                recipient__startswith=prefix).count(), 4 * n)
+
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(counts[0], counts[2])
+
+    def test_new_users(self):
+        self.post(['abc123', 'abc123'])
+        user = self.sandbox_course.group.user_set.get(username='abc123')
+        self.assertFalse(user.has_usable_password())
+        self.assertEqual(QueuedEmail.objects.filter(
+            recipient='abc123@columbia.edu').count(), 1)
+
+    def test_messages(self):
+        roster = reverse('course-roster-view', args=[self.sandbox_course.pk])
+        unis, addrs = self.invitees(1, 'ab')
+        self.post(unis)
+        response = self.client.get(roster)
+        self.assertContains(
+            response, 'ab0 is now a workspace member. An email notification '
+            'was sent to ab0@columbia.edu.')
+        self.assertContains(response, '(ab2000) is already a course member')
+
+        # Large invites are summarized
+        unis, addrs = self.invitees(11, 'cd')
+        self.post(unis, addrs)
+        response = self.client.get(roster)
+        self.assertContains(
+            response, '22 users are now workspace members.')
+        self.assertContains(response, '11 users are already course members')
+        self.assertContains(response, '22 invitations to join the workspace')
+        self.assertContains(
+            response, '11 addresses have already been invited')
+
+    def test_csv(self):
+        member = UserFactory(username='xyz789')
+        self.sandbox_course.group.user_set.add(member)
+        unis = ['zz{}'.format(i) for i in range(2000)]
+        csv = 'UNI,Name\r\n' + ''.join(
+            '{},Student {}\r\n'.format(uni, i)
+            for i, uni in enumerate(unis)) + '\r\nxyz789\r\nzz1\r\n'
+
+        response = self.post(['abc123'], csv=csv)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            self.sandbox_course.group.user_set.filter(
+                username__startswith='zz').count(), 2000)
+        self.assertTrue(self.sandbox_course.group.user_set.filter(
+            username='abc123').exists())
+        self.assertEqual(QueuedEmail.objects.count(), 2001)
+
+    def test_csv_invalid(self):
+        response = self.post(csv='abc123\nfoobar\n\nDEF456\n')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Line 2: foobar is not a valid UNI.')
+        self.assertContains(response, 'Line 4: DEF456 is not a valid UNI.')
+        self.assertFalse(self.sandbox_course.group.user_set.filter(
+            username='abc123').exists())
+
+        csv = ''.join('invalid{}\n'.format(i) for i in range(8))
+        response = self.post(csv=csv)
+        self.assertContains(response, 'Line 5: invalid4 is not a valid UNI.')
+        self.assertNotContains(response, 'invalid5')
+        self.assertContains(response, '...and 3 more.')
+
+    def test_csv_too_many(self):
+        csv = ''.join('ab{}\n'.format(i) for i in range(5001))
+        response = self.post(csv=csv)
+        self.assertContains(response, 'A file can list at most 5000 UNIs.')
+
+    @override_settings(
+        COURSE_ROLE_CACHE='course_roles',
+        CACHES={
+            'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            },
+            'course_roles': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'course_roles',
+            },
+        })
+    def test_course_role_cache(self):
+        caches['course_roles'].clear()
+        user = UserFactory(username='abc123')
+        self.assertSetEqual(CourseRoles(user).member_course_ids, set())
+
+        self.post(['abc123'])
+        self.assertSetEqual(
+            CourseRoles(user).member_course_ids, {self.sandbox_course.pk})
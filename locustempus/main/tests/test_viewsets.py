@@ -1,18 +1,26 @@
 from courseaffils.models import Course
+from datetime import datetime, timezone
+from django.contrib.gis.geos import Point, Polygon
 from django.contrib.auth.models import AnonymousUser
+from django.contrib.contenttypes.models import ContentType
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls.base import reverse
 import json
 from locustempus.main.models import (
-    Activity, Response, Layer, Event, Project
+    Activity, Response, Layer, Event, Project, MediaObject, Location,
+    Feedback, RasterLayer
 )
 from locustempus.main.permissions import (
     IsLoggedInCourse, IsLoggedInFaculty, LayerPermission
 )
 from locustempus.main.tests.factories import (
     CourseTestMixin, UserFactory, LayerFactory, ResponseFactory,
-    ProjectFactory, ActivityFactory
+    ProjectFactory, ActivityFactory, EventFactory, FeedbackFactory
 )
+from locustempus.main.utils import get_layers_for_user
 from unittest.mock import MagicMock
 from waffle.testutils import override_flag
 
@@ -618,6 +626,385 @@ class ProjectAPITest(CourseTestMixin, TestCase):
             )
 
 
+class AggregatedLayersBenchmarkTest(CourseTestMixin, TestCase):
+    """
+    Exercises ProjectSerializer.get_aggregated_layers against an activity
+    with many submitted responses
+    """
+    RESPONSES = 200
+    LAYERS_PER_RESPONSE = 5
+
+    def setUp(self):
+        self.setup_course()
+        self.url = reverse(
+            'api-project-detail', args=[self.sandbox_course_project.pk])
+        self.sandbox_course_response.status = Response.SUBMITTED
+        self.sandbox_course_response.save()
+
+    def add_responses(self, count):
+        content_type = ContentType.objects.get_for_model(Response)
+        students = UserFactory.create_batch(count)
+        self.sandbox_course.group.user_set.add(*students)
+        layers = []
+        for student in students:
+            # ResponseFactory generates the first layer
+            response = ResponseFactory.create(
+                activity=self.sandbox_course_activity,
+                owners=[student],
+                status=Response.SUBMITTED
+            )
+            layers.extend([
+                Layer(
+                    title='Layer {}'.format(i),
+                    content_type=content_type,
+                    object_id=response.pk
+                ) for i in range(self.LAYERS_PER_RESPONSE - 1)
+            ])
+        Layer.objects.bulk_create(layers)
+
+    def get_aggregated_layers(self):
+        with CaptureQueriesContext(connection) as ctx:
+            r = self.client.get(self.url)
+        self.assertEqual(r.status_code, 200)
+        return r.data['aggregated_layers'], len(ctx.captured_queries)
+
+    @override_flag('share_response_layers', active=True)
+    def test_aggregated_layers(self):
+        self.assertTrue(
+            self.client.login(
+                username=self.student.username,
+                password='test'
+            )
+        )
+        self.add_responses(1)
+        # Warm up the content type and waffle flag caches
+        self.get_aggregated_layers()
+        _, queries = self.get_aggregated_layers()
+
+        self.add_responses(self.RESPONSES - 1)
+        layer_urls, more_queries = self.get_aggregated_layers()
+        self.assertEqual(more_queries, queries)
+
+        expected = Layer.objects.filter(
+            response__activity=self.sandbox_course_activity,
+            response__status__in=[Response.SUBMITTED, Response.REVIEWED]
+        )
+        # Every response has five layers, plus the student's own response
+        self.assertEqual(
+            len(layer_urls),
+            self.RESPONSES * self.LAYERS_PER_RESPONSE + 1)
+        self.assertListEqual(
+            sorted(layer_urls),
+            sorted(
+                'http://testserver' +
+                reverse('api-layer-detail', args=[lyr.pk])
+                for lyr in expected
+            )
+        )
+
+
+class CourseRoleQueryCountTest(CourseTestMixin, TestCase):
+    """
+    Counts the course role queries, i.e. group membership lookups, that
+    each API endpoint runs. Roles are resolved once per request.
+    """
+    def setUp(self):
+        self.setup_course()
+        self.sandbox_course_response.status = Response.SUBMITTED
+        self.sandbox_course_response.save()
+
+    def endpoints(self):
+        project = self.sandbox_course_project
+        activity = self.sandbox_course_activity
+        layer = self.sandbox_course_project.layers.first()
+        return [
+            reverse('api-project-list'),
+            reverse('api-project-detail', args=[project.pk]),
+            reverse('api-project-bundle', args=[project.pk]),
+            reverse('api-activity-list'),
+            reverse('api-activity-detail', args=[activity.pk]),
+            reverse('api-layer-list'),
+            reverse('api-layer-detail', args=[layer.pk]),
+            reverse('api-response-list') + '?activity={}'.format(activity.pk),
+            reverse('api-response-detail',
+                    args=[self.sandbox_course_response.pk]),
+            reverse('api-feedback-list') + '?activity={}'.format(activity.pk),
+        ]
+
+    def role_query_counts(self):
+        counts = {}
+        for url in self.endpoints():
+            with CaptureQueriesContext(connection) as ctx:
+                self.client.get(url)
+            counts[url] = len([
+                q for q in ctx.captured_queries
+                if 'auth_user_groups' in q['sql']
+            ])
+        return counts
+
+    @override_flag('share_response_layers', active=True)
+    def test_role_queries(self):
+        for user in (self.faculty, self.student):
+            self.assertTrue(
+                self.client.login(
+                    username=user.username,
+                    password='test'
+                )
+            )
+            for url, count in self.role_query_counts().items():
+                self.assertLessEqual(count, 1, url)
+
+
+class ProjectBundleAPITest(CourseTestMixin, TestCase):
+    def setUp(self):
+        self.setup_course()
+        self.layer = LayerFactory.create(
+            title='A Project Layer',
+            content_object=self.sandbox_course_project,
+            created_by=self.faculty
+        )
+        EventFactory.create(layer=self.layer, created_by=self.faculty)
+
+    def bundle_url(self, project):
+        return reverse('api-project-bundle', args=[project.pk])
+
+    def test_faculty_get(self):
+        self.assertTrue(
+            self.client.login(
+                username=self.faculty.username,
+                password='test'
+            )
+        )
+        r = self.client.get(self.bundle_url(self.sandbox_course_project))
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.data['pk'], self.sandbox_course_project.pk)
+        self.assertSetEqual(
+            {lyr['pk'] for lyr in r.data['layers']},
+            set(self.sandbox_course_project.layers.values_list(
+                'pk', flat=True))
+        )
+        layer = next(
+            lyr for lyr in r.data['layers'] if lyr['pk'] == self.layer.pk)
+        self.assertEqual(len(layer['events']), 1)
+        self.assertListEqual(r.data['aggregated_layers'], [])
+
+    def test_time_range(self):
+        EventFactory.create(
+            layer=self.layer, created_by=self.faculty,
+            datetime=datetime(2020, 1, 1, tzinfo=timezone.utc))
+        self.client.force_login(self.faculty)
+
+        def event_count(**params):
+            r = self.client.get(
+                self.bundle_url(self.sandbox_course_project), params)
+            self.assertEqual(r.status_code, 200)
+            layer = next(
+                lyr for lyr in r.data['layers'] if lyr['pk'] == self.layer.pk)
+            return len(layer['events'])
+
+        self.assertEqual(event_count(), 2)
+        self.assertEqual(event_count(start='2020-01-01'), 1)
+        self.assertEqual(event_count(end='2020-01-01'), 0)
+        r = self.client.get(
+            self.bundle_url(self.sandbox_course_project), {'start': 'soon'})
+        self.assertEqual(r.status_code, 400)
+
+    def test_student_get(self):
+        self.assertTrue(
+            self.client.login(
+                username=self.student.username,
+                password='test'
+            )
+        )
+        r1 = self.client.get(self.bundle_url(self.sandbox_course_project))
+        self.assertEqual(r1.status_code, 200)
+
+        # This project does not have an activity
+        project = self.sandbox_course.projects.first()
+        r2 = self.client.get(self.bundle_url(project))
+        self.assertEqual(r2.status_code, 404)
+
+    def test_non_course_user_get(self):
+        self.assertTrue(
+            self.client.login(
+                username=self.alt_faculty.username,
+                password='test'
+            )
+        )
+        r = self.client.get(self.bundle_url(self.sandbox_course_project))
+        self.assertEqual(r.status_code, 404)
+
+    def test_anon_get(self):
+        r = self.client.get(self.bundle_url(self.sandbox_course_project))
+        self.assertEqual(r.status_code, 403)
+
+    def test_post(self):
+        self.assertTrue(
+            self.client.login(
+                username=self.faculty.username,
+                password='test'
+            )
+        )
+        r = self.client.post(self.bundle_url(self.sandbox_course_project))
+        self.assertEqual(r.status_code, 403)
+
+    @override_flag('share_response_layers', active=True)
+    def test_student_aggregated_layers(self):
+        classmate = UserFactory.create()
+        self.sandbox_course.group.user_set.add(classmate)
+        classmate_response = ResponseFactory.create(
+            activity=self.sandbox_course_activity,
+            owners=[classmate],
+            status=Response.SUBMITTED
+        )
+        classmate_layer = classmate_response.layers.first()
+        EventFactory.create(layer=classmate_layer, created_by=classmate)
+
+        self.assertTrue(
+            self.client.login(
+                username=self.student.username,
+                password='test'
+            )
+        )
+
+        # The student has not submitted yet
+        r1 = self.client.get(self.bundle_url(self.sandbox_course_project))
+        self.assertListEqual(r1.data['aggregated_layers'], [])
+
+        self.sandbox_course_response.status = Response.SUBMITTED
+        self.sandbox_course_response.save()
+        r2 = self.client.get(self.bundle_url(self.sandbox_course_project))
+        self.assertEqual(len(r2.data['aggregated_layers']), 2)
+        for lyr in r2.data['aggregated_layers']:
+            layer = Layer.objects.get(pk=lyr['pk'])
+            self.assertTrue(
+                LayerPermission().layer_permission_helper(
+                    layer, self.student))
+
+        classmate_data = next(
+            lyr for lyr in r2.data['aggregated_layers']
+            if lyr['pk'] == classmate_layer.pk)
+        self.assertEqual(len(classmate_data['events']), 1)
+
+    def test_constant_query_count(self):
+        self.assertTrue(
+            self.client.login(
+                username=self.faculty.username,
+                password='test'
+            )
+        )
+        url = self.bundle_url(self.sandbox_course_project)
+        # Warm up the content type and waffle flag caches
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(url)
+        queries = len(ctx.captured_queries)
+
+        for i in range(10):
+            layer = LayerFactory.create(
+                title='Layer {}'.format(i),
+                content_object=self.sandbox_course_project,
+                created_by=self.faculty
+            )
+            for _ in range(5):
+                EventFactory.create(layer=layer, created_by=self.faculty)
+
+        with CaptureQueriesContext(connection) as ctx:
+            r = self.client.get(url)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(len(ctx.captured_queries), queries)
+
+
+class AsyncAPITest(CourseTestMixin, TestCase):
+    """The async views answer like the viewsets they mirror"""
+    def setUp(self):
+        self.setup_course()
+        self.layer = LayerFactory.create(
+            title='A Project Layer',
+            content_object=self.sandbox_course_project,
+            created_by=self.faculty
+        )
+        EventFactory.create(layer=self.layer, created_by=self.faculty)
+        EventFactory.create(
+            layer=self.layer, created_by=self.faculty,
+            datetime=datetime(2020, 1, 1, tzinfo=timezone.utc))
+
+    def assertSameResponse(self, sync_url, async_url, params=None):
+        r1 = self.client.get(sync_url, params)
+        r2 = self.client.get(async_url, params)
+        self.assertEqual(r1.status_code, r2.status_code)
+        self.assertEqual(r1.json(), r2.json())
+        return r2
+
+    def bundle_urls(self, project):
+        return (reverse('api-project-bundle', args=[project.pk]),
+                reverse('api-async-project-bundle', args=[project.pk]))
+
+    def layer_urls(self):
+        return (reverse('api-layer-list'), reverse('api-async-layer-list'))
+
+    @override_flag('share_response_layers', active=True)
+    def test_bundle(self):
+        self.sandbox_course_response.status = Response.SUBMITTED
+        self.sandbox_course_response.save()
+
+        for user in (self.faculty, self.student, self.alt_faculty):
+            self.client.force_login(user)
+            self.assertSameResponse(
+                *self.bundle_urls(self.sandbox_course_project))
+
+        self.client.force_login(self.student)
+        r = self.assertSameResponse(
+            *self.bundle_urls(self.sandbox_course_project))
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(len(r.json()['aggregated_layers']), 1)
+
+        # This project does not have an activity
+        r = self.assertSameResponse(
+            *self.bundle_urls(self.sandbox_course.projects.first()))
+        self.assertEqual(r.status_code, 404)
+
+    def test_bundle_time_range(self):
+        self.client.force_login(self.faculty)
+        urls = self.bundle_urls(self.sandbox_course_project)
+        for params in ({'start': '2020-01-01'}, {'end': '2020-01-01'},
+                       {'start': 'soon'}):
+            self.assertSameResponse(*urls, params)
+
+    def test_layer_list(self):
+        self.sandbox_course_response.status = Response.SUBMITTED
+        self.sandbox_course_response.save()
+
+        for user in (self.faculty, self.student, self.alt_student):
+            self.client.force_login(user)
+            r = self.assertSameResponse(*self.layer_urls())
+            self.assertEqual(r.status_code, 200)
+
+    def test_anonymous(self):
+        self.assertSameResponse(
+            *self.bundle_urls(self.sandbox_course_project))
+        r = self.assertSameResponse(*self.layer_urls())
+        self.assertEqual(r.status_code, 403)
+
+    def test_read_only(self):
+        self.client.force_login(self.faculty)
+        for url in (self.layer_urls()[1],
+                    self.bundle_urls(self.sandbox_course_project)[1]):
+            self.assertEqual(self.client.post(url).status_code, 405)
+
+    async def test_event_loop(self):
+        await self.async_client.aforce_login(self.faculty)
+        r = await self.async_client.get(
+            self.bundle_urls(self.sandbox_course_project)[1])
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(len(r.json()['layers']), await Layer.objects.filter(
+            project=self.sandbox_course_project).acount())
+
+        r = await self.async_client.get(self.layer_urls()[1])
+        self.assertEqual(r.status_code, 200)
+        self.assertIn(self.layer.pk, [lyr['pk'] for lyr in r.json()])
+
+
 class ActivityAPITest(CourseTestMixin, TestCase):
     def setUp(self):
         self.setup_course()
@@ -926,6 +1313,45 @@ class ActivityAPITest(CourseTestMixin, TestCase):
                 reverse('api-activity-detail', args=[activity.pk]))
             self.assertEqual(resp.status_code, 403)
 
+    def test_progress(self):
+        activity = self.sandbox_course_activity
+        url = reverse('api-activity-progress', args=[activity.pk])
+        # One more student, who hasn't responded
+        self.sandbox_course.group.user_set.add(UserFactory())
+        response = self.sandbox_course_response
+        response.status = Response.SUBMITTED
+        response.save()
+
+        self.client.force_login(self.faculty)
+        # The counts are read, not computed
+        with self.assertNumQueries(6):
+            r = self.client.get(url)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.data['activity'], activity.pk)
+        self.assertEqual(r.data['draft_count'], 0)
+        self.assertEqual(r.data['submitted_count'], 1)
+        self.assertEqual(r.data['submitted_response_count'], 1)
+        self.assertEqual(r.data['owner_count'], 1)
+        self.assertEqual(r.data['member_count'], 2)
+        self.assertEqual(r.data['without_response_count'], 1)
+        self.assertIsNotNone(r.data['last_submitted_at'])
+
+        ResponseFactory.create_batch(10, activity=activity)
+        with self.assertNumQueries(6):
+            r = self.client.get(url)
+        self.assertEqual(r.data['draft_count'], 10)
+
+    def test_progress_permissions(self):
+        url = reverse(
+            'api-activity-progress', args=[self.sandbox_course_activity.pk])
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        self.client.force_login(self.student)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        self.client.force_login(self.alt_faculty)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
 
 class LayerAPITest(CourseTestMixin, TestCase):
     def setUp(self):
@@ -1683,6 +2109,302 @@ class LayerAPITest(CourseTestMixin, TestCase):
             self.assertEqual(resp.status_code, 403)
 
 
+class LayerVisibilityTest(CourseTestMixin, TestCase):
+    """
+    Compares the layers LayerApiView returns with
+    LayerPermission.layer_permission_helper, for every combination of
+    course role and response status
+    """
+    def setUp(self):
+        self.setup_course()
+        self.peers = {}
+        for status in (Response.DRAFT, Response.SUBMITTED, Response.REVIEWED):
+            peer = UserFactory.create()
+            self.sandbox_course.group.user_set.add(peer)
+            ResponseFactory.create(
+                activity=self.sandbox_course_activity,
+                owners=[peer],
+                status=status
+            )
+            self.peers[status] = peer
+        self.non_member = UserFactory.create()
+
+    def users(self):
+        return [
+            self.faculty, self.student, self.alt_faculty, self.alt_student,
+            self.non_member, self.superuser
+        ] + list(self.peers.values())
+
+    def assertVisibleLayers(self, user):
+        expected = {
+            lyr.pk for lyr in Layer.objects.all()
+            if LayerPermission().layer_permission_helper(lyr, user)
+        }
+
+        pks = list(get_layers_for_user(user).values_list('pk', flat=True))
+        self.assertEqual(len(pks), len(set(pks)))
+        self.assertSetEqual(set(pks), expected)
+
+        self.client.force_login(user)
+        r = self.client.get(reverse('api-layer-list'))
+        self.assertEqual(r.status_code, 200)
+        pks = [lyr['pk'] for lyr in r.data]
+        self.assertEqual(len(pks), len(set(pks)))
+        self.assertSetEqual(set(pks), expected)
+
+    def test_visibility_matrix(self):
+        response = self.sandbox_course_response
+        for status in (Response.DRAFT, Response.SUBMITTED, Response.REVIEWED):
+            response.status = status
+            response.save()
+            for user in self.users():
+                with self.subTest(status=status, user=user.username):
+                    self.assertVisibleLayers(user)
+
+        # And once the student has no response at all
+        response.delete()
+        for user in self.users():
+            with self.subTest(status=None, user=user.username):
+                self.assertVisibleLayers(user)
+
+    def test_no_sequential_scan(self):
+        layers = get_layers_for_user(self.student)
+        if connection.vendor == 'postgresql':
+            # The tables here are tiny, so make Postgres show whether an
+            # index path exists at all
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+            plan = layers.explain()
+            self.assertNotIn('Seq Scan on main_layer', plan)
+        else:
+            plan = layers.explain()
+            for line in plan.splitlines():
+                self.assertNotRegex(line, r'SCAN (TABLE )?main_layer$', plan)
+
+
+class LayerQueryCountTest(CourseTestMixin, TestCase):
+    """
+    Checks that reading layers costs a fixed number of queries, no
+    matter how many events the layers hold
+    """
+    def setUp(self):
+        self.setup_course()
+        self.layer = LayerFactory.create(
+            title='A Busy Layer',
+            content_object=self.sandbox_course_project,
+            created_by=self.faculty
+        )
+
+    def add_events(self, count):
+        for _ in range(count):
+            event = EventFactory.create(
+                layer=self.layer, created_by=self.faculty)
+            event.media.add(MediaObject.objects.create(
+                url='https://some.bucket.example.com/img.jpg'))
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            r = self.client.get(url)
+        self.assertEqual(r.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_constant_query_count(self):
+        self.assertTrue(
+            self.client.login(
+                username=self.faculty.username,
+                password='test'
+            )
+        )
+        detail_url = reverse('api-layer-detail', args=[self.layer.pk])
+        list_url = reverse('api-layer-list')
+
+        self.add_events(1)
+        detail_queries = self.count_queries(detail_url)
+        list_queries = self.count_queries(list_url)
+
+        self.add_events(999)
+        self.assertEqual(self.count_queries(detail_url), detail_queries)
+        self.assertEqual(self.count_queries(list_url), list_queries)
+
+        r = self.client.get(detail_url)
+        self.assertEqual(len(r.data['events']), 1000)
+        self.assertEqual(
+            r.data['events'][0]['owner'], self.faculty.get_full_name())
+        self.assertEqual(len(r.data['events'][0]['media']), 1)
+
+
+class LayerImportAPITest(CourseTestMixin, TestCase):
+    def setUp(self):
+        self.setup_course()
+        self.layer = Layer.objects.create(
+            title='A Title', content_object=self.sandbox_course_project)
+        self.url = reverse('api-layer-import-events', args=[self.layer.pk])
+
+    def upload(self, name, content, **data):
+        f = SimpleUploadedFile(name, content.encode('utf-8'))
+        return self.client.post(self.url, dict(file=f, **data))
+
+    def test_import_geojson(self):
+        self.client.force_login(self.faculty)
+        content = json.dumps({
+            'type': 'FeatureCollection',
+            'features': [{
+                'type': 'Feature',
+                'properties': {'name': 'Event {}'.format(i)},
+                'geometry': {'type': 'Point', 'coordinates': [i, 0]}
+            } for i in range(5)] + [{
+                'type': 'Feature', 'properties': {}, 'geometry': None
+            }]
+        })
+        r = self.upload('events.geojson', content)
+        self.assertEqual(r.status_code, 201)
+        self.assertEqual(r.json(), {
+            'created': 5,
+            'error_count': 1,
+            'errors': [{'row': 6, 'error': 'Missing geometry'}],
+        })
+        self.assertEqual(self.layer.events.count(), 5)
+        self.assertEqual(
+            self.layer.events.first().created_by, self.faculty)
+
+    def test_import_csv(self):
+        self.client.force_login(self.faculty)
+        content = 'label,lat,lng,date\nA,40.8,-73.9,1900-01-01\n'
+        r = self.upload('events.txt', content, format='csv')
+        self.assertEqual(r.status_code, 201)
+        self.assertEqual(r.json()['created'], 1)
+
+    def test_import_invalid_request(self):
+        self.client.force_login(self.faculty)
+        r = self.client.post(self.url, {})
+        self.assertEqual(r.status_code, 400)
+
+        r = self.upload('events.kml', '<kml />')
+        self.assertEqual(r.status_code, 400)
+        self.assertIn('format', r.json())
+
+    def test_import_forbidden(self):
+        content = 'label,lat,lng\nA,40.8,-73.9\n'
+
+        # Students can see the project's layer, but not edit it
+        self.client.force_login(self.student)
+        r = self.upload('events.csv', content)
+        self.assertEqual(r.status_code, 403)
+
+        self.client.force_login(self.alt_faculty)
+        r = self.upload('events.csv', content)
+        self.assertEqual(r.status_code, 404)
+
+        self.client.logout()
+        r = self.upload('events.csv', content)
+        self.assertEqual(r.status_code, 403)
+        self.assertFalse(self.layer.events.exists())
+
+    def test_import_response_layer(self):
+        layer = self.sandbox_course_response.layers.first()
+        url = reverse('api-layer-import-events', args=[layer.pk])
+        content = 'label,lat,lng\nA,40.8,-73.9\n'
+
+        self.client.force_login(self.student)
+        r = self.client.post(url, {
+            'file': SimpleUploadedFile('a.csv', content.encode('utf-8'))})
+        self.assertEqual(r.status_code, 201)
+        self.assertEqual(layer.events.count(), 1)
+
+
+class GeoJSONExportAPITest(CourseTestMixin, TestCase):
+    def setUp(self):
+        self.setup_course()
+        self.project_layer = self.sandbox_course_project.layers.first()
+        self.project_event = EventFactory.create(layer=self.project_layer)
+
+        self.student_layer = self.sandbox_course_response.layers.first()
+        self.student_event = EventFactory.create(layer=self.student_layer)
+
+        self.classmate = UserFactory.create()
+        self.sandbox_course.group.user_set.add(self.classmate)
+        classmate_response = ResponseFactory.create(
+            activity=self.sandbox_course_activity, owners=[self.classmate],
+            status=Response.SUBMITTED)
+        self.classmate_layer = classmate_response.layers.first()
+        self.classmate_event = EventFactory.create(layer=self.classmate_layer)
+
+    def get_event_pks(self, url, user):
+        self.client.force_login(user)
+        r = self.client.get(url)
+        self.assertEqual(r.status_code, 200)
+        self.assertTrue(r.streaming)
+        self.assertEqual(r['Content-Type'], 'application/geo+json')
+        data = json.loads(b''.join(r.streaming_content))
+        self.assertEqual(data['type'], 'FeatureCollection')
+        return {f['id'] for f in data['features']}
+
+    def test_layer_export(self):
+        url = reverse('api-layer-geojson', args=[self.project_layer.pk])
+        self.assertEqual(
+            self.get_event_pks(url, self.faculty), {self.project_event.pk})
+        self.assertEqual(
+            self.get_event_pks(url, self.student), {self.project_event.pk})
+
+        # The student's response is a draft, so faculty can't see it
+        url = reverse('api-layer-geojson', args=[self.student_layer.pk])
+        self.client.force_login(self.faculty)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+        self.client.force_login(self.alt_faculty)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+        self.client.logout()
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+    def test_project_export(self):
+        url = reverse(
+            'api-project-geojson', args=[self.sandbox_course_project.pk])
+        self.assertEqual(
+            self.get_event_pks(url, self.faculty),
+            {self.project_event.pk, self.classmate_event.pk})
+        # The student hasn't submitted, so can't see their classmate's
+        self.assertEqual(
+            self.get_event_pks(url, self.student),
+            {self.project_event.pk, self.student_event.pk})
+
+        self.sandbox_course_response.status = Response.SUBMITTED
+        self.sandbox_course_response.save()
+        self.assertEqual(
+            self.get_event_pks(url, self.student),
+            {self.project_event.pk, self.student_event.pk,
+             self.classmate_event.pk})
+
+        self.client.force_login(self.alt_student)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_course_export(self):
+        alt_event = EventFactory.create(
+            layer=self.alt_course_project.layers.first())
+
+        url = reverse('api-course-geojson', args=[self.sandbox_course.pk])
+        self.assertEqual(
+            self.get_event_pks(url, self.faculty),
+            {self.project_event.pk, self.classmate_event.pk})
+        self.assertEqual(
+            self.get_event_pks(url, self.student),
+            {self.project_event.pk, self.student_event.pk})
+
+        url = reverse('api-course-geojson', args=[self.alt_course.pk])
+        self.assertEqual(
+            self.get_event_pks(url, self.alt_faculty), {alt_event.pk})
+
+        self.client.force_login(self.faculty)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        self.client.logout()
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        url = reverse('api-course-geojson', args=[0])
+        self.client.force_login(self.faculty)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
 class EventAPITest(CourseTestMixin, TestCase):
     def setUp(self):
         self.setup_course()
@@ -1868,6 +2590,340 @@ class EventAPITest(CourseTestMixin, TestCase):
         self.assertListEqual(ret_data['media'], [])
 
 
+class EventBulkAPITest(CourseTestMixin, TestCase):
+    def setUp(self):
+        self.setup_course()
+        self.project = self.sandbox_course.projects.first()
+        self.layer = Layer.objects.create(
+            title='A Title', content_object=self.project)
+        self.url = reverse('api-event-bulk')
+
+    def event_data(self, count):
+        return [{
+            'label': 'Event {}'.format(i),
+            'description': 'A short description.',
+            'datetime': '2020-01-0{}T00:00:00Z'.format(i % 9 + 1),
+            'location': {
+                'point': {'lat': 40.0 + i / 100, 'lng': -73.0},
+            },
+            'media': [
+                {'url': 'https://some.bucket.example.com/{}.jpg'.format(i)}
+            ] if i % 2 else None
+        } for i in range(count)]
+
+    def post(self, events, layer=None):
+        return self.client.post(
+            self.url,
+            json.dumps({
+                'layer': (layer or self.layer).pk,
+                'events': events
+            }),
+            content_type='application/json'
+        )
+
+    def test_bulk_create(self):
+        self.client.force_login(self.faculty)
+        r = self.post(self.event_data(20))
+        self.assertEqual(r.status_code, 201)
+
+        pks = r.json()['pks']
+        self.assertEqual(len(pks), 20)
+        events = Event.objects.in_bulk(pks)
+        for i, pk in enumerate(pks):
+            event = events[pk]
+            self.assertEqual(event.label, 'Event {}'.format(i))
+            self.assertEqual(event.layer, self.layer)
+            self.assertEqual(event.created_by, self.faculty)
+            self.assertEqual(event.modified_by, self.faculty)
+            self.assertAlmostEqual(event.location.point.y, 40.0 + i / 100)
+            self.assertEqual(event.media.count(), i % 2)
+
+        # The created events read back through the regular endpoint
+        r = self.client.get(reverse('api-event-detail', args=[pks[1]]))
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(
+            r.json()['media'][0]['url'],
+            'https://some.bucket.example.com/1.jpg')
+
+    def test_bulk_create_response_layer(self):
+        response_layer = self.sandbox_course_response.layers.first()
+
+        self.client.force_login(self.student)
+        r = self.post(self.event_data(3), layer=response_layer)
+        self.assertEqual(r.status_code, 201)
+        self.assertEqual(response_layer.events.count(), 3)
+
+        # Faculty don't see draft responses, so the layer reads as missing
+        self.client.force_login(self.faculty)
+        r = self.post(self.event_data(3), layer=response_layer)
+        self.assertEqual(r.status_code, 400)
+        self.assertIn('layer', r.json())
+
+    def test_bulk_create_forbidden(self):
+        # A layer the student can see, on a project with an activity
+        layer = Layer.objects.create(
+            title='Activity', content_object=self.sandbox_course_project)
+        self.client.force_login(self.student)
+        r = self.post(self.event_data(3), layer=layer)
+        self.assertEqual(r.status_code, 403)
+        self.assertFalse(layer.events.exists())
+
+        # A layer the user can't see reads as one that doesn't exist
+        self.client.force_login(self.alt_faculty)
+        r = self.post(self.event_data(3))
+        self.assertEqual(r.status_code, 400)
+        missing = self.client.post(
+            self.url,
+            json.dumps({'layer': 0, 'events': self.event_data(3)}),
+            content_type='application/json'
+        )
+        self.assertEqual(
+            r.json()['layer'][0].replace(str(self.layer.pk), '0'),
+            missing.json()['layer'][0])
+
+        self.client.logout()
+        r = self.post(self.event_data(3))
+        self.assertEqual(r.status_code, 403)
+        self.assertFalse(self.layer.events.exists())
+
+    def test_bulk_create_invalid(self):
+        self.client.force_login(self.faculty)
+        events = self.event_data(3)
+        del events[1]['label']
+        r = self.post(events)
+        self.assertEqual(r.status_code, 400)
+        errors = r.json()['events']
+        self.assertEqual(list(errors.keys()), ['1'])
+        self.assertIn('label', errors['1'])
+        self.assertFalse(self.layer.events.exists())
+
+        r = self.post([])
+        self.assertEqual(r.status_code, 400)
+
+        r = self.client.post(
+            self.url,
+            json.dumps({'layer': 0, 'events': self.event_data(1)}),
+            content_type='application/json'
+        )
+        self.assertEqual(r.status_code, 400)
+
+    def test_bulk_create_query_count(self):
+        self.client.force_login(self.faculty)
+        self.post(self.event_data(1))
+
+        with CaptureQueriesContext(connection) as small:
+            self.post(self.event_data(2))
+        # SQLite splits larger inserts into batches by its variable limit
+        with CaptureQueriesContext(connection) as large:
+            r = self.post(self.event_data(100))
+        self.assertEqual(r.status_code, 201)
+        self.assertEqual(len(small), len(large))
+
+
+class EventQueryAPITest(CourseTestMixin, TestCase):
+    def setUp(self):
+        self.setup_course()
+        self.layer = Layer.objects.create(
+            title='Cities', content_object=self.sandbox_course_project)
+
+        self.new_york = self.create_event(
+            datetime=datetime(2020, 1, 1, tzinfo=timezone.utc))
+        self.london = self.create_event(
+            datetime=datetime(2020, 6, 1, tzinfo=timezone.utc))
+        Location.objects.filter(event=self.london).update(
+            point=Point(-0.12, 51.5))
+        self.paris = self.create_event()
+        Location.objects.filter(event=self.paris).update(
+            point=None,
+            polygon=Polygon(((2, 48), (3, 48), (3, 49), (2, 49), (2, 48))))
+
+        # Not visible to the sandbox course's faculty
+        alt_layer = Layer.objects.create(
+            title='Alt', content_object=self.alt_course_project)
+        self.create_event(layer=alt_layer)
+
+        self.client.force_login(self.faculty)
+
+    def create_event(self, **kwargs):
+        kwargs.setdefault('layer', self.layer)
+        return EventFactory.create(created_by=self.faculty, **kwargs)
+
+    def get_pks(self, **params):
+        r = self.client.get(reverse('api-event-list'), params)
+        self.assertEqual(r.status_code, 200)
+        return [event['pk'] for event in r.json()]
+
+    def test_list(self):
+        self.assertEqual(
+            self.get_pks(),
+            [self.new_york.pk, self.london.pk, self.paris.pk])
+        self.assertEqual(
+            self.get_pks(layer=self.layer.pk),
+            [self.new_york.pk, self.london.pk, self.paris.pk])
+        self.assertEqual(
+            self.get_pks(layer='{},0'.format(self.layer.pk)),
+            [self.new_york.pk, self.london.pk, self.paris.pk])
+
+        self.client.force_login(self.alt_faculty)
+        self.assertEqual(self.get_pks(layer=self.layer.pk), [])
+
+    def test_bbox(self):
+        self.assertEqual(
+            self.get_pks(bbox='-75,40,-73,41'), [self.new_york.pk])
+        # Polygons intersecting the box match
+        self.assertEqual(
+            self.get_pks(bbox='-1,48.5,2.5,52'),
+            [self.london.pk, self.paris.pk])
+        self.assertEqual(self.get_pks(bbox='10,10,11,11'), [])
+
+    def test_near(self):
+        self.assertEqual(
+            self.get_pks(near='-0.2,51.5', radius=10000), [self.london.pk])
+        self.assertEqual(self.get_pks(near='-0.2,51.5', radius=1000), [])
+        # The polygon's nearest edge is about 7km away
+        self.assertEqual(
+            self.get_pks(near='3.1,48.5', radius=10000), [self.paris.pk])
+        self.assertEqual(self.get_pks(near='3.1,48.5', radius=5000), [])
+        self.assertEqual(
+            self.get_pks(near='2.5,48.5', radius=1), [self.paris.pk])
+
+    def test_intersects(self):
+        europe = json.dumps({
+            'type': 'Polygon',
+            'coordinates': [[[-10, 35], [30, 35], [30, 60], [-10, 60],
+                             [-10, 35]]]
+        })
+        self.assertEqual(
+            self.get_pks(intersects=europe), [self.london.pk, self.paris.pk])
+
+    def test_time_window(self):
+        self.assertEqual(
+            self.get_pks(start='2020-03-01'), [self.london.pk])
+        self.assertEqual(
+            self.get_pks(end='2020-03-01T00:00:00Z'), [self.new_york.pk])
+        self.assertEqual(
+            self.get_pks(start='2020-01-01', end='2020-06-01'),
+            [self.new_york.pk])
+        # Combined with a place
+        self.assertEqual(
+            self.get_pks(bbox='-10,35,30,60', start='2020-01-01'),
+            [self.london.pk])
+        self.assertEqual(
+            self.get_pks(bbox='-10,35,30,60', end='2020-03-01'), [])
+
+    def test_pagination(self):
+        r = self.client.get(
+            reverse('api-event-list'), {'bbox': '-180,-90,180,90', 'limit': 2})
+        self.assertEqual(r.status_code, 200)
+        page = r.json()
+        self.assertEqual(page['count'], 3)
+        self.assertEqual(
+            [e['pk'] for e in page['results']],
+            [self.new_york.pk, self.london.pk])
+
+        r = self.client.get(page['next'])
+        self.assertEqual(
+            [e['pk'] for e in r.json()['results']], [self.paris.pk])
+
+    def test_invalid(self):
+        for params in [
+                {'bbox': '1,2,3'}, {'bbox': 'a,b,c,d'},
+                {'bbox': '10,0,0,10'}, {'bbox': '0,0,200,10'},
+                {'near': '0,0'}, {'near': '0,0', 'radius': -1},
+                {'near': '0,95', 'radius': 10},
+                {'intersects': 'not json'},
+                {'intersects': '{"type": "Point", "coordinates": [0, 0]}'},
+                {'start': 'yesterday'}, {'layer': 'a'}]:
+            r = self.client.get(reverse('api-event-list'), params)
+            self.assertEqual(r.status_code, 400, params)
+
+        # Errors are keyed by the filter that failed
+        r = self.client.get(reverse('api-event-list'), {'layer': 'a'})
+        self.assertEqual(list(r.json()), ['layer'])
+        r = self.client.get(
+            reverse('api-event-list'), {'layer': '1', 'project': 'a'})
+        self.assertEqual(r.status_code, 400)
+        self.assertEqual(list(r.json()), ['project'])
+
+    def test_project(self):
+        self.assertEqual(
+            self.get_pks(project=self.sandbox_course_project.pk),
+            [self.new_york.pk, self.london.pk, self.paris.pk])
+        self.assertEqual(self.get_pks(project=self.alt_course_project.pk), [])
+
+    def histogram(self, **params):
+        r = self.client.get(reverse('api-event-histogram'), params)
+        self.assertEqual(r.status_code, 200)
+        return r.json()
+
+    def test_histogram(self):
+        self.create_event(datetime=datetime(2020, 1, 20, tzinfo=timezone.utc))
+        self.create_event(datetime=datetime(2021, 3, 1, tzinfo=timezone.utc))
+
+        data = self.histogram()
+        self.assertEqual(data['interval'], 'year')
+        self.assertEqual(data['layers'], [{
+            'layer': self.layer.pk,
+            'total': 4,
+            'buckets': [
+                {'start': '2020-01-01T00:00:00Z', 'count': 3},
+                {'start': '2021-01-01T00:00:00Z', 'count': 1},
+            ]
+        }])
+
+        data = self.histogram(interval='month')
+        self.assertEqual(data['layers'][0]['buckets'], [
+            {'start': '2020-01-01T00:00:00Z', 'count': 2},
+            {'start': '2020-06-01T00:00:00Z', 'count': 1},
+            {'start': '2021-03-01T00:00:00Z', 'count': 1},
+        ])
+
+        data = self.histogram(interval='day', start='2020-01-02')
+        self.assertEqual(data['layers'][0]['buckets'], [
+            {'start': '2020-01-20T00:00:00Z', 'count': 1},
+            {'start': '2020-06-01T00:00:00Z', 'count': 1},
+            {'start': '2021-03-01T00:00:00Z', 'count': 1},
+        ])
+
+        # Combined with a place
+        data = self.histogram(interval='hour', bbox='-10,35,30,60')
+        self.assertEqual(data['layers'][0]['buckets'], [
+            {'start': '2020-06-01T00:00:00Z', 'count': 1},
+        ])
+
+    def test_histogram_layers(self):
+        other = Layer.objects.create(
+            title='Other', content_object=self.sandbox_course_project)
+        self.create_event(
+            layer=other, datetime=datetime(2019, 5, 5, tzinfo=timezone.utc))
+
+        data = self.histogram()
+        self.assertEqual(
+            [(lyr['layer'], lyr['total']) for lyr in data['layers']],
+            [(self.layer.pk, 2), (other.pk, 1)])
+        data = self.histogram(layer=other.pk)
+        self.assertEqual(
+            [lyr['layer'] for lyr in data['layers']], [other.pk])
+
+        self.client.force_login(self.alt_faculty)
+        self.assertEqual(self.histogram()['layers'], [])
+
+        r = self.client.get(
+            reverse('api-event-histogram'), {'interval': 'week'})
+        self.assertEqual(r.status_code, 400)
+
+    def test_query_count(self):
+        self.get_pks()
+        with CaptureQueriesContext(connection) as few:
+            self.get_pks(bbox='-180,-90,180,90')
+        for _ in range(10):
+            self.create_event().media.create(
+                url='https://some.bucket.example.com/a.jpg')
+        with CaptureQueriesContext(connection) as many:
+            self.assertEqual(len(self.get_pks(bbox='-180,-90,180,90')), 13)
+        self.assertEqual(len(few), len(many))
+
+
 class ResponseAPITest(CourseTestMixin, TestCase):
     """
     This test class focuses on testing the get_queryset method of
@@ -2061,3 +3117,209 @@ class ResponseAPITest(CourseTestMixin, TestCase):
 
         self.assertEqual(r.status_code, 200)
         self.assertEqual(len(r.data), 0)
+
+
+class ResponsePaginationAPITest(CourseTestMixin, TestCase):
+    def setUp(self):
+        self.setup_course()
+        self.activity = self.sandbox_course_activity
+        submitted = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+        # The sandbox course's student has a draft response
+        self.responses = []
+        for i in range(5):
+            student = UserFactory.create()
+            self.sandbox_course.group.user_set.add(student)
+            response = ResponseFactory.create(
+                activity=self.activity, owners=[student],
+                status=Response.SUBMITTED)
+            # Two responses submitted at the same time
+            Response.objects.filter(pk=response.pk).update(
+                submitted_at=submitted.replace(day=10 - max(i, 1)))
+            self.responses.append(response)
+
+        self.client.force_login(self.faculty)
+
+    def get_pages(self, url, params):
+        pages = []
+        r = self.client.get(url, params)
+        while True:
+            self.assertEqual(r.status_code, 200)
+            pages.append([item['pk'] for item in r.json()['results']])
+            if not r.json()['next']:
+                return pages
+            r = self.client.get(r.json()['next'])
+
+    def test_pages(self):
+        url = reverse('api-response-list')
+        r1, r2, r3, r4, r5 = [r.pk for r in self.responses]
+        pages = self.get_pages(
+            url, {'activity': self.activity.pk, 'page_size': 2})
+        self.assertEqual(pages, [[r5, r4], [r3, r1], [r2]])
+
+        # Without a page size or cursor, the list is unpaged
+        r = self.client.get(url, {'activity': self.activity.pk})
+        self.assertEqual(len(r.json()), 5)
+
+        # The default page size
+        pages = self.get_pages(
+            url, {'activity': self.activity.pk, 'cursor': ''})
+        self.assertEqual(len(pages), 1)
+        self.assertEqual(len(pages[0]), 5)
+
+    def test_drafts_first(self):
+        self.client.force_login(self.student)
+        response = ResponseFactory.create(
+            activity=ActivityFactory.create(
+                project=ProjectFactory.create(course=self.sandbox_course)),
+            owners=[self.student], status=Response.SUBMITTED)
+        Response.objects.filter(pk=response.pk).update(
+            submitted_at=datetime(2020, 1, 1, tzinfo=timezone.utc))
+
+        drafts = list(Response.objects.filter(
+            owners=self.student, submitted_at__isnull=True
+        ).order_by('pk').values_list('pk', flat=True))
+        self.assertIn(self.sandbox_course_response.pk, drafts)
+
+        pages = self.get_pages(
+            reverse('api-response-list'), {'page_size': 1})
+        self.assertEqual(pages, [[pk] for pk in drafts + [response.pk]])
+
+    def test_invalid_cursor(self):
+        for cursor in ['nope', 'W10=', 'WyJhIiwgMV0=']:
+            r = self.client.get(
+                reverse('api-response-list'),
+                {'activity': self.activity.pk, 'cursor': cursor})
+            self.assertEqual(r.status_code, 404, cursor)
+
+    def test_feedback(self):
+        for response in self.responses[:3]:
+            FeedbackFactory.create(response=response, created_by=self.faculty)
+
+        feedback = list(Feedback.objects.order_by(
+            'created_at', 'pk').values_list('pk', flat=True))
+
+        pages = self.get_pages(
+            reverse('api-feedback-list'),
+            {'activity': self.activity.pk, 'page_size': 2})
+        self.assertEqual(pages, [feedback[:2], feedback[2:]])
+
+        # The owner of a response sees its feedback
+        self.client.force_login(self.responses[0].owners.first())
+        pages = self.get_pages(
+            reverse('api-feedback-list'),
+            {'activity': self.activity.pk, 'page_size': 2})
+        self.assertEqual(pages, [[self.responses[0].feedback.pk]])
+
+    def test_query_count(self):
+        url = reverse('api-response-list')
+        params = {'activity': self.activity.pk, 'page_size': 50}
+        for response in self.responses[:2]:
+            FeedbackFactory.create(response=response, created_by=self.faculty)
+        self.client.get(url, params)
+
+        with CaptureQueriesContext(connection) as few:
+            r = self.client.get(url, params)
+        self.assertEqual(len(r.json()['results']), 5)
+
+        for i in range(45):
+            student = UserFactory.create()
+            response = ResponseFactory.create(
+                activity=self.activity, owners=[student],
+                status=Response.SUBMITTED)
+            if i % 2:
+                FeedbackFactory.create(
+                    response=response, created_by=self.faculty)
+
+        with CaptureQueriesContext(connection) as many:
+            r = self.client.get(url, params)
+        self.assertEqual(len(r.json()['results']), 50)
+        self.assertEqual(len(few), len(many))
+
+
+class ResponseQueryCountTest(CourseTestMixin, TestCase):
+    def setUp(self):
+        self.setup_course()
+        self.activity = self.sandbox_course_activity
+        self.url = reverse('api-response-list')
+
+    def add_responses(self, count):
+        for i in range(count):
+            student = UserFactory.create()
+            response = ResponseFactory.create(
+                activity=self.activity, owners=[student],
+                status=Response.SUBMITTED)
+            if i % 2:
+                FeedbackFactory.create(
+                    response=response, created_by=self.faculty,
+                    modified_by=self.faculty)
+            if i % 3 == 0:
+                RasterLayer.objects.create(
+                    title='Raster', url='https://example.com/{z}/{x}/{y}',
+                    content_object=response)
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            r = self.client.get(self.url, {'activity': self.activity.pk})
+        self.assertEqual(r.status_code, 200)
+        return len(r.json()), len(queries)
+
+    def test_query_count(self):
+        self.client.force_login(self.faculty)
+        self.add_responses(1)
+        # Warm up the per-process caches, e.g. content types
+        self.count_queries()
+
+        counts = []
+        for total in [1, 10, 300]:
+            self.add_responses(total - Response.objects.filter(
+                activity=self.activity).exclude(
+                    status=Response.DRAFT).count())
+            responses, queries = self.count_queries()
+            self.assertEqual(responses, total)
+            counts.append(queries)
+        self.assertEqual(counts, [counts[0]] * 3)
+
+
+class FeedbackAPITest(CourseTestMixin, TestCase):
+    def setUp(self):
+        self.setup_course()
+        self.activity = self.sandbox_course_activity
+        self.other = UserFactory.create()
+        self.sandbox_course.group.user_set.add(self.other)
+        other_response = ResponseFactory.create(
+            activity=self.activity, owners=[self.other],
+            status=Response.SUBMITTED)
+        Response.objects.filter(pk=self.sandbox_course_response.pk).update(
+            status=Response.SUBMITTED)
+        self.sandbox_course_response.refresh_from_db()
+        self.feedback = FeedbackFactory.create(
+            response=self.sandbox_course_response, created_by=self.faculty)
+        self.other_feedback = FeedbackFactory.create(
+            response=other_response, created_by=self.faculty)
+
+    def list_feedback(self):
+        r = self.client.get(
+            reverse('api-feedback-list'), {'activity': self.activity.pk})
+        self.assertEqual(r.status_code, 200)
+        return sorted(item['pk'] for item in r.json())
+
+    def test_list_faculty(self):
+        self.client.force_login(self.faculty)
+        self.assertEqual(
+            self.list_feedback(),
+            sorted(Feedback.objects.values_list('pk', flat=True)))
+
+    def test_list_student(self):
+        """A student sees only the feedback on their own response"""
+        self.client.force_login(self.student)
+        self.assertEqual(self.list_feedback(), [self.feedback.pk])
+
+        self.client.force_login(self.other)
+        self.assertEqual(self.list_feedback(), [self.other_feedback.pk])
+
+    def test_list_not_in_course(self):
+        self.client.force_login(self.alt_faculty)
+        r = self.client.get(
+            reverse('api-feedback-list'), {'activity': self.activity.pk})
+        self.assertEqual(r.status_code, 403)
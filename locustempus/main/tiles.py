@@ -0,0 +1,300 @@
+"""
+Builds Mapbox Vector Tiles (MVT) of a layer's Event locations
+
+On PostGIS the tile is built in the database with ST_AsMVT. Other spatial
+backends, such as the SpatiaLite database used by the tests, select the
+locations in the tile's bounds and encode the tile in Python.
+
+See https://github.com/mapbox/vector-tile-spec/tree/master/2.1
+"""
+import hashlib
+import math
+import struct
+
+from django.contrib.gis.geos import Polygon
+from django.db import connection
+from django.db.models import Count, Max, Q
+from locustempus.main.models import Event, Location
+
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+MVT_EXTENT = 4096
+# Pixels of tile coordinates included past each edge of the tile, so
+# point symbols near an edge aren't cut off
+MVT_BUFFER = 64
+MVT_LAYER_NAME = 'events'
+MAX_ZOOM = 24
+
+# Web Mercator can't represent the poles
+MAX_LATITUDE = 85.0511287798066
+
+# Geometry types and commands from the MVT spec
+POINT = 1
+POLYGON = 3
+MOVE_TO = 1
+LINE_TO = 2
+CLOSE_PATH = 7
+
+
+def is_valid_tile(z: int, x: int, y: int) -> bool:
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def tile_bounds(z: int, x: int, y: int,
+                buffer: float = 0) -> Tuple[float, float, float, float]:
+    """
+    Returns the (west, south, east, north) bounds of a tile in degrees.
+    The buffer is a fraction of the tile's size added on each side.
+    """
+    n = 2 ** z
+
+    def lng(tx):
+        return tx / n * 360 - 180
+
+    def lat(ty):
+        ty = min(max(ty, 0), n)
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * ty / n))))
+
+    return (lng(x - buffer), lat(y + 1 + buffer),
+            lng(x + 1 + buffer), lat(y - buffer))
+
+
+def tile_coords(lng: float, lat: float, z: int, x: int,
+                y: int) -> Tuple[int, int]:
+    """Projects a (lng, lat) point to the integer coordinates of a tile"""
+    n = 2 ** z
+    lat = min(max(lat, -MAX_LATITUDE), MAX_LATITUDE)
+    lat_rad = math.radians(lat)
+    tx = (lng + 180) / 360 * n
+    ty = (1 - math.asinh(math.tan(lat_rad)) / math.pi) / 2 * n
+    return (int(round((tx - x) * MVT_EXTENT)),
+            int(round((ty - y) * MVT_EXTENT)))
+
+
+# Protocol buffer encoding. Only the wire types that MVT uses are needed:
+# varints (0), 64 bit doubles (1) and length-delimited fields (2).
+
+def varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def zigzag(value: int) -> int:
+    return (value << 1) ^ (value >> 63)
+
+
+def field_key(field: int, wire_type: int) -> bytes:
+    return varint((field << 3) | wire_type)
+
+
+def varint_field(field: int, value: int) -> bytes:
+    return field_key(field, 0) + varint(value)
+
+
+def bytes_field(field: int, value: bytes) -> bytes:
+    return field_key(field, 2) + varint(len(value)) + value
+
+
+def packed_field(field: int, values: List[int]) -> bytes:
+    return bytes_field(field, b''.join(varint(v) for v in values))
+
+
+def encode_value(value: Any) -> bytes:
+    """Encodes a tile Value message"""
+    if isinstance(value, bool):
+        return varint_field(7, int(value))
+    if isinstance(value, int):
+        return varint_field(6, zigzag(value))
+    if isinstance(value, float):
+        return field_key(3, 1) + struct.pack('<d', value)
+    return bytes_field(1, str(value).encode('utf-8'))
+
+
+def command(cmd: int, count: int) -> int:
+    return (cmd & 0x7) | (count << 3)
+
+
+def ring_area(ring: List[Tuple[int, int]]) -> int:
+    """Twice the signed area of a ring, positive if clockwise on screen"""
+    return sum(
+        x1 * y2 - x2 * y1
+        for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1])
+    )
+
+
+def encode_polygon(polygon, z: int, x: int, y: int) -> List[int]:
+    geometry: List[int] = []
+    cursor = (0, 0)
+    for i, ring in enumerate(polygon):
+        points: List[Tuple[int, int]] = []
+        for lng, lat in ring.coords[:-1]:
+            point = tile_coords(lng, lat, z, x, y)
+            if not points or point != points[-1]:
+                points.append(point)
+        if len(points) > 1 and points[0] == points[-1]:
+            points.pop()
+        if len(points) < 3 or ring_area(points) == 0:
+            if i == 0:
+                # The exterior ring is too small to see at this zoom
+                return []
+            continue
+
+        # Exterior rings wind clockwise in tile coordinates, interior
+        # rings counter-clockwise
+        if (ring_area(points) > 0) != (i == 0):
+            points.reverse()
+
+        geometry.append(command(MOVE_TO, 1))
+        for j, point in enumerate(points):
+            if j == 1:
+                geometry.append(command(LINE_TO, len(points) - 1))
+            geometry.extend([
+                zigzag(point[0] - cursor[0]), zigzag(point[1] - cursor[1])])
+            cursor = point
+        geometry.append(command(CLOSE_PATH, 1))
+    return geometry
+
+
+def encode_geometry(geom, z: int, x: int,
+                    y: int) -> Tuple[Optional[int], List[int]]:
+    if geom.geom_type == 'Point':
+        px, py = tile_coords(geom.x, geom.y, z, x, y)
+        return (POINT, [command(MOVE_TO, 1), zigzag(px), zigzag(py)])
+    if geom.geom_type == 'Polygon':
+        return (POLYGON, encode_polygon(geom, z, x, y))
+    return (None, [])
+
+
+def encode_tile(features: Iterable[Tuple[int, Any, Dict[str, Any]]],
+                z: int, x: int, y: int,
+                layer_name: str = MVT_LAYER_NAME) -> bytes:
+    """
+    Encodes (id, geometry, properties) features, with geometries in
+    longitude and latitude, as a single-layer vector tile
+    """
+    keys: Dict[str, int] = {}
+    values: Dict[Tuple[type, Any], int] = {}
+    encoded_features = []
+
+    for feature_id, geom, properties in features:
+        geom_type, geometry = encode_geometry(geom, z, x, y)
+        if not geometry:
+            continue
+
+        tags = []
+        for key, value in properties.items():
+            if value is None:
+                continue
+            tags.append(keys.setdefault(key, len(keys)))
+            tags.append(values.setdefault((type(value), value), len(values)))
+
+        encoded_features.append(
+            varint_field(1, feature_id) +
+            packed_field(2, tags) +
+            varint_field(3, geom_type) +
+            packed_field(4, geometry))
+
+    if not encoded_features:
+        return b''
+
+    layer = b''.join([
+        varint_field(15, 2),
+        bytes_field(1, layer_name.encode('utf-8')),
+        b''.join(bytes_field(2, f) for f in encoded_features),
+        b''.join(bytes_field(3, k.encode('utf-8')) for k in keys),
+        b''.join(bytes_field(4, encode_value(v)) for _, v in values),
+        varint_field(5, MVT_EXTENT),
+    ])
+    return bytes_field(3, layer)
+
+
+def python_tile(layer, z: int, x: int, y: int) -> bytes:
+    envelope = Polygon.from_bbox(
+        tile_bounds(z, x, y, MVT_BUFFER / MVT_EXTENT))
+    envelope.srid = 4326
+
+    locations = Location.objects.filter(
+        event__layer=layer
+    ).filter(
+        Q(point__intersects=envelope) | Q(polygon__intersects=envelope)
+    ).select_related('event').order_by('event_id')
+
+    return encode_tile((
+        (loc.event_id, loc.point or loc.polygon, event_properties(loc.event))
+        for loc in locations.iterator()
+    ), z, x, y)
+
+
+def event_properties(event: Event) -> Dict[str, Any]:
+    return {
+        'label': event.label,
+        'datetime': event.datetime.isoformat() if event.datetime else None,
+    }
+
+
+POSTGIS_TILE_SQL = """
+WITH bounds AS (
+    SELECT ST_TileEnvelope(%(z)s, %(x)s, %(y)s) AS tile,
+           ST_Transform(ST_TileEnvelope(
+               %(z)s, %(x)s, %(y)s, margin => %(margin)s), 4326) AS query
+), features AS (
+    SELECT e.id,
+           e.label,
+           to_char(e.datetime AT TIME ZONE 'UTC',
+                   'YYYY-MM-DD"T"HH24:MI:SS"+00:00"') AS datetime,
+           ST_AsMVTGeom(
+               ST_Transform(COALESCE(l.point, l.polygon), 3857),
+               bounds.tile, %(extent)s, %(buffer)s, true) AS geom
+    FROM main_event e
+    JOIN main_location l ON l.event_id = e.id
+    CROSS JOIN bounds
+    WHERE e.layer_id = %(layer)s
+      AND (l.point && bounds.query OR l.polygon && bounds.query)
+)
+SELECT ST_AsMVT(features.*, %(name)s, %(extent)s, 'geom', 'id')
+FROM features
+WHERE geom IS NOT NULL
+"""
+
+
+def postgis_tile(layer, z: int, x: int, y: int) -> bytes:
+    with connection.cursor() as cursor:
+        cursor.execute(POSTGIS_TILE_SQL, {
+            'z': z, 'x': x, 'y': y,
+            'margin': MVT_BUFFER / MVT_EXTENT,
+            'extent': MVT_EXTENT,
+            'buffer': MVT_BUFFER,
+            'layer': layer.pk,
+            'name': MVT_LAYER_NAME,
+        })
+        row = cursor.fetchone()
+    return bytes(row[0]) if row and row[0] else b''
+
+
+def layer_tile(layer, z: int, x: int, y: int) -> bytes:
+    """Returns the vector tile of a layer's events, or b'' if empty"""
+    if getattr(connection.ops, 'postgis', False):
+        return postgis_tile(layer, z, x, y)
+    return python_tile(layer, z, x, y)
+
+
+def layer_tile_etag(layer, z: int, x: int, y: int) -> str:
+    """
+    An ETag that changes whenever an event in the layer is added, edited
+    or removed. Saving an event's location marks the event as modified,
+    see location_changed.
+    """
+    state = Event.objects.filter(layer=layer).aggregate(
+        modified=Max('modified_at'), count=Count('pk'))
+    key = '{}:{}/{}/{}:{}:{}:{}'.format(
+        layer.pk, z, x, y, state['modified'], state['count'], MVT_EXTENT)
+    digest = hashlib.sha1(key.encode('utf-8'), usedforsecurity=False)
+    return '"{}"'.format(digest.hexdigest())
@@ -1,21 +1,118 @@
 """Locus Tempus Utility Functions"""
+import time
+
 from courseaffils.models import Course
 from django.conf import settings
-from django.core.mail import send_mail
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.contenttypes.prefetch import GenericPrefetch
+from django.core.mail import EmailMessage, get_connection
 from django.core.validators import validate_email
+from django.contrib.auth.models import Group
+from django.db.models import Exists, OuterRef, Prefetch, Q
 from django.template import loader
+from locustempus.main.models import (
+    Event, Layer, Project, Response, ResponseOwner, course_role_cache,
+    course_role_cache_key
+)
+from rest_framework.request import Request
+
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+
+def render_template_emails(
+        template_name: str,
+        recipients: Sequence[Tuple[str, Dict[str, Any]]]
+) -> List[Tuple[str, str]]:
+    """
+    Renders the template for each (recipient, context) pair, returning
+    (recipient, body) pairs. Every address is validated before anything
+    is rendered, and the template is compiled once.
+    """
+    for recipient, context in recipients:
+        validate_email(recipient)
+
+    template = loader.get_template(template_name)
+    return [
+        (recipient, template.render(context))
+        for recipient, context in recipients
+    ]
+
+
+def template_email_messages(
+        subject: str, template_name: str,
+        recipients: Sequence[Tuple[str, Dict[str, Any]]]
+) -> List[EmailMessage]:
+    """Renders a message to each recipient from the template"""
+    return [
+        EmailMessage(subject, body, settings.SERVER_EMAIL, [recipient])
+        for recipient, body in render_template_emails(
+            template_name, recipients)
+    ]
+
+
+class SendRate(object):
+    """
+    Spaces out sends to at most `limit` messages a second, or not at all
+    if limit is None
+    """
+    def __init__(self, limit: Optional[float]):
+        self.limit = limit
+        self.next_send: Optional[float] = None
+
+    def wait(self, count: int = 1) -> None:
+        """Waits until `count` more messages may be sent"""
+        if not self.limit:
+            return
+
+        now = time.monotonic()
+        if self.next_send is not None and self.next_send > now:
+            time.sleep(self.next_send - now)
+            now = self.next_send
+        self.next_send = now + count / self.limit
+
 
-from typing import Any, Dict
+def send_email_messages(messages: List[EmailMessage],
+                        chunk_size: Optional[int] = None,
+                        rate_limit: Optional[float] = None,
+                        connection=None) -> int:
+    """
+    Sends the messages over one connection, chunk_size at a time and at
+    most rate_limit a second, and returns the number sent. Both default
+    to settings.EMAIL_CHUNK_SIZE and EMAIL_RATE_LIMIT.
+    """
+    if not messages:
+        return 0
+
+    chunk_size = chunk_size or getattr(settings, 'EMAIL_CHUNK_SIZE', 100)
+    rate = SendRate(rate_limit or getattr(settings, 'EMAIL_RATE_LIMIT', None))
+    sent = 0
+    with connection or get_connection() as conn:
+        for i in range(0, len(messages), chunk_size):
+            chunk = messages[i:i + chunk_size]
+            rate.wait(len(chunk))
+            sent += conn.send_messages(chunk) or 0
+    return sent
+
+
+def send_template_emails(
+        subject: str, template_name: str,
+        recipients: Sequence[Tuple[str, Dict[str, Any]]],
+        chunk_size: Optional[int] = None,
+        rate_limit: Optional[float] = None,
+        connection=None) -> int:
+    """
+    Validates the addresses, then sends a template email to each
+    (recipient, context) pair over one connection
+    """
+    return send_email_messages(
+        template_email_messages(subject, template_name, recipients),
+        chunk_size, rate_limit, connection)
 
 
 def send_template_email(subject: str, template_name: str,
                         context: Dict[str, Any], recipient: str) -> None:
     """Validate address and send a template email"""
-    validate_email(recipient)
-
-    template = loader.get_template(template_name)
-    message = template.render(context)
-    send_mail(subject, message, settings.SERVER_EMAIL, [recipient])
+    send_template_emails(subject, template_name, [(recipient, context)])
 
 
 def get_courses_for_user(user):
@@ -34,3 +131,197 @@ def get_courses_for_instructor(user):
     return courses.select_related(
             'info', 'group', 'faculty_group', 'settings').prefetch_related(
                 'coursedetails_set')
+
+
+class CourseRoles(object):
+    """
+    The courses a user is faculty or a member of, loaded in one query.
+
+    These answer the same questions as Course.is_true_faculty,
+    Course.is_true_member and Course.is_faculty without a query per call.
+    If settings.COURSE_ROLE_CACHE names a cache, the course ids are kept
+    there across requests until a membership change invalidates them.
+    """
+    def __init__(self, user):
+        self.user = user
+        self.faculty_course_ids = frozenset()
+        self.member_course_ids = frozenset()
+
+        if user.is_anonymous:
+            return
+
+        cache = course_role_cache()
+        key = course_role_cache_key(user.pk)
+        role_ids = cache.get(key) if cache is not None else None
+        if role_ids is None:
+            role_ids = self.load_course_role_ids(user)
+            if cache is not None:
+                cache.set(
+                    key, role_ids,
+                    getattr(settings, 'COURSE_ROLE_CACHE_TIMEOUT', 300))
+
+        faculty_course_ids, member_course_ids = role_ids
+        self.faculty_course_ids = frozenset(faculty_course_ids)
+        self.member_course_ids = frozenset(member_course_ids)
+
+    @staticmethod
+    def load_course_role_ids(user) -> Tuple[List[int], List[int]]:
+        """Returns the faculty and member course ids for the user"""
+        memberships = Group.user_set.through.objects.filter(user=user)
+        courses = Course.objects.annotate(
+            user_is_member=Exists(
+                memberships.filter(group=OuterRef('group'))),
+            user_is_faculty=Exists(
+                memberships.filter(group=OuterRef('faculty_group')))
+        ).filter(
+            Q(user_is_member=True) | Q(user_is_faculty=True)
+        ).values_list('pk', 'user_is_member', 'user_is_faculty')
+
+        faculty_course_ids = []
+        member_course_ids = []
+        for pk, is_member, is_faculty in courses:
+            if is_member:
+                member_course_ids.append(pk)
+            if is_faculty:
+                faculty_course_ids.append(pk)
+
+        return (faculty_course_ids, member_course_ids)
+
+    def is_true_faculty(self, course) -> bool:
+        return course.pk in self.faculty_course_ids
+
+    def is_true_member(self, course) -> bool:
+        return course.pk in self.member_course_ids
+
+    def is_faculty(self, course) -> bool:
+        return self.user.is_staff or self.is_true_faculty(course)
+
+    def is_student(self, course) -> bool:
+        return not self.is_true_faculty(course) and \
+            self.is_true_member(course)
+
+
+def get_course_roles(request) -> CourseRoles:
+    """
+    Returns the CourseRoles for the requesting user, memoized on the
+    request so permissions, viewsets and serializers share one lookup
+    """
+    if isinstance(request, Request):
+        request = request._request
+
+    roles = getattr(request, '_lt_course_roles', None)
+    if not isinstance(roles, CourseRoles) or roles.user != request.user:
+        roles = CourseRoles(request.user)
+        request._lt_course_roles = roles
+
+    return roles
+
+
+def get_projects_for_user(user, roles=None):
+    """
+    Returns the projects a user may read: those in courses they are
+    faculty in, and those with an activity in courses they are a member of
+    """
+    if user.is_anonymous:
+        return Project.objects.none()
+
+    roles = roles or CourseRoles(user)
+    return Project.objects.filter(
+        Q(course__in=roles.faculty_course_ids) |
+        Q(course__in=roles.member_course_ids, activity__isnull=False)
+    )
+
+
+def get_layers_for_user(user, roles=None):
+    """
+    Returns the layers a user may read, following the rules in
+    LayerPermission.layer_permission_helper.
+
+    Each rule is an id-producing subquery on a single table, matched
+    against Layer's (content_type, object_id) pair, so the layer table is
+    never joined to responses or owners and no row is returned twice.
+    """
+    if user.is_anonymous:
+        return Layer.objects.none()
+
+    roles = roles or CourseRoles(user)
+    not_draft = [Response.SUBMITTED, Response.REVIEWED]
+
+    # Faculty see a course's projects, students only those with an activity
+    projects = Project.objects.filter(
+        Q(course__in=roles.faculty_course_ids) |
+        Q(course__in=roles.member_course_ids, activity__isnull=False)
+    ).values('pk')
+
+    # Activities the user has submitted a response to
+    submitted_activities = ResponseOwner.objects.filter(
+        owner=user, response__status__in=not_draft
+    ).values('activity')
+
+    responses = Response.objects.filter(
+        Q(pk__in=ResponseOwner.objects.filter(
+            owner=user).values('response')) |
+        Q(status__in=not_draft,
+          activity__project__course__in=roles.faculty_course_ids) |
+        Q(status__in=not_draft,
+          activity__in=submitted_activities,
+          activity__project__course__in=roles.member_course_ids)
+    ).values('pk')
+
+    return Layer.objects.filter(
+        Q(content_type=ContentType.objects.get_for_model(Project),
+          object_id__in=projects) |
+        Q(content_type=ContentType.objects.get_for_model(Response),
+          object_id__in=responses)
+    )
+
+
+def prefetch_layer_relations(layers, events=None):
+    """
+    Attach the related rows LayerSerializer and LayerPermission read to a
+    Layer queryset, so that serializing it costs a fixed number of queries
+    regardless of how many events each layer holds. An Event queryset
+    can be given to limit the events attached to each layer.
+    """
+    if events is None:
+        events = Event.objects.all()
+    return layers.select_related('created_by', 'content_type')\
+        .prefetch_related(
+            Prefetch(
+                'events',
+                queryset=events.select_related(
+                    'location', 'created_by').prefetch_related('media')
+            ),
+            GenericPrefetch('content_object', [
+                Project.objects.select_related('course', 'activity'),
+                Response.objects.select_related('activity__project__course')
+            ])
+        )
+
+
+def prefetch_bundle_relations(projects, events=None):
+    """
+    Attach the related rows ProjectBundleSerializer reads to a Project
+    queryset: the course, activity, raster layers, and the layers with
+    prefetch_layer_relations. An Event queryset can be given to limit the
+    events attached to each layer.
+    """
+    return projects.select_related('course', 'activity').prefetch_related(
+        Prefetch(
+            'layers',
+            queryset=prefetch_layer_relations(Layer.objects.all(), events)
+        ),
+        'raster_layers'
+    )
+
+
+def prefetch_response_relations(responses):
+    """
+    Attach the related rows ResponseSerializer reads to a Response
+    queryset: owners, layers, raster layers, and feedback with its
+    authors, so that serializing it costs a fixed number of queries
+    regardless of how many responses it holds.
+    """
+    return responses.select_related(
+        'feedback__created_by', 'feedback__modified_by'
+    ).prefetch_related('owners', 'layers', 'raster_layers')
@@ -10,13 +10,18 @@ from django.contrib.auth.mixins import (
 from django.contrib.auth.models import User, Group
 from django.contrib.sites.shortcuts import get_current_site
 from django.core.exceptions import PermissionDenied
+from django.core.mail import EmailMessage
 from django.db import connections
-from django.db.models import OuterRef, Subquery
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.http import (
     HttpRequest, HttpResponse, HttpResponseRedirect, Http404
 )
 from django.shortcuts import get_object_or_404, render, redirect
 from django.urls.base import reverse
+from django.utils.cache import (
+    get_conditional_response, patch_cache_control, patch_vary_headers
+)
 from django.utils.decorators import method_decorator
 from django.views.decorators.clickjacking import xframe_options_exempt
 from django.views.generic.base import View
@@ -27,20 +32,33 @@ from django.views.generic.edit import (
 from lti_provider.models import LTICourseContext
 
 from locustempus.main.forms import (
-    CourseForm, InviteUNIFormset, InviteEmailFormset
+    CourseForm, CourseRosterInviteFileForm, InviteUNIFormset,
+    InviteEmailFormset
+)
+from locustempus.main.mailqueue import (
+    queue_emails, template_email, template_emails
+)
+from locustempus.main.models import (
+    Activity, ActivityStats, GuestUserAffil, Project, QueuedEmail, Response,
+    invalidate_course_roles
 )
-from locustempus.main.models import GuestUserAffil, Project, Response
 from locustempus.main.management.commands.integrationserver import (
     reset_test_models
 )
-from locustempus.main.utils import get_courses_for_user, send_template_email
+from locustempus.main.tiles import (
+    is_valid_tile, layer_tile, layer_tile_etag
+)
+from locustempus.main.utils import (
+    get_course_roles, get_courses_for_user, get_layers_for_user,
+    send_email_messages, template_email_messages
+)
 from locustempus.mixins import (
     LoggedInCourseMixin, LoggedInFacultyMixin
 )
 from locustempus.utils import user_display_name
 from s3sign.views import SignS3View as BaseSignS3View
 from typing import (
-    Any, Tuple, List
+    Any, Dict, Tuple, List, Set
 )
 from uuid import uuid4
 
@@ -145,8 +163,27 @@ class CourseDetailView(LoggedInCourseMixin, View):
     http_method_names = ['get', 'post']
 
     def get_projects(self, course, is_faculty):
+        """
+        Returns the course's projects, annotated with the response
+        counts from ActivityStats (for faculty) or the user's own response
+        status (for students) so the project cards render without
+        per-project queries.
+        """
         if is_faculty:
-            projects = Project.objects.filter(course=course)
+            # e.g. activities made with bulk_create
+            missing = list(Activity.objects.filter(
+                project__course=course, stats__isnull=True
+            ).values_list('pk', flat=True))
+            if missing:
+                ActivityStats.rebuild_batch(missing)
+
+            projects = Project.objects.filter(course=course).annotate(
+                submitted_response_count=Coalesce(
+                    F('activity__stats__submitted_count') +
+                    F('activity__stats__reviewed_count'), 0),
+                feedback_count=Coalesce(
+                    F('activity__stats__reviewed_count'), 0)
+            )
         else:
             projects = Project.objects.filter(
                 course=course, activity__isnull=False) \
@@ -156,7 +193,7 @@ class CourseDetailView(LoggedInCourseMixin, View):
                         owners__in=[self.request.user]
                     ).values('status')[:1]
                 ))
-        return projects.order_by('title')
+        return projects.select_related('activity').order_by('title')
 
     def get_context(self, request, toggle_layout, pk):
         course = get_object_or_404(Course, pk=pk)
@@ -247,6 +284,8 @@ class CourseRosterView(LoggedInFacultyMixin, DetailView):
             accepted_at=None
         )
         ctx['inactive_invitees'] = inactive_email_invites
+        ctx['queued_emails'] = QueuedEmail.objects.filter(
+            course=course).order_by('-created_at', '-pk')[:50]
         ctx['page_type'] = 'roster'
         ctx['breadcrumb'] = {
             'Workspaces': reverse('course-list-view'),
@@ -347,14 +386,15 @@ class CourseRosterResendEmailInviteView(LoggedInFacultyMixin, View):
 
         # Resend email to invited user
         subj = 'Locus Tempus Invitation: {}'.format(course.title)
-        send_template_email(
+        queue_emails([template_email(
             subj,
             self.guest_email_template,
             {'course_title': course.title,
              'guest_email': affil.guest_email,
              'site': site},
-            affil.guest_email
-        )
+            affil.guest_email,
+            course=course
+        )])
 
         msg = ('{} has been resent an invitation '
                'to join the workspace.'.format(addr))
@@ -382,51 +422,100 @@ class CourseRosterUninviteView(LoggedInFacultyMixin, View):
 
 
 class CourseRosterInviteUser(LoggedInFacultyMixin, View):
-    """Invites a new user to the course by UNI"""
+    """Invites new users to the course by UNI or email address"""
     http_method_names = ['get', 'post']
     template_name = 'main/course_roster_invite.html'
     email_template = 'main/email/new_user.txt'
     guest_email_template = 'main/email/new_guest_user.txt'
     uni_formset = InviteUNIFormset
     email_formset = InviteEmailFormset
+    uni_file_form = CourseRosterInviteFileForm
+    # Past this many, an outcome is reported in one message rather than
+    # one per invitee
+    message_limit = 10
 
     @staticmethod
-    def get_or_create_user(uni: str) -> User:
-        try:
-            user = User.objects.get(username=uni)
-        except User.DoesNotExist:
-            user = User(username=uni)
-            user.set_unusable_password()
-            user.save()
-        return user
+    def get_or_create_users(unis: List[str]) -> List[User]:
+        """
+        Returns the user for each UNI, creating the missing ones in one
+        insert
+        """
+        users = {
+            user.username: user
+            for user in User.objects.filter(username__in=unis)
+        }
+        new_users = []
+        for uni in unis:
+            if uni not in users:
+                user = User(username=uni)
+                user.set_unusable_password()
+                users[uni] = user
+                new_users.append(user)
+        User.objects.bulk_create(new_users)
+        return [users[uni] for uni in unis]
+
+    @staticmethod
+    def add_members(course: Course, users: List[User]) -> Set[int]:
+        """
+        Adds the users to the course in one insert, and returns the ids
+        of those who were already members
+        """
+        membership = Group.user_set.through
+        user_ids = [user.pk for user in users]
+        members = set(membership.objects.filter(
+            group_id=course.group_id, user_id__in=user_ids
+        ).values_list('user_id', flat=True))
+        added = [pk for pk in dict.fromkeys(user_ids) if pk not in members]
+        membership.objects.bulk_create([
+            membership(group_id=course.group_id, user_id=pk) for pk in added
+        ], ignore_conflicts=True)
+        # A bulk insert doesn't send m2m_changed
+        invalidate_course_roles(added)
+        return members
+
+    def add_messages(self, level: int, msgs: List[str],
+                     summary: str) -> None:
+        if len(msgs) > self.message_limit:
+            messages.add_message(
+                self.request, level, summary.format(len(msgs)))
+        else:
+            for msg in msgs:
+                messages.add_message(self.request, level, msg)
 
     def handle_unis(self, course: Course, unis: List[str]) -> None:
         """
         Add a list of UNI users to a course
         """
         site = get_current_site(self.request)
-        for uni in unis:
-            user = self.get_or_create_user(uni)
+        users = self.get_or_create_users(unis)
+        members = self.add_members(course, users)
+        context = {'course_title': course.title, 'site': site}
+        recipients = []
+        already_members = []
+        added = []
+        for uni, user in zip(unis, users):
             display_name = user_display_name(user)
-            if course.is_true_member(user):
-                msg = '{} ({}) is already a course member'.format(
-                    display_name, uni)
-                messages.add_message(self.request, messages.WARNING, msg)
+            if user.pk in members:
+                already_members.append(
+                    '{} ({}) is already a course member'.format(
+                        display_name, uni))
             else:
                 email = '{}@columbia.edu'.format(uni)
-                course.group.user_set.add(user)
-                subj = 'Locus Tempus Invitation: {}'.format(course.title)
-                send_template_email(
-                    subj,
-                    self.email_template,
-                    {'course_title': course.title, 'site': site},
-                    email
-                )
-                msg = (
+                recipients.append((email, context))
+                added.append((
                     '{} is now a workspace member. An email notification '
-                    'was sent to {}.').format(display_name, email)
-
-                messages.add_message(self.request, messages.SUCCESS, msg)
+                    'was sent to {}.').format(display_name, email))
+
+        self.add_messages(
+            messages.WARNING, already_members,
+            '{} users are already course members')
+        self.add_messages(
+            messages.SUCCESS, added,
+            '{} users are now workspace members. An email notification '
+            'was sent to each of them.')
+        queue_emails(template_emails(
+            'Locus Tempus Invitation: {}'.format(course.title),
+            self.email_template, recipients, course))
 
     def handle_emails(self, course: Course, email_addrs: List[str]) -> None:
         """
@@ -434,67 +523,82 @@ class CourseRosterInviteUser(LoggedInFacultyMixin, View):
         """
         site = get_current_site(self.request)
         assert isinstance(self.request.user, User)  # nosec
-        for addr in email_addrs:
-            try:
-                user = User.objects.get(email=addr)
-                if course.is_true_member(user):
-                    msg = '{} is already a course member'.format(
-                        user.username)
-                    messages.add_message(self.request, messages.WARNING, msg)
-                else:
-                    course.group.user_set.add(user)
-                    subj = 'Locus Tempus Invitation: {}'.format(course.title)
-                    send_template_email(
-                        subj,
-                        self.email_template,
-                        {'course_title': course.title, 'site': site},
-                        addr
-                    )
-                    msg = (
-                        '{} is now a workspace member. An email notification '
-                        'was sent to {}.').format(
-                            user.username, addr)
-
-                    messages.add_message(self.request, messages.SUCCESS, msg)
-            except User.DoesNotExist:
-                # Create an affiliation
-                # You need to check if an affiliation exist
-                if GuestUserAffil.objects.filter(
-                        course=course, guest_email=addr).exists():
-                    msg = ('{} has already been invited to join the workspace.'
-                           ' Please use the resend button below to '
-                           'resend the invitation'.format(addr))
-                    messages.add_message(self.request, messages.INFO, msg)
-                else:
-                    affil = GuestUserAffil(
-                        course=course,
-                        guest_email=addr,
-                        invited_by=self.request.user
-                    )
-                    affil.save()
-                    # Send email to invite user to sign up
-                    subj = 'Locus Tempus Invitation: {}'.format(course.title)
-                    send_template_email(
-                        subj,
-                        self.guest_email_template,
-                        {
-                            'course_title': course.title,
-                            'guest_email': addr,
-                            'site': site
-                        },
-                        addr
-                    )
-                    # Show message to faculty
-                    msg = ('{} has been sent an invitation '
-                           'to join the workspace.'.format(addr))
-                    messages.add_message(self.request, messages.SUCCESS, msg)
+        subj = 'Locus Tempus Invitation: {}'.format(course.title)
 
-    def get(self, request, *args, **kwargs) -> HttpResponse:
-        course = get_object_or_404(Course, pk=kwargs.get('pk'))
-        return render(request, self.template_name, {
+        # The first account with each address, as User.objects.get()
+        # would find if there were only one
+        users: Dict[str, User] = {}
+        for user in User.objects.filter(
+                email__in=email_addrs).order_by('pk'):
+            users.setdefault(user.email, user)
+        members = self.add_members(course, list(users.values()))
+
+        guest_addrs = [addr for addr in email_addrs if addr not in users]
+        invited = set(GuestUserAffil.objects.filter(
+            course=course, guest_email__in=guest_addrs
+        ).values_list('guest_email', flat=True))
+        GuestUserAffil.objects.bulk_create([
+            GuestUserAffil(
+                course=course,
+                guest_email=addr,
+                invited_by=self.request.user
+            )
+            for addr in guest_addrs if addr not in invited
+        ])
+
+        context = {'course_title': course.title, 'site': site}
+        member_recipients = []
+        guest_recipients = []
+        already_members = []
+        already_invited = []
+        added = []
+        for addr in email_addrs:
+            user = users.get(addr)
+            if user is not None and user.pk in members:
+                already_members.append(
+                    '{} is already a course member'.format(user.username))
+            elif user is not None:
+                member_recipients.append((addr, context))
+                added.append((
+                    '{} is now a workspace member. An email notification '
+                    'was sent to {}.').format(user.username, addr))
+            elif addr in invited:
+                already_invited.append((
+                    '{} has already been invited to join the workspace.'
+                    ' Please use the resend button below to '
+                    'resend the invitation').format(addr))
+            else:
+                # Send email to invite user to sign up
+                guest_recipients.append(
+                    (addr, dict(context, guest_email=addr)))
+                added.append(
+                    '{} has been sent an invitation '
+                    'to join the workspace.'.format(addr))
+
+        self.add_messages(
+            messages.WARNING, already_members,
+            '{} users are already course members')
+        self.add_messages(
+            messages.INFO, already_invited,
+            '{} addresses have already been invited to join the workspace.'
+            ' Please use the resend buttons below to resend the '
+            'invitations')
+        self.add_messages(
+            messages.SUCCESS, added,
+            '{} invitations to join the workspace were sent.')
+        queue_emails(
+            template_emails(subj, self.email_template, member_recipients,
+                            course) +
+            template_emails(subj, self.guest_email_template,
+                            guest_recipients, course))
+
+    def render_forms(self, course: Course, uni_formset, email_formset,
+                     uni_file_form) -> HttpResponse:
+        return render(self.request, self.template_name, {
             'course': course,
-            'uni_formset': self.uni_formset(prefix='uni'),
-            'email_formset': self.email_formset(prefix='email'),
+            'uni_formset': uni_formset,
+            'email_formset': email_formset,
+            'uni_file_form': uni_file_form,
             'page_type': 'roster',
             'template_title': 'Invite Contributor',
             'breadcrumb': {
@@ -505,36 +609,42 @@ class CourseRosterInviteUser(LoggedInFacultyMixin, View):
             }
         })
 
+    def get(self, request, *args, **kwargs) -> HttpResponse:
+        course = get_object_or_404(Course, pk=kwargs.get('pk'))
+        return self.render_forms(
+            course,
+            self.uni_formset(prefix='uni'),
+            self.email_formset(prefix='email'),
+            self.uni_file_form()
+        )
+
     def post(self, request, *args, **kwargs) -> HttpResponse:
         course = get_object_or_404(Course, pk=kwargs.get('pk'))
         uni_formset = self.uni_formset(
             request.POST, request.FILES, prefix='uni')
         email_formset = self.email_formset(
             request.POST, request.FILES, prefix='email')
+        uni_file_form = self.uni_file_form(request.POST, request.FILES)
 
-        if uni_formset.is_valid() and email_formset.is_valid():
+        if uni_formset.is_valid() and email_formset.is_valid() and \
+                uni_file_form.is_valid():
             unis = [el['invitee'] for el in uni_formset.cleaned_data if el]
+            unis += uni_file_form.cleaned_data['uni_file']
             email_addrs = [el['invitee'] for el
                            in email_formset.cleaned_data if el]
+            # Each invitee once, in the order given
+            unis = list(dict.fromkeys(unis))
+            email_addrs = list(dict.fromkeys(email_addrs))
 
             if (len(unis) == 0 and len(email_addrs) == 0):
                 msg = 'A value must be entered in either field.'
                 messages.add_message(request, messages.ERROR, msg)
-                return render(request, self.template_name, {
-                    'course': course,
-                    'uni_formset': self.uni_formset(prefix='uni'),
-                    'email_formset': self.email_formset(prefix='email'),
-                    'page_type': 'roster',
-                    'template_title': 'Invite Contributor',
-                    'breadcrumb': {
-                        'Workspaces': reverse('course-list-view'),
-                        course.title:
-                            reverse('course-detail-view', args=[course.pk]),
-                        'Roster':
-                            reverse('course-roster-view', args=[course.pk]),
-                        'Invite': ''
-                    }
-                })
+                return self.render_forms(
+                    course,
+                    self.uni_formset(prefix='uni'),
+                    self.email_formset(prefix='email'),
+                    self.uni_file_form()
+                )
 
             self.handle_unis(course, unis)
             self.handle_emails(course, email_addrs)
@@ -542,42 +652,31 @@ class CourseRosterInviteUser(LoggedInFacultyMixin, View):
             return HttpResponseRedirect(
                 reverse('course-roster-view', args=[course.pk]))
 
-        return render(request, self.template_name, {
-            'course': course,
-            'uni_formset': uni_formset,
-            'email_formset': email_formset,
-            'page_type': 'roster',
-            'template_title': 'Invite Contributor',
-            'breadcrumb': {
-                'Workspaces': reverse('course-list-view'),
-                course.title: reverse('course-detail-view', args=[course.pk]),
-                'Roster': reverse('course-roster-view', args=[course.pk]),
-                'Invite': ''
-            }
-        })
+        return self.render_forms(
+            course, uni_formset, email_formset, uni_file_form)
 
 
 @method_decorator(xframe_options_exempt, name='dispatch')
 class LTICourseCreate(LoginRequiredMixin, View):
 
-    def notify_staff(self, course: Course) -> None:
+    def notify_staff(self, course: Course) -> List[EmailMessage]:
         data = {
             'course': course,
             'user': self.request.user
         }
-        send_template_email(
+        return template_email_messages(
             'Locus Tempus Course Connected',
             'main/notify_lti_course_connect.txt',
-            data, settings.SERVER_EMAIL)
+            [(settings.SERVER_EMAIL, data)])
 
-    def thank_faculty(self, course: Course) -> None:
+    def thank_faculty(self, course: Course) -> List[EmailMessage]:
         assert isinstance(self.request.user, User)  # nosec
         user = self.request.user
-        send_template_email(
+        return template_email_messages(
             'Locus Tempus Course Connected',
             'main/lti_course_connect.txt',
-            {'course': course},
-            user.email if user.email else user.username + '@columbia.edu')
+            [(user.email if user.email else user.username + '@columbia.edu',
+              {'course': course})])
 
     def groups_from_context(self, course_context) -> Tuple[Group, Group]:
         group, created = Group.objects.get_or_create(name=course_context)
@@ -661,8 +760,9 @@ class LTICourseCreate(LoginRequiredMixin, View):
             '<strong>Success!</strong> ' +
             '{} is connected to Locus Tempus.'.format(title))
 
-        self.notify_staff(course)
-        self.thank_faculty(course)
+        # Both emails over one connection
+        send_email_messages(
+            self.notify_staff(course) + self.thank_faculty(course))
 
         return HttpResponseRedirect(reverse('lti-landing-page'))
 
@@ -752,6 +852,42 @@ class ProjectDeleteView(LoggedInFacultyMixin, DeleteView):
             kwargs={'pk': self.kwargs.get('pk')})
 
 
+class LayerTileView(View):
+    """
+    Serves a vector tile of the events in a layer. The layer must be one
+    the user could read through the layer API.
+    """
+    http_method_names = ['get']
+
+    def get(self, request, *args, **kwargs) -> HttpResponse:
+        if not request.user.is_authenticated:
+            raise PermissionDenied
+
+        z, x, y = kwargs['z'], kwargs['x'], kwargs['y']
+        if not is_valid_tile(z, x, y):
+            raise Http404()
+
+        layers = get_layers_for_user(request.user, get_course_roles(request))
+        layer = get_object_or_404(layers, pk=kwargs['pk'])
+
+        etag = layer_tile_etag(layer, z, x, y)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            tile = layer_tile(layer, z, x, y)
+            if tile:
+                response = HttpResponse(
+                    tile, content_type='application/vnd.mapbox-vector-tile')
+            else:
+                response = HttpResponse(status=204)
+
+        # Tiles depend on the user's access, so are only cached privately,
+        # and revalidated against the ETag
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ['Cookie'])
+        return response
+
+
 class SignS3View(LoginRequiredMixin, BaseSignS3View):
     root = "uploads/"
 
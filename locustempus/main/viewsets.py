@@ -1,5 +1,23 @@
 """The viewsets and views used for the API"""
-from django.db.models import Q, Exists, OuterRef
+from asgiref.sync import sync_to_async
+from courseaffils.models import Course
+from datetime import timezone as dt_timezone
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Count, Q
+from django.db.models.functions import Trunc
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
+from django.views.generic.base import View
+from locustempus.main.clusters import cached_event_clusters
+from locustempus.main.exporters import geojson_response
+from locustempus.main.filters import (
+    EventPagination, EventSpatialFilter, EventTemporalFilter,
+    FeedbackCursorPagination, ResponseCursorPagination
+)
+from locustempus.main.importers import (
+    IMPORT_FORMATS, detect_format, import_layer
+)
 from locustempus.main.models import (
     Layer, Project, Event, Activity, Response, Feedback
 )
@@ -9,13 +27,32 @@ from locustempus.main.permissions import (
 )
 from locustempus.main.serializers import (
     LayerSerializer, ProjectSerializer, EventSerializer, ActivitySerializer,
-    ResponseSerializer, FeedbackSerializer
+    ActivityProgressSerializer, ResponseSerializer, FeedbackSerializer,
+    ProjectBundleSerializer, BulkEventSerializer
 )
+from locustempus.main.tiles import MAX_ZOOM
 from locustempus.main.utils import (
-    get_courses_for_user, get_courses_for_instructor
+    get_course_roles, get_layers_for_user, get_projects_for_user,
+    prefetch_bundle_relations, prefetch_layer_relations,
+    prefetch_response_relations
+)
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.exceptions import (
+    NotAuthenticated, PermissionDenied, ValidationError
 )
+from rest_framework.parsers import MultiPartParser
+from rest_framework.request import Request
+from rest_framework.response import Response as APIResponse
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet
 
+from typing import Any, Dict
+
+
+HISTOGRAM_INTERVALS = ('year', 'month', 'day', 'hour')
+
 
 class ProjectApiView(ModelViewSet):
     """Retrieves a single project"""
@@ -29,13 +66,53 @@ class ProjectApiView(ModelViewSet):
         OR
         B) They are in the course and the project has an activity
         """
-        user = self.request.user
-        instructor_courses = get_courses_for_instructor(user)
-        user_courses = get_courses_for_user(user)
-        return Project.objects.filter(
-            (Q(course__in=instructor_courses)) |
-            (Q(course__in=user_courses) & Q(activity__isnull=False))
-        )
+        projects = get_projects_for_user(
+            self.request.user, get_course_roles(self.request))
+
+        if self.action == 'bundle':
+            projects = prefetch_bundle_relations(
+                projects, self.get_bundle_events())
+
+        return projects
+
+    def get_bundle_events(self):
+        return EventTemporalFilter().filter_queryset(
+            self.request, Event.objects.all(), self)
+
+    def get_serializer_class(self):
+        if self.action == 'bundle':
+            return ProjectBundleSerializer
+        return ProjectSerializer
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.action == 'bundle':
+            context['events'] = self.get_bundle_events()
+        return context
+
+    @action(detail=True, methods=['get'])
+    def bundle(self, request, pk=None):
+        """
+        Returns a project with its layers, their events, and any aggregated
+        response layers inline, saving the client a request per layer.
+        The events can be limited to a time range with start and end, see
+        EventTemporalFilter.
+        """
+        serializer = self.get_serializer(self.get_object())
+        return APIResponse(serializer.data)
+
+    @action(detail=True, methods=['get'])
+    def geojson(self, request, pk=None):
+        """
+        Streams the events of the project's layers, and of the response
+        layers the user can see, as a GeoJSON FeatureCollection
+        """
+        project = self.get_object()
+        layers = get_layers_for_user(
+            request.user, get_course_roles(request)
+        ).filter(
+            Q(project=project) | Q(response__activity__project=project))
+        return geojson_response(layers, 'project-{}'.format(project.pk))
 
     permission_classes = [IsLoggedInCourse]
 
@@ -52,11 +129,33 @@ class ActivityApiView(ModelViewSet):
         A user can GET / Activityies if the user is in the
         course group for the related Course object
         """
-        user = self.request.user
-        courses = get_courses_for_user(user)
-        return Activity.objects.filter(
-            project__course__in=courses
+        roles = get_course_roles(self.request)
+        activities = Activity.objects.filter(
+            project__course__in=roles.member_course_ids
         )
+        if self.action == 'progress':
+            activities = activities.select_related(
+                'project__course', 'stats')
+        return activities
+
+    @action(detail=True, methods=['get'])
+    def progress(self, request, pk=None):
+        """
+        Returns the activity's response counts for faculty, read from
+        its ActivityStats, with the number of students who have no
+        response yet
+        """
+        activity = self.get_object()
+        course = activity.project.course
+        if not get_course_roles(request).is_faculty(course):
+            raise PermissionDenied
+
+        students = User.objects.filter(groups=course.group_id)
+        if course.faculty_group_id:
+            students = students.exclude(groups=course.faculty_group_id)
+        serializer = ActivityProgressSerializer(
+            activity.get_stats(), context={'member_count': students.count()})
+        return APIResponse(serializer.data)
 
 
 class LayerApiView(ModelViewSet):
@@ -85,42 +184,212 @@ class LayerApiView(ModelViewSet):
           user is a student in Layer => Response => Activity => Project =>
           Course
         """
-        user = self.request.user
-        instructor_courses = get_courses_for_instructor(user)
-        user_courses = get_courses_for_user(user)
-        user_owned_response = Response.objects.filter(
-            activity=OuterRef('response__activity__pk'),
-            owners__in=[user],
-            status__in=[Response.SUBMITTED, Response.REVIEWED]
-        )
-        return Layer.objects.annotate(
-            user_has_related_response=Exists(user_owned_response)
-        ).filter(
-            (Q(project__course__in=instructor_courses)) |
-            (Q(project__course__in=user_courses) &
-             Q(project__activity__isnull=False)) |
-            (Q(response__owners__in=[user])) |
-            (Q(response__status__in=[Response.SUBMITTED, Response.REVIEWED]) &
-             Q(response__activity__project__course__in=instructor_courses)) |
-            (Q(response__status__in=[Response.SUBMITTED, Response.REVIEWED]) &
-             Q(user_has_related_response=True) &
-             Q(response__activity__project__course__in=user_courses))
-        )
+        layers = get_layers_for_user(
+            self.request.user, get_course_roles(self.request))
+        if self.action in ('import_events', 'geojson'):
+            # The layer's existing events are read separately, if at all
+            return layers
+        return prefetch_layer_relations(layers)
+
+    @action(detail=True, methods=['get'])
+    def geojson(self, request, pk=None):
+        """Streams the layer's events as a GeoJSON FeatureCollection"""
+        layer = self.get_object()
+        return geojson_response(
+            Layer.objects.filter(pk=layer.pk), 'layer-{}'.format(layer.pk))
+
+    @action(detail=True, methods=['post'], url_path='import',
+            parser_classes=[MultiPartParser])
+    def import_events(self, request, pk=None):
+        """
+        Imports the events in an uploaded GeoJSON or CSV file into the
+        layer. The format is read from the 'format' field, or guessed from
+        the file's extension. Rows that can't be imported are reported in
+        the response rather than failing the import.
+        """
+        layer = self.get_object()
+
+        upload = request.FILES.get('file')
+        if upload is None:
+            raise ValidationError({'file': 'No file was uploaded.'})
+
+        file_format = request.data.get('format') or \
+            detect_format(upload.name)
+        if file_format not in IMPORT_FORMATS:
+            raise ValidationError({
+                'format': 'Format must be one of: {}.'.format(
+                    ', '.join(IMPORT_FORMATS))
+            })
+
+        result = import_layer(layer, upload, file_format, request.user)
+        return APIResponse(result.as_dict(), status=status.HTTP_201_CREATED)
+
+
+class CourseGeoJSONView(APIView):
+    """
+    Streams the events of every layer in a course that the user can see
+    as a GeoJSON FeatureCollection
+    """
+    def get(self, request, pk=None):
+        course = get_object_or_404(Course, pk=pk)
+        roles = get_course_roles(request)
+        if not (roles.is_true_member(course) or
+                roles.is_true_faculty(course)):
+            self.permission_denied(request)
+
+        layers = get_layers_for_user(request.user, roles).filter(
+            Q(project__course=course) |
+            Q(response__activity__project__course=course))
+        return geojson_response(layers, 'course-{}'.format(course.pk))
 
 
 class EventApiView(ModelViewSet):
-    """Retrieves events"""
+    """
+    Retrieves events
+
+    The list can be filtered to events in some layers with
+    layer=<pk>,<pk>, or in a project's layers and its responses' layers
+    with project=<pk>, and by location and time, see EventSpatialFilter
+    and EventTemporalFilter. It is paged when a limit is given.
+    """
     serializer_class = EventSerializer
     queryset = Event.objects.all()
+    filter_backends = [EventSpatialFilter, EventTemporalFilter]
+    pagination_class = EventPagination
+
+    def get_queryset(self):
+        if self.action not in ('list', 'histogram', 'clusters'):
+            return self.queryset
+
+        # The layers are a subquery, so the query (and the clusters'
+        # cache key) doesn't grow with the number of layers
+        events = Event.objects.filter(layer__in=self.get_layers())
+        if self.action in ('histogram', 'clusters'):
+            return events
+        return events.select_related(
+            'location', 'created_by'
+        ).prefetch_related('media').order_by('pk')
+
+    def get_layers(self):
+        """The layers the user can see, limited by the layer or project"""
+        layers = get_layers_for_user(
+            self.request.user, get_course_roles(self.request))
+        params = self.request.query_params
+        if params.get('layer'):
+            try:
+                pks = [int(pk) for pk in params['layer'].split(',')]
+            except ValueError:
+                raise ValidationError(
+                    {'layer': 'Expected comma separated layer ids.'})
+            layers = layers.filter(pk__in=pks)
+        if params.get('project'):
+            try:
+                project = int(params['project'])
+            except ValueError:
+                raise ValidationError({'project': 'Expected a project id.'})
+            layers = layers.filter(
+                Q(project=project) |
+                Q(response__activity__project=project))
+        return layers
+
+    def get_serializer_class(self):
+        if self.action == 'bulk':
+            return BulkEventSerializer
+        return EventSerializer
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Creates a list of events on a single layer in one request. The
+        user's permission to edit the layer is checked once, and the pks
+        of the created events are returned in the order they were posted.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        layer = serializer.validated_data['layer']
+        if not LayerPermission().has_object_permission(request, self, layer):
+            self.permission_denied(request)
+
+        events = serializer.save()
+        return APIResponse(
+            {'pks': [event.pk for event in events]},
+            status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['get'])
+    def histogram(self, request):
+        """
+        Counts the events in each layer by the year, month, day or hour
+        of their datetime, as given by the interval parameter. Takes the
+        same filters as the list. Events without a datetime aren't counted.
+        Buckets without events are left out.
+        """
+        interval = request.query_params.get('interval', 'year')
+        if interval not in HISTOGRAM_INTERVALS:
+            raise ValidationError({
+                'interval': 'Interval must be one of: {}.'.format(
+                    ', '.join(HISTOGRAM_INTERVALS))
+            })
+
+        buckets = self.filter_queryset(self.get_queryset()).filter(
+            datetime__isnull=False
+        ).annotate(
+            bucket=Trunc('datetime', interval, tzinfo=dt_timezone.utc)
+        ).order_by().values('layer', 'bucket').annotate(
+            count=Count('pk')
+        ).order_by('layer', 'bucket')
+
+        layers: Dict[int, Dict[str, Any]] = {}
+        for row in buckets:
+            layer = layers.setdefault(row['layer'], {
+                'layer': row['layer'], 'total': 0, 'buckets': []})
+            layer['total'] += row['count']
+            layer['buckets'].append(
+                {'start': row['bucket'], 'count': row['count']})
+
+        return APIResponse({
+            'interval': interval,
+            'layers': list(layers.values())
+        })
+
+    @action(detail=False, methods=['get'])
+    def clusters(self, request):
+        """
+        Groups the events into clusters for a map at the given zoom, each
+        with a count, centroid, bbox and a few of its events' pks. Takes
+        the same filters as the list.
+        """
+        try:
+            zoom = int(request.query_params.get('zoom', ''))
+        except ValueError:
+            zoom = -1
+        if not 0 <= zoom <= MAX_ZOOM:
+            raise ValidationError({
+                'zoom': 'A zoom from 0 to {} is required.'.format(MAX_ZOOM)})
+
+        events = self.filter_queryset(self.get_queryset())
+        return APIResponse({
+            'zoom': zoom,
+            'clusters': cached_event_clusters(events, zoom)
+        })
 
 
 class ResponseApiView(ModelViewSet):
-    """Retrieves responses"""
+    """
+    Retrieves responses
+
+    The list is paged when a page_size or cursor is given, see
+    KeysetCursorPagination.
+    """
     serializer_class = ResponseSerializer
     permission_classes = [IsResponseOwnerOrFaculty]
+    pagination_class = ResponseCursorPagination
     _lt_model_cls = Response
 
     def get_queryset(self):
+        return prefetch_response_relations(self.filter_responses())
+
+    def filter_responses(self):
         """
         If no querystring param is provided, then return a queryset
         that has the current user as owner
@@ -141,11 +410,12 @@ class ResponseApiView(ModelViewSet):
                 return Response.objects.none()
 
             course = activity.project.course
-            if course.is_true_faculty(user):
+            roles = get_course_roles(self.request)
+            if roles.is_true_faculty(course):
                 return Response.objects.filter(activity=activity)\
                     .exclude(status=Response.DRAFT)
 
-            if course.is_true_member(user):
+            if roles.is_true_member(course):
                 return Response.objects.filter(
                     activity=activity,
                     owners__in=[user]
@@ -162,11 +432,21 @@ class ResponseApiView(ModelViewSet):
 
 
 class FeedbackAPIView(ModelViewSet):
-    """Retrieves feedback"""
+    """
+    Retrieves feedback
+
+    The list is paged when a page_size or cursor is given, see
+    KeysetCursorPagination.
+    """
     serializer_class = FeedbackSerializer
     permission_classes = [IsFeedbackFacultyOrStudentRecipient]
+    pagination_class = FeedbackCursorPagination
 
     def get_queryset(self):
+        return self.filter_feedback().select_related(
+            'created_by', 'modified_by')
+
+    def filter_feedback(self):
         """
         If no querystring param is provided, then return a queryset
         that has the current user as owner
@@ -187,15 +467,16 @@ class FeedbackAPIView(ModelViewSet):
                 return Feedback.objects.none()
 
             course = activity.project.course
-            if course.is_true_faculty(user):
+            roles = get_course_roles(self.request)
+            if roles.is_true_faculty(course):
                 # Return feedback for only that particular activity
                 return Feedback.objects.filter(response__activity=activity)
 
-            if course.is_true_member(user):
+            if roles.is_true_member(course):
                 # Return the feedback for responses owned by the student
                 return Feedback.objects.filter(
                     response__activity=activity,
-                    response__activity__owners__in=[user]
+                    response__owners__in=[user]
                 )
 
             # If a user is not faculty nor a student in the course, then return
@@ -204,3 +485,87 @@ class FeedbackAPIView(ModelViewSet):
         else:
             # Return feedback created by this user
             return Feedback.objects.filter(created_by=user)
+
+
+class AsyncAPIView(View):
+    """
+    A read-only API view that runs on the event loop when served over
+    ASGI, querying with Django's async ORM. It answers like the DRF view
+    it mirrors, with session authentication and JSON errors.
+
+    Serializers read waffle flags and a few related rows, so serializing
+    runs in a thread. Django doesn't wrap async views in ATOMIC_REQUESTS'
+    transaction, which these reads don't need.
+    """
+    http_method_names = ['get']
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        return transaction.non_atomic_requests(super().as_view(**initkwargs))
+
+    async def authenticate(self, request):
+        """
+        Resolves the session user with request.auser(), replacing the
+        lazy request.user, which can't be loaded on the event loop.
+        Returns None for anonymous users.
+        """
+        user = await request.auser()
+        request.user = user
+        return None if user.is_anonymous else user
+
+    def error(self, detail, status_code: int) -> JsonResponse:
+        if not isinstance(detail, dict):
+            detail = {'detail': detail}
+        return JsonResponse(detail, status=status_code, encoder=JSONEncoder)
+
+    async def serialize(self, serializer_class, instance, many=False,
+                        **context) -> JsonResponse:
+        context['request'] = self.request
+
+        def to_representation():
+            return serializer_class(
+                instance, many=many, context=context).data
+
+        data = await sync_to_async(to_representation)()
+        return JsonResponse(data, safe=not many, encoder=JSONEncoder)
+
+
+class AsyncProjectBundleView(AsyncAPIView):
+    """An async variant of ProjectApiView's bundle action"""
+    async def get(self, request, pk=None):
+        user = await self.authenticate(request)
+        if user is None:
+            return self.error(NotAuthenticated.default_detail, 403)
+
+        try:
+            events = EventTemporalFilter().filter_queryset(
+                Request(request), Event.objects.all(), self)
+        except ValidationError as e:
+            return self.error(e.detail, 400)
+
+        roles = await sync_to_async(get_course_roles)(request)
+        projects = prefetch_bundle_relations(
+            get_projects_for_user(user, roles), events)
+        project = await projects.filter(pk=pk).afirst()
+        if project is None:
+            return self.error('No Project matches the given query.', 404)
+
+        return await self.serialize(
+            ProjectBundleSerializer, project, events=events)
+
+
+class AsyncLayerListView(AsyncAPIView):
+    """An async variant of LayerApiView's list"""
+    async def get(self, request):
+        user = await self.authenticate(request)
+        if user is None:
+            return self.error(NotAuthenticated.default_detail, 403)
+
+        roles = await sync_to_async(get_course_roles)(request)
+        # Looking up the layers' content types may query, so the queryset
+        # is built in a thread
+        layers = await sync_to_async(get_layers_for_user)(user, roles)
+        layers = [
+            layer async for layer in prefetch_layer_relations(layers)]
+
+        return await self.serialize(LayerSerializer, layers, many=True)
@@ -40,7 +40,7 @@ INSTALLED_APPS += [  # noqa
 MIDDLEWARE += [ # noqa
     'django.middleware.csrf.CsrfViewMiddleware',
     'django_cas_ng.middleware.CASMiddleware',
-    'lti_tool.middleware.LtiLaunchMiddleware',
+    'locustempus.lti.middleware.LtiLaunchMiddleware',
     'lti_authentication.middleware.LtiLaunchAuthenticationMiddleware',
     'locustempus.main.middleware.WhoDidItMiddleware',
 ]
@@ -77,9 +77,26 @@ REST_FRAMEWORK = {
     )
 }
 
+# Course roles are resolved once per API request. Setting COURSE_ROLE_CACHE
+# to an alias in CACHES also keeps them across requests, invalidated when
+# group memberships change. Use a cache shared by all processes, since
+# invalidation only reaches the cache it is configured with.
+COURSE_ROLE_CACHE = None
+COURSE_ROLE_CACHE_TIMEOUT = 60 * 5
+
+# Event clusters are cached under a key that changes when the clustered
+# events change, so any cache can hold them. Set to None to disable.
+EVENT_CLUSTER_CACHE = 'default'
+EVENT_CLUSTER_CACHE_TIMEOUT = 60 * 60
+
 CONTACT_US_EMAIL = 'ctl-locustempus@columbia.edu'
 SERVER_EMAIL = 'locustempus-noreply@mail.ctl.columbia.edu'
 EMAIL_SUBJECT_PREFIX = 'Locus Tempus Contact Request'
+# Batched email is sent over one connection, EMAIL_CHUNK_SIZE messages
+# per call to the backend, and at most EMAIL_RATE_LIMIT messages a
+# second if the mail server throttles senders
+EMAIL_CHUNK_SIZE = 100
+EMAIL_RATE_LIMIT = None
 
 THUMBNAIL_SUBDIR = "thumbs"
 LOGIN_REDIRECT_URL = "/"
@@ -38,6 +38,15 @@ urlpatterns = [
     path('cas/logout', cas_views.LogoutView.as_view(),
          name='cas_ng_logout'),
 
+    path('tiles/layer/<int:pk>/<int:z>/<int:x>/<int:y>.pbf',
+         views.LayerTileView.as_view(), name='layer-tile'),
+    path('api/course/<int:pk>/geojson/',
+         viewsets.CourseGeoJSONView.as_view(), name='api-course-geojson'),
+    path('api/async/project/<int:pk>/bundle/',
+         viewsets.AsyncProjectBundleView.as_view(),
+         name='api-async-project-bundle'),
+    path('api/async/layer/', viewsets.AsyncLayerListView.as_view(),
+         name='api-async-layer-list'),
     path('api/', include(router.urls)),
     path('accounts/register/',
          RegistrationView.as_view(form_class=CustomRegistrationForm),
@@ -0,0 +1,117 @@
+"""
+Load tests a tile server, reporting the tiles served per second
+
+Requests every tile between --minzoom and --maxzoom, round robin across
+--concurrency threads each with its own keep-alive connection, until
+--requests tiles have been fetched:
+
+    python3 loadtest.py --url http://localhost:8888 --concurrency 16
+"""
+import argparse
+import http.client
+import statistics
+import threading
+import time
+from collections import Counter
+from urllib.parse import urlsplit
+
+
+def tile_paths(minzoom, maxzoom):
+    paths = []
+    for z in range(minzoom, maxzoom + 1):
+        for x in range(1 << z):
+            for y in range(1 << z):
+                paths.append('/{}/{}/{}.pbf'.format(z, x, y))
+    return paths
+
+
+class Worker(threading.Thread):
+    def __init__(self, url, paths, count, gzip):
+        super().__init__(daemon=True)
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.prefix = parts.path.rstrip('/')
+        self.paths = paths
+        self.count = count
+        self.headers = {'Accept-Encoding': 'gzip'} if gzip else {}
+        self.latencies = []
+        self.statuses = Counter()
+        self.bytes = 0
+
+    def run(self):
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        for i in range(self.count):
+            path = self.prefix + self.paths[i % len(self.paths)]
+            start = time.perf_counter()
+            try:
+                conn.request('GET', path, headers=self.headers)
+                response = conn.getresponse()
+                body = response.read()
+            except (OSError, http.client.HTTPException):
+                self.statuses['error'] += 1
+                conn.close()
+                conn = http.client.HTTPConnection(
+                    self.host, self.port, timeout=30)
+                continue
+            self.latencies.append(time.perf_counter() - start)
+            self.statuses[response.status] += 1
+            self.bytes += len(body)
+        conn.close()
+
+
+def percentile(values, pct):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(int(len(values) * pct / 100), len(values) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--url', default='http://localhost:8888')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--minzoom', type=int, default=0)
+    parser.add_argument('--maxzoom', type=int, default=1)
+    parser.add_argument(
+        '--gzip', action='store_true', help='Send Accept-Encoding: gzip')
+    args = parser.parse_args()
+
+    paths = tile_paths(args.minzoom, args.maxzoom)
+    per_worker = max(args.requests // args.concurrency, 1)
+    workers = [
+        # Offset each worker so they don't all request the same tile
+        Worker(args.url, paths[i % len(paths):] + paths[:i % len(paths)],
+               per_worker, args.gzip)
+        for i in range(args.concurrency)
+    ]
+
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = [t for w in workers for t in w.latencies]
+    statuses = sum((w.statuses for w in workers), Counter())
+    total = sum(statuses.values())
+    received = sum(w.bytes for w in workers)
+
+    print('Requests:     {} in {:.2f}s'.format(total, elapsed))
+    print('Tiles/sec:    {:.1f}'.format(len(latencies) / elapsed))
+    print('MB/sec:       {:.2f}'.format(received / elapsed / 1e6))
+    print('Latency (ms): mean {:.2f}, p50 {:.2f}, p95 {:.2f}, '
+          'p99 {:.2f}'.format(
+              statistics.mean(latencies) * 1000 if latencies else 0,
+              percentile(latencies, 50) * 1000,
+              percentile(latencies, 95) * 1000,
+              percentile(latencies, 99) * 1000))
+    print('Statuses:     {}'.format(', '.join(
+        '{}: {}'.format(k, v) for k, v in sorted(
+            statuses.items(), key=lambda item: str(item[0])))))
+
+
+if __name__ == '__main__':
+    main()
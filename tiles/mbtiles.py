@@ -0,0 +1,256 @@
+"""
+Reads tiles from an MBTiles file for the local tile server
+
+A tile lookup goes through three layers:
+
+- An LRU of recently served tiles, bounded by their total size.
+- A sorted (z, x, y) -> rowid index of every tile in the file, so a
+  lookup is a binary search and a fetch by rowid, and a missing tile
+  never touches the database. The index is saved next to the MBTiles
+  file (as <name>.mbtiles.idx) and memory-mapped on the next start, so
+  large tile sets start instantly. Until the index is built, tiles are
+  looked up with a query.
+- A pool of read-only SQLite connections, shared between the server's
+  threads.
+
+See https://github.com/mapbox/mbtiles-spec
+"""
+import array
+import bisect
+import mmap
+import os
+import queue
+import sqlite3
+import struct
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+INDEX_MAGIC = b'LTMBIDX1'
+# magic, MBTiles mtime_ns, MBTiles size, tile count
+INDEX_HEADER = struct.Struct('<8sqqq')
+
+# Tile coordinates are packed into one integer key. MBTiles rows are
+# numbered from the south (TMS), and keys use those rows, so that reading
+# the tiles in (zoom_level, tile_column, tile_row) order produces sorted
+# keys straight from the table's unique index.
+COORD_BITS = 25
+
+
+def tile_key(z, x, row):
+    return (z << (2 * COORD_BITS)) | (x << COORD_BITS) | row
+
+
+def tms_row(z, y):
+    return (1 << z) - 1 - y
+
+
+class TileIndex(object):
+    """Sorted tile keys, and the rowid of each tile's data"""
+    def __init__(self, keys, rowids, buffer=None):
+        self.keys = keys
+        self.rowids = rowids
+        # The mmap backing keys and rowids, if loaded from a file
+        self.buffer = buffer
+
+    def __len__(self):
+        return len(self.keys)
+
+    def get(self, key):
+        i = bisect.bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            return self.rowids[i]
+        return None
+
+    def save(self, path, source_stat):
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(INDEX_HEADER.pack(
+                INDEX_MAGIC, source_stat.st_mtime_ns, source_stat.st_size,
+                len(self.keys)))
+            f.write(self.keys.tobytes())
+            f.write(self.rowids.tobytes())
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, source_stat):
+        """Maps a saved index, or returns None if it is missing or stale"""
+        try:
+            with open(path, 'rb') as f:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+
+        try:
+            magic, mtime_ns, size, count = INDEX_HEADER.unpack_from(buffer)
+        except struct.error:
+            buffer.close()
+            return None
+        expected = INDEX_HEADER.size + 16 * count
+        if magic != INDEX_MAGIC or mtime_ns != source_stat.st_mtime_ns or \
+                size != source_stat.st_size or len(buffer) != expected:
+            buffer.close()
+            return None
+
+        view = memoryview(buffer)
+        start = INDEX_HEADER.size
+        keys = view[start:start + 8 * count].cast('q')
+        rowids = view[start + 8 * count:].cast('q')
+        return cls(keys, rowids, buffer)
+
+
+class LRUCache(object):
+    """A thread-safe LRU of byte strings, bounded by their total size"""
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            value = self.items.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self.lock:
+            old = self.items.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self.items[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, evicted = self.items.popitem(last=False)
+                self.size -= len(evicted)
+
+
+class MBTilesReader(object):
+    def __init__(self, path, pool_size=8, cache_bytes=64 * 1024 * 1024,
+                 build_index=True):
+        self.path = os.path.abspath(path)
+        self.index_path = self.path + '.idx'
+        self.cache = LRUCache(cache_bytes)
+        self.index = None
+
+        self.pool = queue.LifoQueue()
+        for _ in range(pool_size):
+            self.pool.put(self.connect())
+
+        self.data_table = self.find_data_table()
+        if build_index and self.data_table:
+            stat = os.stat(self.path)
+            self.index = TileIndex.load(self.index_path, stat)
+            if self.index is None:
+                threading.Thread(
+                    target=self.build_index, args=(stat,), daemon=True
+                ).start()
+
+    def connect(self):
+        conn = sqlite3.connect(
+            'file:{}?mode=ro'.format(self.path), uri=True,
+            check_same_thread=False)
+        # Read the database's pages through a memory map
+        conn.execute('PRAGMA mmap_size = 268435456')
+        return conn
+
+    @contextmanager
+    def connection(self):
+        conn = self.pool.get()
+        try:
+            yield conn
+        finally:
+            self.pool.put(conn)
+
+    def find_data_table(self):
+        """
+        Returns the table that tile data can be read from by rowid:
+        'images' for the deduplicated map/images schema that tippecanoe and
+        mbutil write, 'tiles' if tiles is a plain table, or None
+        """
+        with self.connection() as conn:
+            tables = dict(conn.execute(
+                'SELECT name, type FROM sqlite_master '
+                'WHERE name IN (?, ?, ?)', ('tiles', 'map', 'images')))
+        if tables.get('map') == 'table' and tables.get('images') == 'table':
+            return 'images'
+        if tables.get('tiles') == 'table':
+            return 'tiles'
+        return None
+
+    def index_query(self):
+        if self.data_table == 'images':
+            return (
+                'SELECT map.zoom_level, map.tile_column, map.tile_row, '
+                'images.rowid FROM map '
+                'JOIN images ON images.tile_id = map.tile_id '
+                'ORDER BY map.zoom_level, map.tile_column, map.tile_row')
+        return (
+            'SELECT zoom_level, tile_column, tile_row, rowid FROM tiles '
+            'ORDER BY zoom_level, tile_column, tile_row')
+
+    def build_index(self, stat):
+        keys = array.array('q')
+        rowids = array.array('q')
+        with self.connection() as conn:
+            for z, x, row, rowid in conn.execute(self.index_query()):
+                keys.append(tile_key(z, x, row))
+                rowids.append(rowid)
+
+        index = TileIndex(keys, rowids)
+        self.index = index
+        try:
+            index.save(self.index_path, stat)
+        except OSError:
+            # The index still works from memory if it can't be saved
+            pass
+
+    def query_tile(self, z, x, y):
+        with self.connection() as conn:
+            row = conn.execute(
+                'SELECT tile_data FROM tiles WHERE zoom_level = ? '
+                'AND tile_column = ? AND tile_row = ?',
+                (z, x, tms_row(z, y))).fetchone()
+        return bytes(row[0]) if row else None
+
+    def read_tile(self, rowid):
+        if self.data_table == 'images':
+            sql = 'SELECT tile_data FROM images WHERE rowid = ?'
+        else:
+            sql = 'SELECT tile_data FROM tiles WHERE rowid = ?'
+        with self.connection() as conn:
+            row = conn.execute(sql, (rowid,)).fetchone()
+        return bytes(row[0]) if row else None
+
+    def get_tile(self, z, x, y):
+        """Returns a tile's data, or None if there's no such tile"""
+        key = tile_key(z, x, tms_row(z, y))
+        data = self.cache.get(key)
+        if data is not None:
+            return data
+
+        index = self.index
+        if index is not None:
+            rowid = index.get(key)
+            data = self.read_tile(rowid) if rowid is not None else None
+        else:
+            data = self.query_tile(z, x, y)
+
+        if data is not None:
+            self.cache.put(key, data)
+        return data
+
+    def get_metadata(self):
+        with self.connection() as conn:
+            return dict(conn.execute('SELECT name, value FROM metadata'))
+
+    def close(self):
+        while not self.pool.empty():
+            self.pool.get().close()
@@ -1,14 +1,270 @@
-import http.server
-import socketserver
+"""
+A local vector tile server for the integration base map
+
+Serves style.json, metadata.json and {z}/{x}/{y}.pbf tiles, either from
+this directory's z/x/y.pbf tree or from a single .mbtiles file (see
+mbtiles.py), and a small JSON index of those at /:
+
+    python3 server.py                           # the directory tree
+    python3 server.py --mbtiles countries.mbtiles
+
+Requests are handled on a thread each, with HTTP/1.1 keep-alive. Tiles
+are sent with an ETag and Cache-Control header, and gzipped tiles (as
+tippecanoe writes to .mbtiles) are sent with Content-Encoding: gzip, or
+decompressed for clients that don't accept gzip.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+import sys
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from mbtiles import MBTilesReader
 
 PORT = 8888
 
+TILE_PATH = re.compile(r'^/(\d+)/(\d+)/(\d+)\.(pbf|mvt)$')
+GZIP_MAGIC = b'\x1f\x8b'
+# Served at /, so that the server answers on its root
+INDEX = {
+    'style': '/style.json',
+    'metadata': '/metadata.json',
+    'tiles': '/{z}/{x}/{y}.pbf',
+}
+
+
+def is_gzipped(data):
+    return data[:2] == GZIP_MAGIC
+
+
+class DirectoryTileSource(object):
+    """Reads tiles from a {z}/{x}/{y}.pbf directory tree"""
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    def get_tile(self, z, x, y):
+        path = os.path.join(self.root, str(z), str(x), '{}.pbf'.format(y))
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def get_metadata(self):
+        return None
+
+
+class TileRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'LocusTempusTiles/1.0'
+    # Headers and body are written separately, don't wait to coalesce them
+    disable_nagle_algorithm = True
+
+    # Set on the handler class by make_server
+    source = None
+    root = '.'
+    max_age = 3600
+
+    def do_GET(self):
+        self.handle_request(send_body=True)
+
+    def do_HEAD(self):
+        self.handle_request(send_body=False)
+
+    def handle_request(self, send_body):
+        path = self.path.split('?', 1)[0]
+        match = TILE_PATH.match(path)
+        if match:
+            z, x, y = [int(v) for v in match.groups()[:3]]
+            if not (0 <= x < (1 << z) and 0 <= y < (1 << z)):
+                return self.send_empty(HTTPStatus.NOT_FOUND)
+            data = self.source.get_tile(z, x, y)
+            if data is None:
+                # An empty tile, rather than an error
+                return self.send_empty(HTTPStatus.NO_CONTENT)
+            return self.send_data(
+                data, 'application/vnd.mapbox-vector-tile', send_body)
+
+        if path == '/':
+            # Lets start-server-and-test and health checks wait on the root
+            data = json.dumps(INDEX).encode('utf-8')
+        elif path == '/style.json':
+            data = self.read_file('style.json')
+        elif path == '/metadata.json':
+            data = self.read_metadata()
+        else:
+            data = None
+
+        if data is None:
+            return self.send_empty(HTTPStatus.NOT_FOUND)
+        return self.send_data(data, 'application/json', send_body)
+
+    def read_file(self, name):
+        try:
+            with open(os.path.join(self.root, name), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def read_metadata(self):
+        data = self.read_file('metadata.json')
+        if data is None:
+            metadata = self.source.get_metadata()
+            if metadata is not None:
+                data = json.dumps(metadata).encode('utf-8')
+        return data
+
+    def accepts_gzip(self):
+        accept = self.headers.get('Accept-Encoding', '')
+        return 'gzip' in [e.split(';')[0].strip() for e in accept.split(',')]
+
+    def send_data(self, data, content_type, send_body):
+        encoding = None
+        if is_gzipped(data):
+            if self.accepts_gzip():
+                encoding = 'gzip'
+            else:
+                data = gzip.decompress(data)
+
+        digest = hashlib.sha1(data, usedforsecurity=False).hexdigest()
+        etag = '"{}"'.format(digest)
+        if etag in self.headers.get('If-None-Match', ''):
+            return self.send_empty(HTTPStatus.NOT_MODIFIED, etag)
+
+        status = HTTPStatus.OK
+        content_range = None
+        byte_range = self.parse_range(len(data))
+        if byte_range is False:
+            self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+            self.send_header('Content-Range', 'bytes */{}'.format(len(data)))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if byte_range:
+            start, end = byte_range
+            content_range = 'bytes {}-{}/{}'.format(start, end, len(data))
+            data = data[start:end + 1]
+            status = HTTPStatus.PARTIAL_CONTENT
+
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        if content_range:
+            self.send_header('Content-Range', content_range)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Vary', 'Accept-Encoding')
+        self.send_cache_headers(etag)
+        self.end_headers()
+        if send_body:
+            self.wfile.write(data)
+
+    def parse_range(self, length):
+        """
+        Returns the (start, end) of a single-range Range header, None if
+        there isn't one, or False if it can't be satisfied
+        """
+        match = re.match(
+            r'^bytes=(\d*)-(\d*)$', self.headers.get('Range', '').strip())
+        if not match or match.groups() == ('', ''):
+            return None
+        start, end = match.groups()
+        if start == '':
+            # The last N bytes
+            start, end = max(length - int(end), 0), length - 1
+        else:
+            start = int(start)
+            end = min(int(end), length - 1) if end else length - 1
+        if start >= length or start > end:
+            return False
+        return (start, end)
+
+    def send_cache_headers(self, etag=None):
+        if etag:
+            self.send_header('ETag', etag)
+        self.send_header(
+            'Cache-Control', 'public, max-age={}'.format(self.max_age))
+
+    def send_empty(self, status, etag=None):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        if status in (HTTPStatus.NOT_MODIFIED, HTTPStatus.NO_CONTENT):
+            self.send_cache_headers(etag)
+        self.end_headers()
 
-class MyHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
     def end_headers(self):
-        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header('Access-Control-Allow-Origin', '*')
         super().end_headers()
 
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+class TileServer(ThreadingHTTPServer):
+    daemon_threads = True
+    quiet = False
+
+    def handle_error(self, request, client_address):
+        # Map clients drop connections to tiles scrolled out of view
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def make_server(host, port, source, root='.', max_age=3600, quiet=False):
+    handler = type('Handler', (TileRequestHandler,), {
+        'source': source,
+        'root': root,
+        'max_age': max_age,
+    })
+    server = TileServer((host, port), handler)
+    server.quiet = quiet
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--host', default='')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument(
+        '--root', default='.',
+        help='Directory with style.json, metadata.json and the z/x/y tree')
+    parser.add_argument(
+        '--mbtiles', help='Serve tiles from this MBTiles file instead')
+    parser.add_argument(
+        '--pool-size', type=int, default=8,
+        help='Read-only connections to the MBTiles file')
+    parser.add_argument(
+        '--cache-mb', type=int, default=64,
+        help='Megabytes of recently served MBTiles tiles to keep in memory')
+    parser.add_argument(
+        '--max-age', type=int, default=3600,
+        help='Seconds clients may cache responses for')
+    parser.add_argument(
+        '--quiet', action='store_true', help="Don't log each request")
+    args = parser.parse_args()
+
+    if args.mbtiles:
+        source = MBTilesReader(
+            args.mbtiles, args.pool_size, args.cache_mb * 1024 * 1024)
+    else:
+        source = DirectoryTileSource(args.root)
+
+    server = make_server(
+        args.host, args.port, source, args.root, args.max_age, args.quiet)
+    print('Serving tiles on port {}'.format(args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
 
-with socketserver.TCPServer(("", PORT), MyHTTPRequestHandler) as httpd:
-    httpd.serve_forever()
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,372 @@
+"""
+Tests for the MBTiles reader, run from this directory:
+
+    python3 -m unittest
+"""
+import array
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+
+from mbtiles import (
+    INDEX_HEADER, INDEX_MAGIC, LRUCache, MBTilesReader, TileIndex, tile_key,
+    tms_row
+)
+
+# (z, x, y) in XYZ, as requested from the server
+TILES = {
+    (0, 0, 0): b'world',
+    (1, 0, 0): b'north west',
+    (1, 1, 1): b'south east',
+    (2, 3, 1): b'ocean',
+    (2, 0, 2): b'ocean',
+}
+
+
+def create_mbtiles(path, tiles, schema='tiles'):
+    """
+    Writes an MBTiles file with a plain tiles table, or with the
+    deduplicated map/images tables and a tiles view
+    """
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE metadata (name text, value text)')
+    conn.execute(
+        "INSERT INTO metadata VALUES ('name', 'test'), ('format', 'pbf')")
+    if schema == 'tiles':
+        conn.execute(
+            'CREATE TABLE tiles (zoom_level integer, tile_column integer, '
+            'tile_row integer, tile_data blob)')
+        conn.execute(
+            'CREATE UNIQUE INDEX tile_index ON tiles '
+            '(zoom_level, tile_column, tile_row)')
+        add_tiles(conn, tiles)
+    else:
+        conn.execute(
+            'CREATE TABLE map (zoom_level integer, tile_column integer, '
+            'tile_row integer, tile_id text)')
+        conn.execute(
+            'CREATE UNIQUE INDEX map_index ON map '
+            '(zoom_level, tile_column, tile_row)')
+        conn.execute('CREATE TABLE images (tile_data blob, tile_id text)')
+        conn.execute(
+            'CREATE VIEW tiles AS SELECT map.zoom_level AS zoom_level, '
+            'map.tile_column AS tile_column, map.tile_row AS tile_row, '
+            'images.tile_data AS tile_data FROM map '
+            'JOIN images ON images.tile_id = map.tile_id')
+        add_tiles(conn, tiles, deduplicate=True)
+    conn.commit()
+    conn.close()
+
+
+def add_tiles(conn, tiles, deduplicate=False):
+    for (z, x, y), data in tiles.items():
+        row = (z, x, tms_row(z, y))
+        if not deduplicate:
+            conn.execute(
+                'INSERT INTO tiles VALUES (?, ?, ?, ?)', row + (data,))
+            continue
+        # Tiles with the same data share an image
+        tile_id = data.decode('utf-8')
+        conn.execute('INSERT INTO map VALUES (?, ?, ?, ?)', row + (tile_id,))
+        if not conn.execute(
+                'SELECT 1 FROM images WHERE tile_id = ?',
+                (tile_id,)).fetchone():
+            conn.execute('INSERT INTO images VALUES (?, ?)', (data, tile_id))
+
+
+class TileKeyTest(unittest.TestCase):
+    def test_tms_row(self):
+        self.assertEqual(tms_row(0, 0), 0)
+        self.assertEqual(tms_row(1, 0), 1)
+        self.assertEqual(tms_row(2, 1), 2)
+
+    def test_tile_key(self):
+        # Keys sort in (z, x, row) order
+        coords = [(0, 0, 0), (1, 0, 1), (1, 1, 0), (2, 0, 3), (2, 3, 0),
+                  (24, 2 ** 24 - 1, 2 ** 24 - 1)]
+        keys = [tile_key(*c) for c in coords]
+        self.assertEqual(keys, sorted(keys))
+        self.assertEqual(len(set(keys)), len(keys))
+
+
+class LRUCacheTest(unittest.TestCase):
+    def test_eviction_order(self):
+        cache = LRUCache(10)
+        cache.put('a', b'aaa')
+        cache.put('b', b'bbb')
+        cache.put('c', b'ccc')
+        # Reading a makes b the least recently used
+        self.assertEqual(cache.get('a'), b'aaa')
+
+        cache.put('d', b'ddd')
+        self.assertEqual(list(cache.items), ['c', 'a', 'd'])
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.size, 9)
+
+        # A large value evicts as many as it needs to
+        cache.put('e', b'eeeeeee')
+        self.assertEqual(list(cache.items), ['d', 'e'])
+        self.assertEqual(cache.size, 10)
+
+    def test_replace(self):
+        cache = LRUCache(10)
+        cache.put('a', b'aaaa')
+        cache.put('b', b'bbbb')
+        cache.put('a', b'AA')
+        self.assertEqual(cache.size, 6)
+        self.assertEqual(list(cache.items), ['b', 'a'])
+        self.assertEqual(cache.get('a'), b'AA')
+
+    def test_too_large(self):
+        cache = LRUCache(4)
+        cache.put('a', b'aaaa')
+        cache.put('b', b'bbbbb')
+        self.assertEqual(list(cache.items), ['a'])
+        self.assertEqual(cache.size, 4)
+
+    def test_stats(self):
+        cache = LRUCache(10)
+        cache.put('a', b'a')
+        cache.get('a')
+        cache.get('a')
+        cache.get('b')
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+
+class TempDirMixin(object):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+
+class TileIndexTest(TempDirMixin, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(self.dir, 'test.mbtiles.idx')
+        self.stat = SimpleNamespace(st_mtime_ns=1234, st_size=5678)
+        self.index = TileIndex(
+            array.array('q', [3, 5, 9]), array.array('q', [30, 50, 90]))
+
+    def test_get(self):
+        self.assertEqual(len(self.index), 3)
+        self.assertEqual(self.index.get(5), 50)
+        self.assertEqual(self.index.get(9), 90)
+        for key in [0, 4, 10]:
+            self.assertIsNone(self.index.get(key))
+
+    def test_save(self):
+        self.index.save(self.path, self.stat)
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        self.assertEqual(
+            INDEX_HEADER.unpack_from(data), (INDEX_MAGIC, 1234, 5678, 3))
+        self.assertEqual(len(data), INDEX_HEADER.size + 16 * 3)
+        # No temporary file is left behind
+        self.assertEqual(os.listdir(self.dir), ['test.mbtiles.idx'])
+
+    def test_load(self):
+        self.index.save(self.path, self.stat)
+        index = TileIndex.load(self.path, self.stat)
+        self.addCleanup(index.buffer.close)
+        self.assertEqual(len(index), 3)
+        self.assertEqual(list(index.keys), [3, 5, 9])
+        self.assertEqual(index.get(5), 50)
+        self.assertIsNone(index.get(4))
+
+    def test_load_stale(self):
+        self.index.save(self.path, self.stat)
+        for stat in [SimpleNamespace(st_mtime_ns=1235, st_size=5678),
+                     SimpleNamespace(st_mtime_ns=1234, st_size=5679)]:
+            self.assertIsNone(TileIndex.load(self.path, stat))
+
+    def test_load_invalid(self):
+        self.assertIsNone(TileIndex.load(self.path, self.stat))
+
+        # An empty file can't be mapped
+        open(self.path, 'wb').close()
+        self.assertIsNone(TileIndex.load(self.path, self.stat))
+
+        self.index.save(self.path, self.stat)
+        with open(self.path, 'rb') as f:
+            data = f.read()
+
+        for invalid in [
+                data[:INDEX_HEADER.size - 1],
+                data[:-8],
+                data + b'\0' * 8,
+                b'NOTANIDX' + data[8:]]:
+            with open(self.path, 'wb') as f:
+                f.write(invalid)
+            self.assertIsNone(TileIndex.load(self.path, self.stat))
+
+
+class MBTilesReaderTestMixin(TempDirMixin):
+    schema = 'tiles'
+    data_table = 'tiles'
+
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(self.dir, 'test.mbtiles')
+        create_mbtiles(self.path, TILES, self.schema)
+
+    def reader(self, **kwargs):
+        reader = MBTilesReader(self.path, **kwargs)
+        self.addCleanup(reader.close)
+        return reader
+
+    def wait_for_index(self, reader):
+        """Waits for the reader to build its index and save it"""
+        deadline = time.monotonic() + 5
+        while True:
+            if reader.index is not None and TileIndex.load(
+                    reader.index_path, os.stat(self.path)) is not None:
+                return reader.index
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+
+    def assert_tiles(self, reader):
+        for (z, x, y), data in TILES.items():
+            self.assertEqual(reader.get_tile(z, x, y), data, (z, x, y))
+        # XYZ rows are flipped to TMS rows, so these are missing
+        self.assertIsNone(reader.get_tile(1, 0, 1))
+        self.assertIsNone(reader.get_tile(1, 1, 0))
+        self.assertIsNone(reader.get_tile(5, 0, 0))
+
+    def test_data_table(self):
+        self.assertEqual(
+            self.reader(build_index=False).data_table, self.data_table)
+
+    def test_query_fallback(self):
+        """Until the index is built, tiles are read with a query"""
+        reader = self.reader(build_index=False)
+        self.assertIsNone(reader.index)
+        self.assert_tiles(reader)
+        self.assertFalse(os.path.exists(reader.index_path))
+
+    def test_index(self):
+        reader = self.reader()
+        index = self.wait_for_index(reader)
+        self.assertEqual(len(index), len(TILES))
+        self.assertIsNone(index.buffer)
+        self.assert_tiles(reader)
+
+        # The next reader maps the saved index
+        reader = self.reader()
+        self.assertIsNotNone(reader.index.buffer)
+        self.assertEqual(len(reader.index), len(TILES))
+        self.assert_tiles(reader)
+
+    def test_stale_index(self):
+        self.wait_for_index(self.reader())
+
+        conn = sqlite3.connect(self.path)
+        add_tiles(conn, {(3, 1, 1): b'new'}, self.schema != 'tiles')
+        conn.commit()
+        conn.close()
+        stat = os.stat(self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+        # The saved index no longer matches the file, and is rebuilt
+        self.assertIsNone(
+            TileIndex.load(self.path + '.idx', os.stat(self.path)))
+        reader = self.reader()
+        index = self.wait_for_index(reader)
+        self.assertIsNone(index.buffer)
+        self.assertEqual(len(index), len(TILES) + 1)
+        self.assertEqual(reader.get_tile(3, 1, 1), b'new')
+
+        reader = self.reader()
+        self.assertIsNotNone(reader.index.buffer)
+        self.assertEqual(len(reader.index), len(TILES) + 1)
+
+    def test_cache(self):
+        reader = self.reader(build_index=False, cache_bytes=8)
+        self.assertEqual(reader.get_tile(0, 0, 0), b'world')
+        self.assertEqual(reader.get_tile(0, 0, 0), b'world')
+        self.assertEqual(reader.cache.hits, 1)
+        # Tiles larger than the cache are still served
+        self.assertEqual(reader.get_tile(1, 0, 0), b'north west')
+        self.assertEqual(list(reader.cache.items), [tile_key(0, 0, 0)])
+
+    def test_metadata(self):
+        self.assertEqual(
+            self.reader(build_index=False).get_metadata(),
+            {'name': 'test', 'format': 'pbf'})
+
+    def test_pool(self):
+        reader = self.reader(pool_size=2, build_index=False)
+        self.assertEqual(reader.pool.qsize(), 2)
+
+        with reader.connection() as conn:
+            self.assertEqual(reader.pool.qsize(), 1)
+            # Connections are read-only
+            with self.assertRaises(sqlite3.OperationalError):
+                conn.execute('DELETE FROM metadata')
+
+        # Connections go back to the pool after an error
+        with self.assertRaises(ValueError):
+            with reader.connection():
+                raise ValueError
+        self.assertEqual(reader.pool.qsize(), 2)
+
+        # More threads than connections wait for one
+        errors = []
+
+        def read():
+            try:
+                for _ in range(20):
+                    self.assertEqual(reader.query_tile(0, 0, 0), b'world')
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=read) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(reader.pool.qsize(), 2)
+
+        reader.close()
+        self.assertEqual(reader.pool.qsize(), 0)
+
+
+class PlainMBTilesReaderTest(MBTilesReaderTestMixin, unittest.TestCase):
+    pass
+
+
+class DeduplicatedMBTilesReaderTest(MBTilesReaderTestMixin, unittest.TestCase):
+    schema = 'map'
+    data_table = 'images'
+
+    def test_shared_images(self):
+        conn = sqlite3.connect(self.path)
+        self.assertEqual(
+            conn.execute('SELECT COUNT(*) FROM images').fetchone()[0],
+            len(set(TILES.values())))
+        conn.close()
+
+        reader = self.reader()
+        self.wait_for_index(reader)
+        self.assertEqual(reader.get_tile(2, 3, 1), b'ocean')
+        self.assertEqual(reader.get_tile(2, 0, 2), b'ocean')
+
+
+class NoTilesTest(TempDirMixin, unittest.TestCase):
+    def test_no_tiles_table(self):
+        path = os.path.join(self.dir, 'empty.mbtiles')
+        sqlite3.connect(path).close()
+        reader = MBTilesReader(path)
+        self.addCleanup(reader.close)
+        self.assertIsNone(reader.data_table)
+        self.assertIsNone(reader.index)
+        self.assertFalse(os.path.exists(reader.index_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
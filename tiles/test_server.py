@@ -0,0 +1,206 @@
+"""
+Tests for the tile server, run from this directory:
+
+    python3 -m unittest
+"""
+import gzip
+import http.client
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from server import DirectoryTileSource, make_server
+
+TILE = b'\x1a\x10tile data, z0x0y0'
+GZIPPED_TILE = b'\x1a\x10tile data, z1x0y1'
+
+
+class TileServerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.root = tempfile.mkdtemp()
+        cls.write('0/0/0.pbf', TILE)
+        cls.write('1/0/1.pbf', gzip.compress(GZIPPED_TILE))
+        cls.write('style.json', b'{"version": 8}')
+
+        cls.server = make_server(
+            '127.0.0.1', 0, DirectoryTileSource(cls.root), cls.root,
+            max_age=60, quiet=True)
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        cls.thread.join()
+        shutil.rmtree(cls.root)
+
+    @classmethod
+    def write(cls, name, data):
+        path = os.path.join(cls.root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def request(self, path, method='GET', **headers):
+        conn = http.client.HTTPConnection(
+            '127.0.0.1', self.server.server_address[1], timeout=5)
+        self.addCleanup(conn.close)
+        conn.request(method, path, headers=headers)
+        r = conn.getresponse()
+        return r, r.read()
+
+    def test_tile(self):
+        r, body = self.request('/0/0/0.pbf')
+        self.assertEqual(r.status, 200)
+        self.assertEqual(body, TILE)
+        self.assertEqual(
+            r.getheader('Content-Type'), 'application/vnd.mapbox-vector-tile')
+        self.assertEqual(r.getheader('Content-Length'), str(len(TILE)))
+        self.assertEqual(r.getheader('Cache-Control'), 'public, max-age=60')
+        self.assertEqual(r.getheader('Accept-Ranges'), 'bytes')
+        self.assertEqual(r.getheader('Vary'), 'Accept-Encoding')
+        self.assertEqual(r.getheader('Access-Control-Allow-Origin'), '*')
+        self.assertIsNone(r.getheader('Content-Encoding'))
+        self.assertTrue(r.getheader('ETag'))
+
+        # Query strings are ignored, and .mvt is the same tile
+        r, body = self.request('/0/0/0.mvt?v=1')
+        self.assertEqual(r.status, 200)
+        self.assertEqual(body, TILE)
+
+    def test_keep_alive(self):
+        conn = http.client.HTTPConnection(
+            '127.0.0.1', self.server.server_address[1], timeout=5)
+        self.addCleanup(conn.close)
+        for _ in range(3):
+            conn.request('GET', '/0/0/0.pbf')
+            r = conn.getresponse()
+            self.assertEqual(r.read(), TILE)
+            self.assertFalse(r.will_close)
+
+    def test_etag(self):
+        r, _ = self.request('/0/0/0.pbf')
+        etag = r.getheader('ETag')
+
+        r, body = self.request('/0/0/0.pbf', **{'If-None-Match': etag})
+        self.assertEqual(r.status, 304)
+        self.assertEqual(body, b'')
+        self.assertEqual(r.getheader('ETag'), etag)
+        self.assertEqual(r.getheader('Cache-Control'), 'public, max-age=60')
+        self.assertEqual(r.getheader('Content-Length'), '0')
+
+        # One of several ETags
+        r, _ = self.request(
+            '/0/0/0.pbf', **{'If-None-Match': '"other", ' + etag})
+        self.assertEqual(r.status, 304)
+
+        r, body = self.request('/0/0/0.pbf', **{'If-None-Match': '"other"'})
+        self.assertEqual(r.status, 200)
+        self.assertEqual(body, TILE)
+
+    def test_gzip(self):
+        r, body = self.request(
+            '/1/0/1.pbf', **{'Accept-Encoding': 'br, gzip;q=0.8'})
+        self.assertEqual(r.status, 200)
+        self.assertEqual(r.getheader('Content-Encoding'), 'gzip')
+        self.assertEqual(r.getheader('Content-Length'), str(len(body)))
+        self.assertEqual(gzip.decompress(body), GZIPPED_TILE)
+        gzip_etag = r.getheader('ETag')
+
+        # Decompressed for clients that don't accept gzip
+        for accept in ['', 'identity', 'x-gzip']:
+            r, body = self.request('/1/0/1.pbf', **{'Accept-Encoding': accept})
+            self.assertEqual(r.status, 200)
+            self.assertIsNone(r.getheader('Content-Encoding'))
+            self.assertEqual(body, GZIPPED_TILE)
+            self.assertNotEqual(r.getheader('ETag'), gzip_etag)
+
+    def test_range(self):
+        length = len(TILE)
+        for header, start, end in [
+                ('bytes=0-3', 0, 3),
+                ('bytes=4-', 4, length - 1),
+                ('bytes=-5', length - 5, length - 1),
+                ('bytes=2-1000', 2, length - 1),
+                ('bytes=-1000', 0, length - 1)]:
+            r, body = self.request('/0/0/0.pbf', Range=header)
+            self.assertEqual(r.status, 206, header)
+            self.assertEqual(body, TILE[start:end + 1], header)
+            self.assertEqual(
+                r.getheader('Content-Range'),
+                'bytes {}-{}/{}'.format(start, end, length), header)
+            self.assertEqual(
+                r.getheader('Content-Length'), str(end - start + 1), header)
+
+        for header in ['bytes={}-'.format(length), 'bytes=5-4']:
+            r, body = self.request('/0/0/0.pbf', Range=header)
+            self.assertEqual(r.status, 416, header)
+            self.assertEqual(body, b'')
+            self.assertEqual(
+                r.getheader('Content-Range'), 'bytes */{}'.format(length))
+
+        # Multiple and malformed ranges get the whole tile
+        for header in ['bytes=0-1,3-4', 'bytes=-', 'lines=0-1']:
+            r, body = self.request('/0/0/0.pbf', Range=header)
+            self.assertEqual(r.status, 200, header)
+            self.assertEqual(body, TILE)
+
+    def test_missing_tile(self):
+        r, body = self.request('/1/1/1.pbf')
+        self.assertEqual(r.status, 204)
+        self.assertEqual(body, b'')
+        self.assertEqual(r.getheader('Cache-Control'), 'public, max-age=60')
+
+    def test_not_found(self):
+        for path in [
+                # Outside the tile grid
+                '/0/1/0.pbf', '/0/0/1.pbf', '/1/2/0.pbf', '/1/0/2.pbf',
+                # Not a tile
+                '/0/0/0.png', '/0/0/-1.pbf', '/missing.json', '/index',
+                # Outside the root
+                '/../server.py', '/%2e%2e/server.py',
+                '/0/0/../../style.json', '/style.json/../server.py',
+                '/0/0/..%2f..%2fstyle.json']:
+            r, body = self.request(path)
+            self.assertEqual(r.status, 404, path)
+            self.assertEqual(body, b'')
+
+    def test_head(self):
+        r, body = self.request('/0/0/0.pbf', method='HEAD')
+        self.assertEqual(r.status, 200)
+        self.assertEqual(body, b'')
+        self.assertEqual(r.getheader('Content-Length'), str(len(TILE)))
+        self.assertTrue(r.getheader('ETag'))
+
+        r, body = self.request('/1/1/1.pbf', method='HEAD')
+        self.assertEqual(r.status, 204)
+
+    def test_root(self):
+        """The root answers, for start-server-and-test in package.json"""
+        r, body = self.request('/')
+        self.assertEqual(r.status, 200)
+        self.assertEqual(r.getheader('Content-Type'), 'application/json')
+        self.assertEqual(json.loads(body)['style'], '/style.json')
+
+        r, body = self.request('/', method='HEAD')
+        self.assertEqual(r.status, 200)
+        self.assertEqual(body, b'')
+
+    def test_json(self):
+        r, body = self.request('/style.json')
+        self.assertEqual(r.status, 200)
+        self.assertEqual(r.getheader('Content-Type'), 'application/json')
+        self.assertEqual(body, b'{"version": 8}')
+
+        # The directory tree has no metadata to fall back on
+        r, body = self.request('/metadata.json')
+        self.assertEqual(r.status, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()